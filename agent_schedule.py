@@ -0,0 +1,52 @@
+import math
+import time
+import hashlib
+
+
+def host_phase(hostname, probe):
+    """Deterministic fraction in [0, 1) used to stagger a probe across the fleet"""
+    digest = hashlib.sha256(f'{hostname}:{probe}'.encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) / 2 ** 32
+
+
+class CollectionSchedule:
+    """Monotonic-clock schedule with an independent interval per probe.
+
+    Each probe first comes due at a host-specific offset within its
+    interval, so agents started together do not all run their speed test
+    at the same moment. Later due times advance from the previous due time
+    rather than from when collection finished, so slow cycles do not make
+    samples drift. Runs missed while the agent was busy are skipped, not
+    replayed. Intervals are multiplied by the current backoff factor.
+    """
+
+    def __init__(self, intervals, hostname, clock=time.monotonic):
+        self.intervals = intervals
+        self.clock = clock
+        self.backoff = 1.0
+        start = clock()
+        self.next_due = {
+            probe: start + host_phase(hostname, probe) * interval
+            for probe, interval in intervals.items()
+        }
+
+    def due(self):
+        """Probes whose due time has passed"""
+        now = self.clock()
+        return [probe for probe, due in self.next_due.items() if due <= now]
+
+    def mark_run(self, probe):
+        """Advance a probe to its next slot after it ran"""
+        interval = self.intervals[probe] * self.backoff
+        due = self.next_due[probe] + interval
+        now = self.clock()
+        if due <= now:
+            due += (math.floor((now - due) / interval) + 1) * interval
+        self.next_due[probe] = due
+
+    def next_wakeup(self):
+        """Seconds until the next probe comes due"""
+        return max(0.0, min(self.next_due.values()) - self.clock())
+
+    def set_backoff(self, factor):
+        self.backoff = max(1.0, factor)
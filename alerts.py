@@ -0,0 +1,332 @@
+import os
+import json
+import queue
+import logging
+import operator
+import threading
+import requests
+from datetime import datetime
+
+# Rules used when ALERT_RULES_FILE is not set
+DEFAULT_RULES = [
+    {'name': 'high-latency', 'type': 'threshold', 'metric': 'latency', 'op': '>', 'value': 150, 'for': 3},
+    {'name': 'slow-dns', 'type': 'threshold', 'metric': 'dns_resolution_time', 'op': '>', 'value': 500, 'for': 3},
+    {'name': 'slow-download', 'type': 'threshold', 'metric': 'download_speed', 'op': '<', 'value': 5},
+    {'name': 'latency-spike', 'type': 'rate', 'metric': 'latency', 'op': '>', 'value': 20, 'smoothing': 0.5},
+    {'name': 'device-offline', 'type': 'heartbeat', 'after': 900}
+]
+
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le
+}
+
+RULE_TYPES = ('threshold', 'rate', 'heartbeat')
+
+# Notifications waiting for delivery; more are dropped with a warning
+MAX_PENDING = 1000
+
+
+class Rule:
+    """A declarative alert rule.
+
+    threshold fires when a metric compares true against value for 'for'
+    consecutive samples. rate fires when the metric's per-minute rate of
+    change between samples (optionally smoothed by an EWMA with factor
+    'smoothing') compares true against value. heartbeat fires when a device
+    has not reported for 'after' seconds.
+    """
+
+    def __init__(self, name, type, metric=None, op='>', value=None, after=None, severity='warning', smoothing=1.0, **options):
+        if type not in RULE_TYPES:
+            raise ValueError(f"Rule {name}: type must be one of {', '.join(RULE_TYPES)}")
+        if type != 'heartbeat' and (metric is None or value is None or op not in OPERATORS):
+            raise ValueError(f"Rule {name}: metric, value and an op of {', '.join(OPERATORS)} are required")
+        if type == 'heartbeat' and not after:
+            raise ValueError(f'Rule {name}: after is required')
+        if not 0 < smoothing <= 1:
+            raise ValueError(f'Rule {name}: smoothing must be in (0, 1]')
+        self.name = name
+        self.type = type
+        self.metric = metric
+        self.op = op
+        self.value = value
+        self.after = after
+        self.severity = severity
+        self.smoothing = smoothing
+        self.consecutive = max(int(options.get('for', 1)), 1)
+        self.compare = OPERATORS[op]
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'type': self.type,
+            'metric': self.metric,
+            'op': self.op,
+            'value': self.value,
+            'after': self.after,
+            'severity': self.severity,
+            'smoothing': self.smoothing,
+            'for': self.consecutive
+        }
+
+
+def load_rules(path=None):
+    """Rules from a JSON file containing a list of rule objects, or the defaults"""
+    if path:
+        with open(path) as f:
+            specs = json.load(f)
+    else:
+        specs = DEFAULT_RULES
+    return [Rule(**spec) for spec in specs]
+
+
+class RuleState:
+    """Rolling state of one rule for one device; constant size"""
+
+    __slots__ = ('breaches', 'firing', 'since', 'notified_at', 'last_value', 'last_time', 'smoothed')
+
+    def __init__(self):
+        self.breaches = 0
+        self.firing = False
+        self.since = None
+        self.notified_at = None
+        self.last_value = None
+        self.last_time = None
+        self.smoothed = None
+
+
+class LogSink:
+    def send(self, alert):
+        log = logging.warning if alert['state'] == 'firing' else logging.info
+        log(f"Alert {alert['rule']} {alert['state']} for device {alert['device_id']}: {alert['message']}")
+
+
+class FileSink:
+    """Appends each notification to a file as one JSON line"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, alert):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(alert, separators=(',', ':')) + '\n')
+
+
+class WebhookSink:
+    """POSTs each notification as JSON to a URL"""
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, alert):
+        self.session.post(self.url, json=alert, timeout=self.timeout).raise_for_status()
+
+
+class CallbackSink:
+    """Hands each notification to a function, e.g. to publish it in-process"""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def send(self, alert):
+        self.callback(alert)
+
+
+def create_sinks(spec):
+    """Sinks from a comma-separated list such as 'log,file:alerts.jsonl,webhook:https://...'"""
+    sinks = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        kind, _, target = item.partition(':')
+        if kind == 'log':
+            sinks.append(LogSink())
+        elif kind == 'file' and target:
+            sinks.append(FileSink(target))
+        elif kind == 'webhook' and target:
+            sinks.append(WebhookSink(target))
+        else:
+            raise ValueError(f'Unknown alert sink: {item}')
+    return sinks
+
+
+class AlertEngine:
+    """Evaluates rules incrementally as samples arrive.
+
+    Every (rule, device) pair keeps a RuleState, so each sample costs O(1)
+    per matching rule and no history is queried. Notifications are only
+    sent when an alert starts firing or resolves, plus a reminder every
+    repeat_after seconds while it keeps firing. Delivery runs on a
+    background thread so slow sinks never hold up ingestion; a failing sink
+    is logged and does not affect the others.
+    """
+
+    def __init__(self, rules, sinks, repeat_after=3600):
+        self.rules = rules
+        self.sinks = list(sinks)
+        self.repeat_after = repeat_after
+        self.metric_rules = [rule for rule in rules if rule.type != 'heartbeat']
+        self.heartbeat_rules = [rule for rule in rules if rule.type == 'heartbeat']
+        self.states = {}
+        self.lock = threading.Lock()
+        self.pending = queue.Queue(maxsize=MAX_PENDING)
+        self.evaluated = 0
+        self.notifications = 0
+        self.dropped = 0
+        self.failures = 0
+        self.thread = None
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def _state(self, rule, device_id):
+        key = (rule.name, device_id)
+        state = self.states.get(key)
+        if state is None:
+            state = self.states[key] = RuleState()
+        return state
+
+    def evaluate(self, rows):
+        """Feed newly stored samples (dicts with device_id, timestamp and metrics).
+
+        Samples are judged at their own timestamp, so a spooled backlog fires
+        and repeats alerts as it would have live. A sample no newer than the
+        last one a rule saw for the device is skipped.
+        """
+        with self.lock:
+            for row in sorted(rows, key=lambda r: r['timestamp']):
+                device_id = row['device_id']
+                timestamp = row['timestamp']
+                for rule in self.metric_rules:
+                    value = row.get(rule.metric)
+                    if value is None:
+                        continue
+                    state = self._state(rule, device_id)
+                    if state.last_time is not None and timestamp <= state.last_time:
+                        continue
+                    self.evaluated += 1
+                    if rule.type == 'threshold':
+                        observed = value
+                        breached = rule.compare(value, rule.value)
+                        state.breaches = state.breaches + 1 if breached else 0
+                        breached = state.breaches >= rule.consecutive
+                        state.last_time = timestamp
+                    else:
+                        state.smoothed = value if state.smoothed is None else (
+                            rule.smoothing * value + (1 - rule.smoothing) * state.smoothed
+                        )
+                        previous, previous_time = state.last_value, state.last_time
+                        state.last_value, state.last_time = state.smoothed, timestamp
+                        if previous_time is None:
+                            continue
+                        minutes = (timestamp - previous_time).total_seconds() / 60
+                        observed = round((state.smoothed - previous) / minutes, 3)
+                        breached = rule.compare(observed, rule.value)
+                    message = f"{rule.metric} {'rate ' if rule.type == 'rate' else ''}{observed}"
+                    if breached:
+                        message += f' {rule.op} {rule.value}'
+                    self._update(rule, device_id, breached, observed, timestamp, message, timestamp)
+
+    def check_heartbeats(self, last_seen, now=None):
+        """Fire or resolve heartbeat rules given each device's last report time.
+
+        Heartbeats resolve here rather than at ingest, because the server's
+        own probe stores samples for devices that are not reporting.
+        """
+        now = now or datetime.utcnow()
+        with self.lock:
+            for rule in self.heartbeat_rules:
+                for device_id, seen in last_seen.items():
+                    silent = int((now - seen).total_seconds()) if seen else None
+                    stale = silent is None or silent >= rule.after
+                    message = f'No report for {silent}s' if silent is not None else 'Never reported'
+                    if stale or (rule.name, device_id) in self.states:
+                        self._update(rule, device_id, stale, silent, now, message, now)
+
+    def forget(self, device_id):
+        """Drop all state of a deleted device without notifying"""
+        with self.lock:
+            for rule in self.rules:
+                self.states.pop((rule.name, device_id), None)
+
+    def _update(self, rule, device_id, breached, observed, timestamp, message, now=None):
+        state = self.states.get((rule.name, device_id)) if not breached else self._state(rule, device_id)
+        if state is None:
+            return
+        now = now or datetime.utcnow()
+        if breached and not state.firing:
+            state.firing, state.since, state.notified_at = True, timestamp, now
+            self._notify(rule, device_id, 'firing', observed, timestamp, message)
+        elif breached and (now - state.notified_at).total_seconds() >= self.repeat_after:
+            state.notified_at = now
+            self._notify(rule, device_id, 'firing', observed, timestamp, message)
+        elif not breached and state.firing:
+            state.firing, state.since = False, None
+            self._notify(rule, device_id, 'resolved', observed, timestamp, message)
+
+    def _notify(self, rule, device_id, state, observed, timestamp, message):
+        alert = {
+            'rule': rule.name,
+            'type': rule.type,
+            'severity': rule.severity,
+            'device_id': device_id,
+            'state': state,
+            'value': observed,
+            'message': message,
+            'timestamp': timestamp.isoformat()
+        }
+        # Started on first use, so a process forked after import gets its own
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._deliver, name='alerts', daemon=True)
+            self.thread.start()
+        try:
+            self.pending.put_nowait(alert)
+            self.notifications += 1
+        except queue.Full:
+            self.dropped += 1
+            logging.warning(f"Alert queue full, dropped {rule.name} for device {device_id}")
+
+    def _deliver(self):
+        while True:
+            alert = self.pending.get()
+            for sink in list(self.sinks):
+                try:
+                    sink.send(alert)
+                except Exception as e:
+                    self.failures += 1
+                    logging.error(f"Alert sink {type(sink).__name__} failed: {str(e)}")
+            self.pending.task_done()
+
+    def active(self):
+        """Alerts currently firing"""
+        with self.lock:
+            return [
+                {'rule': rule, 'device_id': device_id, 'since': state.since.isoformat()}
+                for (rule, device_id), state in self.states.items() if state.firing
+            ]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'rules': [rule.to_dict() for rule in self.rules],
+                'sinks': [type(sink).__name__ for sink in self.sinks],
+                'tracked': len(self.states),
+                'firing': sum(1 for state in self.states.values() if state.firing),
+                'evaluated': self.evaluated,
+                'notifications': self.notifications,
+                'pending': self.pending.qsize(),
+                'dropped': self.dropped,
+                'failures': self.failures
+            }
+
+
+def create_engine_from_env():
+    """Alert engine configured by ALERT_RULES_FILE, ALERT_SINKS and ALERT_REPEAT_AFTER"""
+    return AlertEngine(
+        load_rules(os.getenv('ALERT_RULES_FILE')),
+        create_sinks(os.getenv('ALERT_SINKS', 'log')),
+        repeat_after=int(os.getenv('ALERT_REPEAT_AFTER', '3600'))
+    )
@@ -0,0 +1,281 @@
+import math
+import numpy as np
+from datetime import timedelta
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import storage
+from models import Device, MetricsRollup
+from rollups import HISTOGRAM_GROWTH
+
+# Highest histogram bin; with 5% bins this covers values up to about 2e6
+MAX_BIN = 300
+
+# Robust z-score above which a device is reported as an outlier
+OUTLIER_Z = 3.5
+
+# Scales a median absolute deviation to a standard deviation of normal data
+MAD_SCALE = 0.6745
+
+
+class Samples:
+    """One metric column of many devices, ordered by device and then time.
+
+    codes maps every sample to its position in device_ids, starts holds the
+    offset of each device's first sample, and values holds NaN where the
+    probe produced no reading.
+    """
+
+    def __init__(self, device_ids, codes, starts, values):
+        self.device_ids = device_ids
+        self.codes = codes
+        self.starts = starts
+        self.values = values
+
+    @classmethod
+    def from_arrays(cls, device_column, values):
+        """Build from per-sample device ids that are already sorted"""
+        device_column = np.asarray(device_column, dtype=np.int64)
+        first = np.ones(len(device_column), dtype=bool)
+        first[1:] = device_column[1:] != device_column[:-1]
+        codes = np.cumsum(first) - 1
+        return cls(device_column[first], codes, np.flatnonzero(first), np.asarray(values, dtype=np.float64))
+
+
+def load_samples(engine, metric, since, until, device_ids=None, store=None):
+    """Read one raw metric column from store, the SQL store on engine by default"""
+    store = store or storage.SqlMetricsStore(Session(engine))
+    device_column, values = store.read_column(metric, since, until, device_ids)
+    return Samples.from_arrays(device_column, values)
+
+
+def load_baseline(engine, metric, since, days):
+    """Daily p95 of every device over the days before since, from the 1d rollups"""
+    table = MetricsRollup.__table__
+    query = select(table.c.device_id, table.c.p95).where(
+        table.c.resolution == '1d',
+        table.c.metric == metric,
+        table.c.bucket_start >= since - timedelta(days=days),
+        table.c.bucket_start < since,
+        table.c.p95.isnot(None)
+    ).order_by(table.c.device_id)
+    with engine.connect() as connection:
+        rows = [tuple(row) for row in connection.execute(query)]
+    data = np.array(rows, dtype=np.float64).reshape(-1, 2)
+    return data[:, 0].astype(np.int64), data[:, 1]
+
+
+def load_devices(engine):
+    """Hostname, location and SSID of every device, keyed by id"""
+    table = Device.__table__
+    with engine.connect() as connection:
+        rows = connection.execute(select(table.c.id, table.c.hostname, table.c.location, table.c.wifi_ssid)).all()
+    return {row[0]: {'hostname': row[1], 'location': row[2], 'wifi_ssid': row[3]} for row in rows}
+
+
+def histogram_bins(values, missing):
+    """Vectorized rollups.histogram_bin, capped at MAX_BIN; missing values get MAX_BIN + 1.
+
+    Rounds up instead of truncating and adding one, which only differs for
+    values exactly on a bin edge and saves a pass over the array.
+    """
+    scaled = np.fmax(values, 1.0)
+    np.log(scaled, out=scaled)
+    scaled *= 1 / math.log(HISTOGRAM_GROWTH)
+    np.ceil(scaled, out=scaled)
+    np.minimum(scaled, MAX_BIN, out=scaled)
+    scaled[missing] = MAX_BIN + 1
+    return scaled.astype(np.int64)
+
+
+def histogram_quantiles(histograms, quantile, high):
+    """Per-row quantile of a histogram matrix, clamped to each row's max.
+
+    Matches rollups.histogram_quantile, so fleet figures agree with the
+    per-device rollups to within one bin width.
+    """
+    counts = histograms.sum(axis=1)
+    cumulative = np.cumsum(histograms, axis=1)
+    index = np.argmax(cumulative >= (quantile * counts)[:, None], axis=1)
+    upper = np.where(index > 0, HISTOGRAM_GROWTH ** index.astype(np.float64), 1.0)
+    result = np.round(np.minimum(upper, high), 3)
+    return np.where(counts > 0, result, np.nan)
+
+
+def group_median(values, codes, groups):
+    """Median of values within each of groups codes; NaN for empty groups"""
+    order = np.lexsort((values, codes))
+    values = values[order]
+    counts = np.bincount(codes, minlength=groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    medians = np.full(groups, np.nan)
+    present = counts > 0
+    low = starts[present] + (counts[present] - 1) // 2
+    high = starts[present] + counts[present] // 2
+    medians[present] = (values[low] + values[high]) / 2
+    return medians
+
+
+def robust_z(values, value_codes, reference, reference_codes, groups):
+    """Robust z-score of each value against the reference values of its group.
+
+    Uses the median and median absolute deviation, so a few extreme
+    readings in the reference neither hide nor create outliers. Percentiles
+    are only known to one histogram bin, so the deviation is never taken
+    to be smaller than a bin width.
+    """
+    median = group_median(reference, reference_codes, groups)
+    mad = group_median(np.abs(reference - median[reference_codes]), reference_codes, groups)
+    mad = np.maximum(mad, np.abs(median) * (HISTOGRAM_GROWTH - 1))
+    mad = np.where(mad > 0, mad, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return MAD_SCALE * (values - median[value_codes]) / mad[value_codes]
+
+
+def device_stats(samples):
+    """Per-device sample counts, percentiles, jitter, availability and histograms.
+
+    Jitter is the mean absolute change between consecutive readings and
+    availability the share of samples with a reading at all. Needs at least
+    one sample. Samples are sorted by device, so per-device totals are
+    contiguous reductions and everything takes a few passes over the arrays.
+    """
+    devices = len(samples.device_ids)
+    values, starts = samples.values, samples.starts
+    total = np.diff(np.append(starts, len(values)))
+    missing = np.isnan(values)
+
+    # The extra last column counts missing readings
+    index = histogram_bins(values, missing)
+    index += samples.codes * (MAX_BIN + 2)
+    histograms = np.bincount(index, minlength=devices * (MAX_BIN + 2)).reshape(devices, MAX_BIN + 2)
+    readings = total - histograms[:, -1]
+    histograms = histograms[:, :-1]
+
+    high = np.fmax.reduceat(values, starts)
+    sums = np.add.reduceat(np.where(missing, 0.0, values), starts)
+
+    # steps[i] is the change from sample i to i + 1, not counted across devices
+    steps = np.empty(len(values))
+    np.subtract(values[1:], values[:-1], out=steps[:-1])
+    np.abs(steps, out=steps)
+    steps[starts[1:] - 1] = np.nan
+    steps[-1] = np.nan
+    no_step = np.isnan(steps)
+    jitter_count = total - np.add.reduceat(no_step, starts, dtype=np.int32)
+    steps[no_step] = 0.0
+    jitter_sum = np.add.reduceat(steps, starts)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'samples': total,
+            'readings': readings,
+            'mean': np.round(sums / readings, 3),
+            'p50': histogram_quantiles(histograms, 0.5, high),
+            'p95': histogram_quantiles(histograms, 0.95, high),
+            'p99': histogram_quantiles(histograms, 0.99, high),
+            'max': high,
+            'jitter': np.round(jitter_sum / jitter_count, 3),
+            'jitter_sum': jitter_sum,
+            'jitter_count': jitter_count,
+            'availability': np.round(readings / total, 4),
+            'histograms': histograms
+        }
+
+
+def group_stats(stats, group_codes, groups):
+    """Combine per-device stats into per-group stats by merging histograms"""
+    histograms = np.zeros((groups, MAX_BIN + 1), dtype=np.int64)
+    np.add.at(histograms, group_codes, stats['histograms'])
+    high = np.full(groups, -np.inf)
+    np.maximum.at(high, group_codes, np.nan_to_num(stats['max'], nan=-np.inf))
+
+    def total(name):
+        return np.bincount(group_codes, weights=stats[name], minlength=groups)
+
+    samples, readings = total('samples').astype(np.int64), total('readings')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'devices': np.bincount(group_codes, minlength=groups),
+            'samples': samples,
+            'p50': histogram_quantiles(histograms, 0.5, high),
+            'p95': histogram_quantiles(histograms, 0.95, high),
+            'p99': histogram_quantiles(histograms, 0.99, high),
+            'jitter': np.round(total('jitter_sum') / total('jitter_count'), 3),
+            'availability': np.round(readings / samples, 4)
+        }
+
+
+def _value(value):
+    """Plain Python value of a numpy scalar, with NaN as None"""
+    value = value.item() if hasattr(value, 'item') else value
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def _codes(labels):
+    """Group names and the group code of every label"""
+    if not len(labels):
+        return np.zeros(0, dtype=object), np.zeros(0, dtype=np.int64)
+    return np.unique(np.array(labels, dtype=object), return_inverse=True)
+
+
+def fleet_report(samples, devices, group_by='device', baseline=None, location=None, limit=20, outliers_only=False, worst='high'):
+    """Fleet analytics over loaded samples.
+
+    group_by is 'device', 'location' or 'wifi_ssid'. Devices carry two
+    robust z-scores of their p95: against the other devices at the same
+    location (z_peer) and against their own daily p95 over the baseline
+    days (z_baseline). Rows are ordered worst p95 first, where worst is
+    'high' for latency-like metrics and 'low' for throughput.
+    """
+    count = len(samples.device_ids)
+    if not count:
+        return []
+    stats = device_stats(samples)
+    info = [devices.get(int(d), {}) for d in samples.device_ids]
+
+    if group_by != 'device':
+        names, group_codes = _codes([i.get(group_by) or 'Unknown' for i in info])
+        grouped = group_stats(stats, group_codes, len(names))
+        keep = np.ones(len(names), dtype=bool)
+        p95 = grouped['p95']
+
+        def rows_of(i):
+            return {group_by: names[i], **{key: _value(values[i]) for key, values in grouped.items()}}
+    else:
+        p95 = stats['p95']
+        locations, location_codes = _codes([i.get('location') or 'Unknown' for i in info])
+        known = ~np.isnan(p95)
+        z_peer = robust_z(p95, location_codes, p95[known], location_codes[known], len(locations))
+
+        z_baseline = np.full(count, np.nan)
+        if baseline is not None and len(baseline[0]) and count:
+            ids, daily = baseline
+            position = np.searchsorted(samples.device_ids, ids)
+            matched = position < count
+            matched[matched] = samples.device_ids[position[matched]] == ids[matched]
+            z_baseline = robust_z(p95, np.arange(count), daily[matched], position[matched], count)
+
+        z_peer, z_baseline = np.round(z_peer, 2), np.round(z_baseline, 2)
+        outlier = np.fmax(np.abs(z_peer), np.abs(z_baseline)) > OUTLIER_Z
+        keep = np.ones(count, dtype=bool)
+        if location is not None:
+            keep &= np.array([i.get('location') == location for i in info], dtype=bool)
+        if outliers_only:
+            keep &= outlier
+
+        def rows_of(i):
+            return {
+                'device_id': int(samples.device_ids[i]),
+                'hostname': info[i].get('hostname'),
+                'location': info[i].get('location'),
+                'wifi_ssid': info[i].get('wifi_ssid'),
+                **{name: _value(stats[name][i]) for name in ('samples', 'mean', 'p50', 'p95', 'p99', 'jitter', 'availability')},
+                'z_peer': _value(z_peer[i]),
+                'z_baseline': _value(z_baseline[i]),
+                'outlier': bool(outlier[i])
+            }
+
+    # Worst first, devices without readings last
+    key = np.where(np.isnan(p95), np.inf, -p95 if worst == 'high' else p95)
+    order = [i for i in np.argsort(key, kind='stable') if keep[i]]
+    return [rows_of(i) for i in (order[:limit] if limit else order)]
@@ -1,19 +1,45 @@
-from flask import Flask, jsonify, request
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
-from datetime import datetime
+from sqlalchemy import event
+from datetime import datetime, timedelta, timezone
+import os
+import json
+import time
+import base64
+import socket
+import atexit
 import pytz
 import network_monitor
-import threading
-import time
+import rollups
+import migrations
+import retention
+import export
+import analytics
+import alerts
+import storage
+import instrumentation
+from compression import DecompressMiddleware
+from models import db, ActiveAlert, Device, MetricsRollup, SampleDetail, SpeedTest
+from scheduler import Scheduler
+from events import EventBroker, EventRelay
+from cache import ResponseCache
+from speedtest_jobs import SpeedTestQueue, SpeedTestRejected, job_dict
 
 app = Flask(__name__)
-CORS(app)
+# Dashboards on another origin read the resolution and paging headers too
+CORS(app, expose_headers=['X-Resolution', 'X-Next-Cursor'])
 
-# Configure SQLite database
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///network_monitor.db'
+# Agents may send gzip or zstd compressed request bodies
+app.wsgi_app = DecompressMiddleware(app.wsgi_app)
+
+# Configure the database; SQLite unless DATABASE_URL points elsewhere
+database_url = os.getenv('DATABASE_URL', 'sqlite:///network_monitor.db')
+if database_url.startswith('postgres://'):
+    database_url = 'postgresql://' + database_url[len('postgres://'):]
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True}
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+db.init_app(app)
 
 # Philippines timezone
 ph_tz = pytz.timezone('Asia/Manila')
@@ -24,73 +50,389 @@ def to_ph_time(utc_dt):
         return utc_dt.replace(tzinfo=pytz.UTC).astimezone(ph_tz)
     return None
 
-# Database Models
-class Device(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    hostname = db.Column(db.String(100), nullable=False)
-    username = db.Column(db.String(100))
-    location = db.Column(db.String(100))
-    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
-    connection_type = db.Column(db.String(50))
-    wifi_ssid = db.Column(db.String(100))
-    signal_strength = db.Column(db.String(20))
-    internal_ip = db.Column(db.String(50))
-    external_ip = db.Column(db.String(50))
-    status = db.Column(db.String(20), default='offline')
-
-class NetworkMetrics(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    device_id = db.Column(db.Integer, db.ForeignKey('device.id'), nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    dns_resolution_time = db.Column(db.Float)
-    download_speed = db.Column(db.Float)
-    upload_speed = db.Column(db.Float)
-    latency = db.Column(db.Float)
-
-# Create database tables
+# Helper function returning a UTC -> Philippines time ISO formatter for a
+# time range. The zone offset is looked up once per range instead of once
+# per row; ranges that cross an offset change fall back to to_ph_time().
+def ph_time_formatter(since, until):
+    offset = to_ph_time(since).utcoffset()
+    if to_ph_time(until).utcoffset() != offset:
+        return lambda utc_dt: to_ph_time(utc_dt).isoformat()
+    minutes = int(offset.total_seconds()) // 60
+    suffix = f"{'+' if minutes >= 0 else '-'}{abs(minutes) // 60:02d}:{abs(minutes) % 60:02d}"
+    return lambda utc_dt: (utc_dt + offset).isoformat() + suffix
+
+# Maximum number of samples accepted by a single batch request
+MAX_BATCH_SIZE = 1000
+
+# Default upper bound on points returned by the metrics query
+DEFAULT_MAX_POINTS = 1000
+
+# Default and largest page size of the paginated metrics query
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+# Default analytics window and the daily baseline it is compared against
+ANALYTICS_DAYS = 7
+ANALYTICS_BASELINE_DAYS = 14
+
+# Metrics where a lower value is worse
+HIGHER_IS_BETTER = ('download_speed', 'upload_speed')
+
+# Numeric sample fields accepted by the ingestion endpoints
+METRIC_FIELDS = ('dns_resolution_time', 'download_speed', 'upload_speed', 'latency')
+
+# Helper function to resolve the since/until range of a metrics query.
+# Explicit ISO-8601 bounds win over the hour/day/month timeframe buckets.
+def metrics_range(args):
+    now = datetime.utcnow()
+    timeframe = args.get('timeframe', 'hour')
+    if timeframe == 'hour':
+        since = now.replace(minute=0, second=0, microsecond=0)
+    elif timeframe == 'day':
+        since = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        since = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    until = now + timedelta(seconds=1)
+
+    since = parse_timestamp(args.get('since')) or since
+    until = parse_timestamp(args.get('until')) or until
+    if since >= until:
+        raise ValueError('since must be before until')
+    return since, until
+
+# Helper function giving the start of a timeframe-relative range, so cached
+# responses roll over with the hour/day/month bucket
+def metrics_range_key():
+    try:
+        return metrics_range(request.args)[0]
+    except ValueError:
+        return None
+
+# Helper function to validate the fields= column selector
+def selected_fields(value):
+    if not value:
+        return METRIC_FIELDS
+    fields = tuple(dict.fromkeys(f.strip() for f in value.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in METRIC_FIELDS]
+    if unknown or not fields:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}; expected any of {', '.join(METRIC_FIELDS)}")
+    return fields
+
+# Helper functions for opaque keyset pagination cursors over (timestamp, id)
+def encode_cursor(timestamp, row_id):
+    return base64.urlsafe_b64encode(f'{timestamp.isoformat()}|{row_id}'.encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+# Helper function to parse an ISO-8601 timestamp into naive UTC
+def parse_timestamp(value):
+    if value is None or value == '':
+        return None
+    if not isinstance(value, str):
+        raise ValueError('timestamp must be an ISO-8601 string')
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f'Invalid ISO-8601 timestamp: {value}')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+# Create database tables and bring older databases up to date
 with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        event.listen(db.engine, 'connect', migrations.apply_sqlite_pragmas)
     db.create_all()
+    migrations.migrate(db.engine)
+    instrumentation.instrument_sqlalchemy(db.engine, db.session)
+
+# Raw samples live in the SQL database unless METRICS_STORE=columnar
+metrics_store = storage.create_store_from_env(db.session, os.path.join(app.instance_path, 'metrics_store'))
+
+# Live updates for dashboards, fanned out in-process
+broker = EventBroker()
+
+# Serialized GET responses, invalidated by the ingestion path
+response_cache = ResponseCache(max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', '512')))
+
+# True in the processes started by serve.py and worker.py. Each of them has
+# its own event stream clients and cached responses, so events and
+# invalidations go through the database to every process, and alerts are
+# only evaluated by the job worker, which receives the web processes'
+# samples as relayed metrics events.
+relay_events = False
+job_worker = False
+
+# Helper functions to publish events and drop cached responses, in this
+# process or, when relaying, in every process
+def publish_events(events):
+    if relay_events:
+        event_relay.send_many(events)
+    else:
+        for event, data in events:
+            broker.publish(event, data)
+
+def publish_event(event, data):
+    publish_events([(event, data)])
+
+def invalidate_cache(*tags):
+    # Dropped here at once, so this process never serves its own stale data
+    response_cache.invalidate(*tags)
+    if relay_events:
+        event_relay.send('invalidate', list(tags))
+
+# Helper function applying an event relayed from any process
+def relayed_event(event, data):
+    if event == 'invalidate':
+        response_cache.invalidate(*data)
+        return
+    broker.publish(event, data)
+    if job_worker and event == 'metrics':
+        alert_engine.evaluate([dict(
+            sample,
+            device_id=data['device_id'],
+            timestamp=datetime.fromisoformat(sample['timestamp']).astimezone(timezone.utc).replace(tzinfo=None)
+        ) for sample in data['samples']])
+    elif job_worker and event == 'device_deleted':
+        alert_engine.forget(data['id'])
+
+with app.app_context():
+    event_relay = EventRelay(db.engine, relayed_event)
+
+# Alert rules evaluated as samples are stored; notifications also go out
+# on the event stream
+alert_engine = alerts.create_engine_from_env()
+alert_engine.add_sink(alerts.CallbackSink(lambda alert: publish_event('alert', alert)))
+
+# Keep the active_alert table in step with the job worker's alerts
+def record_alert(alert):
+    with app.app_context():
+        key = {'rule': alert['rule'], 'device_id': alert['device_id']}
+        if alert['state'] == 'resolved':
+            ActiveAlert.query.filter_by(**key).delete()
+        else:
+            row = ActiveAlert.query.filter_by(**key).first()
+            if row is None:
+                row = ActiveAlert(since=datetime.fromisoformat(alert['timestamp']), **key)
+                db.session.add(row)
+            row.severity, row.value, row.message = alert['severity'], alert['value'], alert['message']
+        db.session.commit()
 
-# Helper function to update device metrics
-def update_device_metrics(device_id):
-    while True:
+# Helper function listing firing alerts, from the job worker's table when
+# alerts are evaluated there
+def firing_alerts():
+    if not relay_events or job_worker:
+        return alert_engine.active()
+    return [
+        {'rule': a.rule, 'device_id': a.device_id, 'since': a.since.isoformat()}
+        for a in ActiveAlert.query.order_by(ActiveAlert.since)
+    ]
+
+def use_event_relay(worker=False):
+    """Relay events through the database; called by serve.py and worker.py.
+
+    worker is set by the job worker, which also evaluates alerts.
+    """
+    global relay_events, job_worker
+    relay_events = True
+    job_worker = worker
+    if worker:
         with app.app_context():
-            device = Device.query.get(device_id)
-            if device:
-                # Get network metrics
-                connection_info = network_monitor.get_connection_info()
-                ip_info = network_monitor.get_ip_addresses()
-                dns_time = network_monitor.measure_dns_resolution()
-                speed_results = network_monitor.run_speed_test()
-                latency = network_monitor.ping_host('8.8.8.8')
-
-                # Update device info
-                device.connection_type = connection_info.get('connection_type', 'N/A')
-                device.wifi_ssid = connection_info.get('wifi_ssid')
-                device.signal_strength = connection_info.get('signal_strength')
-                device.internal_ip = ip_info['internal_ip']
-                device.external_ip = ip_info['external_ip']
-                device.last_seen = datetime.utcnow()
-                device.status = 'online'
-
-                # Store metrics
-                metrics = NetworkMetrics(
-                    device_id=device_id,
-                    dns_resolution_time=dns_time,
-                    download_speed=speed_results.get('download') if 'error' not in speed_results else None,
-                    upload_speed=speed_results.get('upload') if 'error' not in speed_results else None,
-                    latency=latency
-                )
-                db.session.add(metrics)
-                db.session.commit()
-
-        time.sleep(300)  # Update every 5 minutes
+            # Alert state starts empty, so alerts still firing will fire again
+            ActiveAlert.query.delete()
+            db.session.commit()
+            alert_engine.add_sink(alerts.CallbackSink(record_alert))
+        event_relay.start()
 
-# API Routes
-@app.route('/api/devices', methods=['GET'])
-def get_devices():
-    devices = Device.query.all()
-    return jsonify([{
+# Store finished speed tests and report job progress on the event stream
+def speedtest_updated(job):
+    data = job_dict(job)
+    if job.status == 'completed':
+        with app.app_context():
+            row = {
+                'device_id': job.device_id,
+                'timestamp': job.finished_at,
+                'download_speed': data['result']['download'],
+                'upload_speed': data['result']['upload']
+            }
+            store_metrics([row])
+            db.session.commit()
+            publish_ingest([], [row])
+    publish_event('speedtest', data)
+
+# Any web process queues tests; only the job worker runs them
+speedtests = SpeedTestQueue(
+    network_monitor.run_speed_test,
+    app.app_context,
+    max_concurrent=int(os.getenv('SPEEDTEST_CONCURRENCY', '1')),
+    cooldown=int(os.getenv('SPEEDTEST_COOLDOWN', '600')),
+    on_update=speedtest_updated
+)
+
+# Background jobs share one scheduler instead of one thread per device
+SERVER_PROBE_INTERVAL = int(os.getenv('SERVER_PROBE_INTERVAL', '300'))
+# Named apart from an agent running on the same host
+SERVER_DEVICE_HOSTNAME = os.getenv('SERVER_DEVICE_HOSTNAME', f'{socket.gethostname()} (server)')
+SERVER_DEVICE_LOCATION = 'Server'
+COMPACTION_INTERVAL = int(os.getenv('COMPACTION_INTERVAL', '3600'))
+HEARTBEAT_SWEEP_INTERVAL = int(os.getenv('HEARTBEAT_SWEEP_INTERVAL', '60'))
+HEARTBEAT_TIMEOUT = int(os.getenv('HEARTBEAT_TIMEOUT', '900'))
+SPEEDTEST_DISPATCH_INTERVAL = 2
+scheduler = Scheduler(max_workers=int(os.getenv('SCHEDULER_WORKERS', '4')))
+
+# Request and ingest metrics served on /metrics, next to the database and
+# probe metrics recorded by instrumentation itself
+REQUEST_DURATION = instrumentation.histogram(
+    'http_request_duration_seconds', 'Time to build an API response', ['method', 'route', 'status']
+)
+SAMPLES_INGESTED = instrumentation.counter('metrics_samples_ingested_total', 'Raw metric samples stored')
+STORE_APPEND_DURATION = instrumentation.histogram(
+    'metrics_store_append_duration_seconds', 'Time to append a batch of raw samples', ['store']
+)
+
+# Counters the components above already keep, read when /metrics is scraped
+instrumentation.gauge('event_stream_subscribers', 'Connected event stream clients').set_function(
+    lambda: broker.stats()['subscribers']
+)
+instrumentation.counter('event_stream_dropped_total', 'Events dropped for slow stream clients').set_function(
+    lambda: broker.stats()['dropped']
+)
+instrumentation.gauge('response_cache_entries', 'Cached API responses').set_function(
+    lambda: response_cache.stats()['entries']
+)
+instrumentation.counter('response_cache_lookups_total', 'Response cache lookups', ['result']).set_function(
+    lambda: {('hit',): response_cache.stats()['hits'], ('miss',): response_cache.stats()['misses']}
+)
+instrumentation.gauge('scheduler_queue_depth', 'Background jobs due but not yet running').set_function(
+    lambda: scheduler.stats()['queue_depth']
+)
+instrumentation.gauge('scheduler_lag_seconds', 'Delay of the last background job start').set_function(
+    lambda: scheduler.stats()['lag']
+)
+instrumentation.gauge('alerts_firing', 'Alerts currently firing').set_function(
+    lambda: len(firing_alerts())
+)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+# Web processes pick up relayed events from the first request on, which
+# under gunicorn is after the fork
+@app.before_request
+def start_event_relay():
+    if relay_events:
+        event_relay.start()
+
+# Routes are labelled by their rule, e.g. /api/devices/<int:device_id>/metrics,
+# so the number of label sets stays bounded
+@app.after_request
+def observe_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_DURATION.observe(time.perf_counter() - started, request.method, route, str(response.status_code))
+    return response
+
+# Helper function returning the device the server's own probe is recorded
+# under, so agent-reported devices and their metrics are never touched
+def server_device():
+    device = Device.query.filter_by(hostname=SERVER_DEVICE_HOSTNAME, location=SERVER_DEVICE_LOCATION).first()
+    if device is None:
+        device = Device(hostname=SERVER_DEVICE_HOSTNAME, location=SERVER_DEVICE_LOCATION, status='online')
+        db.session.add(device)
+        db.session.flush()
+    return device
+
+# Measure the server's own network and record it under the server device
+def collect_server_metrics():
+    connection_info = network_monitor.get_connection_info()
+    ip_info = network_monitor.get_ip_addresses()
+    dns_time = network_monitor.measure_dns_resolution()
+    speed_results = speedtests.run_exclusive()
+    latency = network_monitor.ping_host('8.8.8.8')
+
+    with app.app_context():
+        now = datetime.utcnow()
+        device = server_device()
+        update_device_info(device, {'connection_info': connection_info, 'ip_addresses': ip_info}, now)
+
+        row = {
+            'device_id': device.id,
+            'timestamp': now,
+            'dns_resolution_time': dns_time,
+            'download_speed': speed_results.get('download') if 'error' not in speed_results else None,
+            'upload_speed': speed_results.get('upload') if 'error' not in speed_results else None,
+            'latency': latency
+        }
+        store_metrics([row])
+        db.session.commit()
+        publish_ingest([device], [row])
+
+# Mark devices that stopped reporting offline in one bulk update
+def sweep_heartbeats():
+    with app.app_context():
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=HEARTBEAT_TIMEOUT)
+        stale = [device_id for device_id, in db.session.query(Device.id).filter(
+            Device.status == 'online',
+            Device.last_seen < cutoff
+        )]
+        if stale:
+            Device.query.filter(
+                Device.id.in_(stale),
+                Device.last_seen < cutoff
+            ).update({Device.status: 'offline'}, synchronize_session=False)
+            db.session.commit()
+            invalidate_cache('devices')
+            for device in Device.query.filter(Device.id.in_(stale)):
+                publish_event('device', device_json(device))
+        alert_engine.check_heartbeats(dict(db.session.query(Device.id, Device.last_seen)), now)
+
+# Delete data past its retention period and reclaim the space
+def compact_metrics():
+    with app.app_context():
+        retention.compact(store=metrics_store)
+    invalidate_cache('metrics')
+
+def start_background_jobs(relay=False):
+    """Schedule periodic jobs; safe to call more than once.
+
+    relay is set by worker.py, which shares events with the web processes
+    through the database and evaluates their alerts.
+    """
+    if relay and not job_worker:
+        use_event_relay(worker=True)
+    scheduler.add_job('server-probe', collect_server_metrics, SERVER_PROBE_INTERVAL)
+    scheduler.add_job('compaction', compact_metrics, COMPACTION_INTERVAL, delay=60)
+    scheduler.add_job('heartbeat-sweep', sweep_heartbeats, HEARTBEAT_SWEEP_INTERVAL)
+    scheduler.add_job('speedtest-dispatch', speedtests.dispatch, SPEEDTEST_DISPATCH_INTERVAL, jitter=0)
+    if not scheduler.running:
+        speedtests.recover()
+        scheduler.start()
+        atexit.register(scheduler.stop, wait=False)
+
+# Helper function to insert raw samples and fold them into the rollups,
+# plus any agent diagnostics sent with them. Rows must carry a timestamp;
+# the caller commits.
+def store_metrics(rows, details=()):
+    if details:
+        db.session.execute(SampleDetail.__table__.insert(), details)
+    if not rows:
+        return
+    with STORE_APPEND_DURATION.time(metrics_store.name):
+        metrics_store.append(rows)
+    SAMPLES_INGESTED.inc(amount=len(rows))
+    rollups.update_rollups(rows)
+
+# Helper function to serialize a device for the API and the event stream
+def device_json(d):
+    return {
         'id': d.id,
         'hostname': d.hostname,
         'username': d.username,
@@ -100,12 +442,118 @@ def get_devices():
         'wifi_ssid': d.wifi_ssid,
         'signal_strength': d.signal_strength,
         'status': d.status
-    } for d in devices])
+    }
+
+# Helper function to push committed changes to every stream subscriber and
+# drop the cached responses they affect. Each event is built once here,
+# however many dashboards are connected.
+def publish_ingest(devices, rows=()):
+    tags = {f'metrics:{row["device_id"]}' for row in rows}
+    if devices:
+        tags.add('devices')
+    invalidate_cache(*tags)
+
+    events = [('device', device_json(device)) for device in devices]
+    samples = {}
+    for row in rows:
+        samples.setdefault(row['device_id'], []).append(dict(
+            {field: row.get(field) for field in METRIC_FIELDS},
+            timestamp=to_ph_time(row['timestamp']).isoformat()
+        ))
+    events.extend(
+        ('metrics', {'device_id': device_id, 'samples': device_samples})
+        for device_id, device_samples in samples.items()
+    )
+    publish_events(events)
+
+    # When relaying, the job worker evaluates these from the metrics events
+    if not relay_events:
+        alert_engine.evaluate(rows)
+
+# Agent payload fields that must be JSON objects when present
+PAYLOAD_OBJECTS = ('connection_info', 'ip_addresses', 'speed_test', 'ping_results',
+                   'traffic', 'dns_stats', 'ping_stats', 'probe_durations')
+
+# Agent diagnostics kept as JSON in the sample_detail table
+DETAIL_FIELDS = ('traffic', 'dns_stats', 'ping_stats', 'probe_durations')
+
+# Helper function to tell an integer id from a JSON boolean
+def is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+# Helper function to build a NetworkMetrics row from an agent payload
+def metrics_row(device_id, data):
+    if not isinstance(data, dict):
+        raise ValueError('Sample must be an object')
+    for field in PAYLOAD_OBJECTS:
+        if data.get(field) is not None and not isinstance(data[field], dict):
+            raise ValueError(f'{field} must be an object')
+    speed_test = data.get('speed_test') or {}
+    row = {
+        'device_id': device_id,
+        'dns_resolution_time': data.get('dns_resolution_time'),
+        'download_speed': speed_test.get('download'),
+        'upload_speed': speed_test.get('upload'),
+        'latency': (data.get('ping_results') or {}).get('8.8.8.8')
+    }
+    for field in METRIC_FIELDS:
+        value = row[field]
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError(f'{field} must be a number')
+    return row
+
+# Helper function to build a SampleDetail row for a stored row from its
+# agent payload, or None when the payload carries no diagnostics
+def detail_row(row, data):
+    details = {field: data[field] for field in DETAIL_FIELDS if data.get(field) is not None}
+    if not details:
+        return None
+    return {
+        'device_id': row['device_id'],
+        'timestamp': row['timestamp'],
+        'data': json.dumps(details, separators=(',', ':'))
+    }
+
+# Helper function to refresh device details from an agent payload; agents
+# only report connection details on cycles where they collected them
+def update_device_info(device, data, seen_at=None):
+    if 'connection_info' in data:
+        connection_info = data['connection_info'] or {}
+        device.connection_type = connection_info.get('connection_type', 'N/A')
+        device.wifi_ssid = connection_info.get('wifi_ssid')
+        device.signal_strength = connection_info.get('signal_strength')
+    if 'ip_addresses' in data:
+        ip_addresses = data['ip_addresses'] or {}
+        device.internal_ip = ip_addresses.get('internal_ip')
+        device.external_ip = ip_addresses.get('external_ip')
+    device.last_seen = seen_at or datetime.utcnow()
+    device.status = 'online'
+
+# API Routes
+@app.route('/api/devices', methods=['GET'])
+@response_cache.cached(lambda: ['devices'])
+def get_devices():
+    devices = Device.query.all()
+    return jsonify([device_json(d) for d in devices])
+
+@app.route('/api/stream', methods=['GET'])
+def stream_events():
+    """Server-Sent Events feed of device changes and new metric samples"""
+    subscription = broker.subscribe()
+    return Response(
+        broker.stream(subscription),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/api/devices', methods=['POST'])
 def register_device():
     data = request.json
-    device_info = network_monitor.get_device_info()
+    # Agents describe themselves at registration; fall back to this host for
+    # clients that do not
+    device_info = data.get('device_info')
+    if not isinstance(device_info, dict) or not device_info.get('hostname'):
+        device_info = network_monitor.get_device_info()
     
     # Check if device already exists
     existing_device = Device.query.filter_by(hostname=device_info['hostname']).first()
@@ -113,99 +561,298 @@ def register_device():
         existing_device.status = 'online'
         existing_device.last_seen = datetime.utcnow()
         db.session.commit()
+        publish_ingest([existing_device])
         return jsonify({'id': existing_device.id, 'message': 'Device updated successfully'})
     
     device = Device(
         hostname=device_info['hostname'],
-        username=device_info['username'],
+        username=device_info.get('username'),
         location=data.get('location', 'Unknown'),
         status='online'
     )
     db.session.add(device)
     db.session.commit()
-
-    # Start monitoring thread for the new device
-    thread = threading.Thread(target=update_device_metrics, args=(device.id,))
-    thread.daemon = True
-    thread.start()
+    publish_ingest([device])
 
     return jsonify({'id': device.id, 'message': 'Device registered successfully'})
 
 @app.route('/api/devices/<int:device_id>/metrics', methods=['GET', 'POST'])
+@response_cache.cached(lambda device_id: [f'metrics:{device_id}', 'metrics'], vary=lambda device_id: metrics_range_key())
 def device_metrics(device_id):
     if request.method == 'GET':
-        timeframe = request.args.get('timeframe', 'hour')
-        
-        if timeframe == 'hour':
-            since = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
-        elif timeframe == 'day':
-            since = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        try:
+            since, until = metrics_range(request.args)
+            fields = selected_fields(request.args.get('fields'))
+            cursor = decode_cursor(request.args['cursor']) if 'cursor' in request.args else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        format_time = ph_time_formatter(since, until)
+        paginate = cursor is not None or 'limit' in request.args
+
+        # Long ranges are served from the rollup tables instead of raw rows
+        if not paginate:
+            max_points = request.args.get('max_points', DEFAULT_MAX_POINTS, type=int)
+            resolution = rollups.choose_resolution(
+                device_id, since, until, max(max_points, 1), retention.retained_since(), metrics_store
+            )
+            if resolution != 'raw':
+                points = rollups.query_rollups(device_id, resolution, since, until, fields)
+                response = jsonify([dict(point, timestamp=format_time(start)) for start, point in points])
+                response.headers['X-Resolution'] = resolution
+                return response
+
+        # Only the selected columns are loaded, as plain tuples
+        next_cursor = None
+        if paginate:
+            limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+            rows = metrics_store.query(device_id, since, until, fields, after=cursor, limit=limit + 1)
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
         else:
-            since = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-            since = since.replace(day=1)
-
-        metrics = NetworkMetrics.query.filter(
-            NetworkMetrics.device_id == device_id,
-            NetworkMetrics.timestamp >= since
-        ).all()
-
-        return jsonify([{
-            'timestamp': to_ph_time(m.timestamp).isoformat(),
-            'dns_resolution_time': m.dns_resolution_time,
-            'download_speed': m.download_speed,
-            'upload_speed': m.upload_speed,
-            'latency': m.latency
-        } for m in metrics])
-    
+            rows = metrics_store.query(device_id, since, until, fields)
+
+        response = jsonify([
+            dict(zip(fields, row[2:]), timestamp=format_time(row[1])) for row in rows
+        ])
+        response.headers['X-Resolution'] = 'raw'
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
+
     elif request.method == 'POST':
         data = request.json
         device = Device.query.get(device_id)
         if not device:
             return jsonify({'error': 'Device not found'}), 404
 
-        # Update device info
-        connection_info = data.get('connection_info', {})
-        ip_addresses = data.get('ip_addresses', {})
-        device.connection_type = connection_info.get('connection_type', 'N/A')
-        device.wifi_ssid = connection_info.get('wifi_ssid')
-        device.signal_strength = connection_info.get('signal_strength')
-        device.internal_ip = ip_addresses.get('internal_ip')
-        device.external_ip = ip_addresses.get('external_ip')
-        device.last_seen = datetime.utcnow()
-        device.status = 'online'
-
-        # Store metrics
-        speed_test = data.get('speed_test', {})
-        metrics = NetworkMetrics(
-            device_id=device_id,
-            dns_resolution_time=data.get('dns_resolution_time'),
-            download_speed=speed_test.get('download'),
-            upload_speed=speed_test.get('upload'),
-            latency=data.get('ping_results', {}).get('8.8.8.8')
-        )
-        db.session.add(metrics)
+        try:
+            row = metrics_row(device_id, data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Update device info and store metrics
+        row['timestamp'] = datetime.utcnow()
+        update_device_info(device, data, row['timestamp'])
+        detail = detail_row(row, data)
+        store_metrics([row], [detail] if detail else [])
         db.session.commit()
+        publish_ingest([device], [row])
 
         return jsonify({'message': 'Metrics updated successfully'}), 200
 
+@app.route('/api/devices/<int:device_id>/details', methods=['GET'])
+def device_details(device_id):
+    """Agent diagnostics sent with a device's samples, oldest first"""
+    try:
+        since, until = metrics_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    rows = db.session.query(SampleDetail.timestamp, SampleDetail.data).filter(
+        SampleDetail.device_id == device_id,
+        SampleDetail.timestamp >= since,
+        SampleDetail.timestamp < until
+    ).order_by(SampleDetail.timestamp).limit(limit)
+    format_time = ph_time_formatter(since, until)
+    return jsonify([dict(json.loads(data), timestamp=format_time(timestamp)) for timestamp, data in rows])
+
+@app.route('/api/export', methods=['GET'])
+def export_metrics():
+    """Stream raw or rolled-up metrics of many devices as CSV, NDJSON, Parquet or Arrow"""
+    export_format = request.args.get('format', 'csv')
+    resolution = request.args.get('resolution', 'raw')
+    try:
+        since, until = metrics_range(request.args)
+        fields = selected_fields(request.args.get('fields'))
+        device_ids = [d.strip() for value in request.args.getlist('device_id') for d in value.split(',') if d.strip()]
+        if not all(d.isdigit() for d in device_ids):
+            raise ValueError('device_id must be a list of integers')
+        device_ids = [int(d) for d in device_ids]
+        output = export.stream_export(
+            db.engine, export_format, since, until, device_ids, resolution, fields, store=metrics_store
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    filename = f"metrics-{resolution}-{since.strftime('%Y%m%dT%H%M%S')}.{export_format}"
+    return Response(
+        stream_with_context(output),
+        mimetype=export.EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename={filename}', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/analytics', methods=['GET'])
+def fleet_analytics():
+    """Fleet-wide percentiles, jitter, availability and outliers of one metric.
+
+    The statistics take well under a second for 10k devices over a week
+    (about 20M samples), but the raw window is read first. The SQL store
+    reads about 250k samples/s, so a fleet-sized window takes over a
+    minute; use METRICS_STORE=columnar (about 20M samples/s) for large
+    fleets, or narrow the window with days, since and until.
+    """
+    metric = request.args.get('metric', 'latency')
+    group_by = request.args.get('group_by', 'device')
+    try:
+        if metric not in METRIC_FIELDS:
+            raise ValueError(f"Unknown metric {metric}; expected any of {', '.join(METRIC_FIELDS)}")
+        if group_by not in ('device', 'location', 'wifi_ssid'):
+            raise ValueError('group_by must be device, location or wifi_ssid')
+        until = parse_timestamp(request.args.get('until')) or datetime.utcnow()
+        days = request.args.get('days', ANALYTICS_DAYS, type=float)
+        since = parse_timestamp(request.args.get('since')) or until - timedelta(days=days)
+        if since >= until:
+            raise ValueError('since must be before until')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    baseline_days = request.args.get('baseline_days', ANALYTICS_BASELINE_DAYS, type=int)
+    samples = analytics.load_samples(db.engine, metric, since, until, store=metrics_store)
+    baseline = analytics.load_baseline(db.engine, metric, since, baseline_days) if group_by == 'device' and baseline_days > 0 else None
+    rows = analytics.fleet_report(
+        samples,
+        analytics.load_devices(db.engine),
+        group_by=group_by,
+        baseline=baseline,
+        location=request.args.get('location'),
+        limit=max(request.args.get('limit', 20, type=int), 0),
+        outliers_only=request.args.get('outliers') == 'true',
+        worst='low' if metric in HIGHER_IS_BETTER else 'high'
+    )
+    return jsonify({
+        'metric': metric,
+        'since': since.isoformat(),
+        'until': until.isoformat(),
+        'devices': len(samples.device_ids),
+        'samples': len(samples.values),
+        'rows': rows
+    })
+
+@app.route('/api/devices/metrics/batch', methods=['POST'])
+def batch_device_metrics():
+    """Ingest many samples, possibly for several devices, in one commit"""
+    data = request.get_json(silent=True)
+    samples = data.get('samples') if isinstance(data, dict) else data
+    if not isinstance(samples, list):
+        return jsonify({'error': 'Expected a list of samples'}), 400
+    if len(samples) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'Batch exceeds {MAX_BATCH_SIZE} samples'}), 413
+
+    device_ids = {
+        s.get('device_id') for s in samples
+        if isinstance(s, dict) and is_id(s.get('device_id'))
+    }
+    devices = {d.id: d for d in Device.query.filter(Device.id.in_(device_ids)).all()}
+
+    now = datetime.utcnow()
+    rows = []
+    details = []
+    results = []
+    latest = {}
+    for index, sample in enumerate(samples):
+        try:
+            if not isinstance(sample, dict):
+                raise ValueError('Sample must be an object')
+            device_id = sample.get('device_id')
+            if not is_id(device_id):
+                raise ValueError('device_id must be an integer')
+            device = devices.get(device_id)
+            if device is None:
+                raise ValueError('Device not found')
+            row = metrics_row(device.id, sample)
+            row['timestamp'] = parse_timestamp(sample.get('timestamp')) or now
+        except ValueError as e:
+            results.append({'index': index, 'status': 'rejected', 'error': str(e)})
+            continue
+
+        rows.append(row)
+        detail = detail_row(row, sample)
+        if detail is not None:
+            details.append(detail)
+        results.append({'index': index, 'status': 'accepted'})
+        if device.id not in latest or row['timestamp'] >= latest[device.id][0]:
+            latest[device.id] = (row['timestamp'], sample)
+
+    # Device details come from the newest sample of each device, unless the
+    # device has already reported something more recent
+    updated = []
+    for device_id, (timestamp, sample) in latest.items():
+        device = devices[device_id]
+        seen_at = min(timestamp, now)
+        if device.last_seen is None or seen_at >= device.last_seen:
+            update_device_info(device, sample, seen_at)
+            updated.append(device)
+
+    store_metrics(rows, details)
+    db.session.commit()
+    publish_ingest(updated, rows)
+
+    return jsonify({
+        'accepted': len(rows),
+        'rejected': len(samples) - len(rows),
+        'results': results
+    }), 200
+
 @app.route('/api/devices/<int:device_id>/speedtest', methods=['POST'])
 def run_speedtest(device_id):
     device = Device.query.get(device_id)
     if not device:
         return jsonify({'error': 'Device not found'}), 404
-    
-    # Run speed test
-    speed_results = network_monitor.run_speed_test()
-    if 'error' not in speed_results:
-        metrics = NetworkMetrics(
-            device_id=device_id,
-            download_speed=speed_results['download'],
-            upload_speed=speed_results['upload']
-        )
-        db.session.add(metrics)
-        db.session.commit()
-        return jsonify(speed_results)
-    return jsonify({'error': speed_results['error']}), 500
+
+    # Speed tests run in the background; clients poll the job or watch the stream
+    try:
+        job = speedtests.submit(device_id)
+    except SpeedTestRejected as e:
+        response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    return jsonify({'job': job_dict(job), 'status_url': f'/api/speedtests/{job.id}'}), 202
+
+@app.route('/api/speedtests/<job_id>', methods=['GET'])
+def speedtest_status(job_id):
+    job = speedtests.get(job_id)
+    if not job:
+        return jsonify({'error': 'Speed test not found'}), 404
+    return jsonify(job_dict(job))
+
+@app.route('/api/speedtests', methods=['GET'])
+def speedtest_stats():
+    return jsonify(speedtests.stats())
+
+@app.route('/api/retention', methods=['GET'])
+def retention_stats():
+    return jsonify({'retention_days': retention.RETENTION_DAYS, 'last_run': retention.last_report})
+
+@app.route('/api/alerts', methods=['GET'])
+def active_alerts():
+    active = firing_alerts()
+    stats = alert_engine.stats()
+    if relay_events and not job_worker:
+        # Evaluated by the job worker; this process only knows the configuration
+        stats = {'rules': stats['rules'], 'sinks': stats['sinks'], 'firing': len(active), 'evaluated_by': 'worker'}
+    return jsonify({'active': active, 'stats': stats})
+
+@app.route('/api/stream/stats', methods=['GET'])
+def stream_stats():
+    return jsonify(broker.stats())
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(response_cache.stats())
+
+@app.route('/api/storage/stats', methods=['GET'])
+def storage_stats():
+    return jsonify(metrics_store.stats())
+
+@app.route('/api/scheduler', methods=['GET'])
+def scheduler_stats():
+    return jsonify(scheduler.stats())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Counters and histograms in the Prometheus text exposition format"""
+    return Response(instrumentation.REGISTRY.render(), content_type=instrumentation.CONTENT_TYPE)
 
 @app.route('/api/devices/<int:device_id>', methods=['DELETE'])
 def delete_device(device_id):
@@ -214,10 +861,21 @@ def delete_device(device_id):
         return jsonify({'error': 'Device not found'}), 404
     
     # Delete associated metrics
-    NetworkMetrics.query.filter_by(device_id=device_id).delete()
+    metrics_store.delete_device(device_id)
+    MetricsRollup.query.filter_by(device_id=device_id).delete()
+    SampleDetail.query.filter_by(device_id=device_id).delete()
+    SpeedTest.query.filter_by(device_id=device_id).delete()
+    ActiveAlert.query.filter_by(device_id=device_id).delete()
     db.session.delete(device)
     db.session.commit()
+    invalidate_cache('devices', f'metrics:{device_id}')
+    alert_engine.forget(device_id)
+    publish_event('device_deleted', {'id': device_id})
     return jsonify({'message': 'Device deleted successfully'})
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # Development server only; use serve.py and worker.py in production.
+    # With the reloader on, only the child process that serves requests runs jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_jobs()
+    app.run(debug=True, port=int(os.getenv('PORT', '5000')))
\ No newline at end of file
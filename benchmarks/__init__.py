@@ -0,0 +1,7 @@
+"""Performance benchmarks.
+
+Each module can be run on its own from the repository root, for example
+``python -m benchmarks.bench_transport``, and prints its results as JSON. ``python -m benchmarks.run`` runs them all as
+suites and, given an earlier run's output with ``--baseline``, fails on
+results that got worse by more than ``--threshold``.
+"""
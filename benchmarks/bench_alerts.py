@@ -0,0 +1,58 @@
+"""Alert evaluation cost per sample as the fleet and its history grow.
+
+Feeds synthetic samples through alerts.AlertEngine with the default rules
+and no sinks. Because every (rule, device) pair keeps constant-size
+rolling state, the cost per sample should stay flat however many samples
+each device has already sent.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+import alerts
+
+
+def run(devices=10000, rounds=20, batch=500):
+    engine = alerts.AlertEngine(alerts.load_rules(), [])
+    rng = random.Random(42)
+    start_time = datetime.utcnow() - timedelta(minutes=5 * rounds)
+    per_round = []
+    for step in range(rounds):
+        timestamp = start_time + timedelta(minutes=5 * step)
+        rows = [{
+            'device_id': device_id,
+            'timestamp': timestamp,
+            'latency': rng.lognormvariate(3.4, 0.5),
+            'dns_resolution_time': rng.lognormvariate(3, 0.6)
+        } for device_id in range(1, devices + 1)]
+        start = time.perf_counter()
+        for i in range(0, len(rows), batch):
+            engine.evaluate(rows[i:i + batch])
+        per_round.append((time.perf_counter() - start) / devices * 1e6)
+
+    stats = engine.stats()
+    return {
+        'devices': devices,
+        'samples': devices * rounds,
+        'us_per_sample_first_round': round(per_round[0], 2),
+        'us_per_sample_last_round': round(per_round[-1], 2),
+        'samples_per_sec': round(1e6 / (sum(per_round) / len(per_round))),
+        'tracked_states': stats['tracked'],
+        'notifications': stats['notifications']
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--batch', type=int, default=500)
+    args = parser.parse_args(argv)
+    json.dump(run(args.devices, args.rounds, args.batch), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Fleet analytics compute time for a synthetic fleet.
+
+Generates one week of latency samples for every device (one every five
+minutes by default, with some missing readings and a few degraded
+devices), then times analytics.fleet_report() per device and per
+location on the in-memory arrays. Loading the arrays is timed separately
+on a smaller table with --load-rows, from both the SQL and the columnar
+store, and projected to the size of the synthetic fleet; loading the full
+window from the SQL store takes far longer than the compute step.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import sqlite3
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+import analytics
+import storage
+import migrations
+from models import db
+from benchmarks.bench_metrics_query import build_database
+
+
+def synthetic_fleet(devices, days, interval, seed=42):
+    """Samples ordered by device and time, plus device metadata"""
+    rng = np.random.default_rng(seed)
+    per_device = days * 86400 // interval
+    device_column = np.repeat(np.arange(1, devices + 1, dtype=np.int64), per_device)
+    values = rng.lognormal(mean=3.4, sigma=0.35, size=devices * per_device)
+    degraded = rng.choice(devices, size=max(devices // 200, 1), replace=False)
+    for code in degraded:
+        values[code * per_device:(code + 1) * per_device] *= 4
+    values[rng.random(values.shape) < 0.02] = np.nan
+
+    metadata = {
+        i: {'hostname': f'HOST-{i:05d}', 'location': f'Site {i % 20}', 'wifi_ssid': f'SSID-{i % 50}'}
+        for i in range(1, devices + 1)
+    }
+    return analytics.Samples.from_arrays(device_column, values), metadata, sorted(int(d) + 1 for d in degraded)
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 1), result
+
+
+def copy_to_columnar(path, directory):
+    """Columnar store holding the latency samples of the database at path"""
+    store = storage.ColumnarMetricsStore(os.path.join(directory, 'metrics_store'))
+    conn = sqlite3.connect(path)
+    cursor = conn.execute('SELECT device_id, timestamp, latency FROM network_metrics ORDER BY timestamp')
+    while True:
+        chunk = cursor.fetchmany(100000)
+        if not chunk:
+            break
+        store.append([
+            {'device_id': device_id, 'timestamp': datetime.fromisoformat(timestamp), 'latency': latency}
+            for device_id, timestamp, latency in chunk
+        ])
+    conn.close()
+    return store
+
+
+def timed_load(engine, store, now, fleet_samples):
+    start = time.perf_counter()
+    samples = analytics.load_samples(engine, 'latency', now - timedelta(days=3650), now + timedelta(seconds=1), store=store)
+    seconds = time.perf_counter() - start
+    rows_per_sec = len(samples.values) / seconds
+    return {
+        'rows': len(samples.values),
+        'seconds': round(seconds, 2),
+        'rows_per_sec': round(rows_per_sec),
+        'fleet_seconds': round(fleet_samples / rows_per_sec, 1)
+    }
+
+
+def load_time(rows, devices, fleet_samples):
+    """Time to read a raw metric column of rows samples into arrays from each store.
+
+    fleet_seconds projects the rate to the synthetic fleet's sample count.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'network_monitor.db')
+        now = build_database(path, rows, devices)
+        engine = create_engine(f'sqlite:///{path}')
+        event.listen(engine, 'connect', migrations.apply_sqlite_pragmas)
+        db.metadata.create_all(engine)
+        migrations.migrate(engine)
+        session = Session(engine)
+        results = {
+            'sql': timed_load(engine, storage.SqlMetricsStore(session), now, fleet_samples),
+            'columnar': timed_load(engine, copy_to_columnar(path, directory), now, fleet_samples)
+        }
+        session.close()
+        engine.dispose()
+    return results
+
+
+def run(devices=10000, days=7, interval=300, repeat=3, load_rows=1_000_000):
+    start = time.perf_counter()
+    samples, metadata, degraded = synthetic_fleet(devices, days, interval)
+    generate_seconds = time.perf_counter() - start
+
+    device_ms, rows = timed(lambda: analytics.fleet_report(samples, metadata, limit=20), repeat)
+    location_ms, _ = timed(lambda: analytics.fleet_report(samples, metadata, group_by='location', limit=0), repeat)
+    outlier_ms, outliers = timed(lambda: analytics.fleet_report(samples, metadata, limit=0, outliers_only=True), repeat)
+
+    flagged = {row['device_id'] for row in outliers}
+    return {
+        'devices': devices,
+        'samples': len(samples.values),
+        'generate_seconds': round(generate_seconds, 1),
+        'compute_ms': {
+            'by_device_top20': device_ms,
+            'by_location': location_ms,
+            'outliers': outlier_ms
+        },
+        'degraded_devices': len(degraded),
+        'degraded_flagged': len(flagged & set(degraded)),
+        'other_flagged': len(flagged - set(degraded)),
+        'worst_device': rows[0]['hostname'] if rows else None,
+        'load': load_time(load_rows, 100, len(samples.values)) if load_rows else None
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--interval', type=int, default=300, help='Seconds between samples')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--load-rows', type=int, default=1_000_000, help='Rows in the load-time test (0 to skip)')
+    args = parser.parse_args(argv)
+    json.dump(run(args.devices, args.days, args.interval, args.repeat, args.load_rows), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
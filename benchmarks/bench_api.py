@@ -0,0 +1,108 @@
+"""Device list and metrics endpoints: query time against JSON serialization.
+
+Seeds a temporary SQLite database with a fleet of devices and one device
+with a run of raw samples, then times GET /api/devices and a raw-resolution
+GET /api/devices/<id>/metrics through the Flask test client with the
+response cache off. Each endpoint is also split into its two halves, the
+database query and building the JSON response, timed separately inside a
+request context.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 3)
+
+
+def run(devices=1000, samples=5000, repeat=20):
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'network_monitor.db')}"
+        os.environ['RESPONSE_CACHE_SIZE'] = '0'
+        os.environ.setdefault('SPEEDTEST_BACKEND', 'fake')
+        from flask import jsonify
+        from app import app, db, device_json, metrics_store, ph_time_formatter, METRIC_FIELDS
+        from models import Device
+
+        until = datetime.utcnow().replace(microsecond=0)
+        since = until - timedelta(seconds=10 * samples)
+        with app.app_context():
+            db.session.add_all(Device(
+                hostname=f'HOST-{i:05d}', username=f'user{i}', location=f'Site {i % 20}', last_seen=until,
+                connection_type='Wi-Fi', wifi_ssid=f'SSID-{i % 50}', signal_strength='-58 dBm', status='online'
+            ) for i in range(1, devices + 1))
+            db.session.commit()
+            metrics_store.append([{
+                'device_id': 1,
+                'timestamp': since + timedelta(seconds=10 * step),
+                'latency': 20.0 + step % 13,
+                'dns_resolution_time': 10.0 + step % 7,
+                'download_speed': None,
+                'upload_speed': None
+            } for step in range(samples)])
+            db.session.commit()
+
+        client = app.test_client()
+        metrics_path = (
+            f'/api/devices/1/metrics?since={since.isoformat()}&until={until.isoformat()}&max_points={samples * 2}'
+        )
+        response = client.get(metrics_path)
+        assert response.headers['X-Resolution'] == 'raw' and len(response.get_json()) == samples
+        results = {
+            'devices': devices,
+            'samples': samples,
+            'get_devices': {
+                'request_ms': median_ms(lambda: client.get('/api/devices'), repeat),
+                'response_bytes': len(client.get('/api/devices').data)
+            },
+            'device_metrics': {
+                'request_ms': median_ms(lambda: client.get(metrics_path), repeat),
+                'response_bytes': len(response.data)
+            }
+        }
+
+        with app.test_request_context():
+            def query_devices():
+                db.session.expire_all()
+                return Device.query.all()
+            fleet = query_devices()
+            results['get_devices']['query_ms'] = median_ms(query_devices, repeat)
+            results['get_devices']['serialize_ms'] = median_ms(lambda: jsonify([device_json(d) for d in fleet]), repeat)
+
+            rows = metrics_store.query(1, since, until, METRIC_FIELDS)
+            format_time = ph_time_formatter(since, until)
+            results['device_metrics']['query_ms'] = median_ms(
+                lambda: metrics_store.query(1, since, until, METRIC_FIELDS), repeat
+            )
+            results['device_metrics']['serialize_ms'] = median_ms(lambda: jsonify([
+                dict(zip(METRIC_FIELDS, row[2:]), timestamp=format_time(row[1])) for row in rows
+            ]), repeat)
+            db.session.remove()
+        with app.app_context():
+            db.engine.dispose()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--samples', type=int, default=5000, help='Raw samples returned by the metrics query')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+    json.dump(run(args.devices, args.samples, args.repeat), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
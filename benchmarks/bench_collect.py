@@ -0,0 +1,132 @@
+"""Agent collection cycle overhead with stubbed probes.
+
+Runs NetworkAgent.collect_metrics for every probe group with the network
+probes replaced by stubs, so the figures are the agent's own cost:
+scheduling probes on the runner, assembling the sample, the passive
+traffic summary and the speed test decision. A second pass gives every
+stub the same delay to show that one cycle takes about as long as its
+slowest probe rather than the sum of them. A last pass times the speed
+test group alone with a fresh baseline, when the test is skipped and the
+cycle runs no probes. The device is never registered and nothing is
+uploaded.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import network_agent
+
+GROUPS = ('connection', 'dns', 'ping', 'speed_test')
+
+
+def stub_probes(delay):
+    """Stand-ins for the network probes returning realistically shaped results"""
+    def wait():
+        if delay:
+            time.sleep(delay)
+
+    def connection_info():
+        wait()
+        return {'interface': 'wlan0', 'connection_type': 'Wi-Fi', 'wifi_ssid': 'Branch-Office',
+                'signal_strength': '-58 dBm'}
+
+    def ip_addresses():
+        wait()
+        return {'internal_ip': '192.168.1.42', 'external_ip': '192.168.1.42'}
+
+    def dns():
+        wait()
+        stats = {'queries': 6, 'answered': 6, 'failure_rate': 0.0, 'min': 9.8, 'avg': 12.5, 'p50': 11.9,
+                 'p95': 16.2, 'max': 16.2, 'errors': {}}
+        return {'avg': 12.5, 'resolvers': {r: dict(stats, resolver=r) for r in ('192.168.1.1', '8.8.8.8')}}
+
+    def latency(host, count):
+        wait()
+        return {'sent': count, 'received': count, 'packet_loss': 0.0, 'min': 17.1, 'avg': 19.8, 'max': 23.4,
+                'stddev': 2.1, 'jitter': 1.4, 'host': host, 'method': 'icmp'}
+
+    def speed_test():
+        wait()
+        return {'download': 100.0, 'upload': 20.0}
+
+    return {
+        'get_connection_info': connection_info,
+        'get_ip_addresses': ip_addresses,
+        'measure_dns': dns,
+        'measure_latency': latency,
+        'run_speed_test': speed_test
+    }
+
+
+def make_agent(directory):
+    network_agent.SPOOL_PATH = os.path.join(directory, 'metrics_spool.db')
+
+    def register_device(agent):
+        agent.device_id = 1
+        return True
+    network_agent.NetworkAgent.register_device = register_device
+    return network_agent.NetworkAgent(cloud_endpoint='http://127.0.0.1:9/api')
+
+
+def time_cycles(agent, delay, cycles):
+    for name, func in stub_probes(delay).items():
+        setattr(network_agent, name, func)
+    timings = []
+    for _ in range(cycles):
+        # Without a baseline every cycle runs the speed test stub as well
+        agent.speed_test_policy.baseline = None
+        start = time.perf_counter()
+        metrics = agent.collect_metrics(GROUPS)
+        timings.append((time.perf_counter() - start) * 1000)
+    assert metrics and metrics['speed_test'] == {'download': 100.0, 'upload': 20.0}, metrics
+    return statistics.median(timings), metrics
+
+
+def time_skipped_speed_tests(agent, cycles):
+    """Cycles of the speed test group alone while the baseline is fresh"""
+    agent.speed_test_policy.record({'download': 100.0, 'upload': 20.0})
+    timings = []
+    for _ in range(cycles):
+        start = time.perf_counter()
+        metrics = agent.collect_metrics(['speed_test'])
+        timings.append((time.perf_counter() - start) * 1000)
+    assert metrics and 'speed_test' not in metrics and 'traffic' in metrics, metrics
+    return statistics.median(timings)
+
+
+def run(cycles=200, delay=0.05, delayed_cycles=10):
+    probes = 4 + len(network_agent.PING_HOSTS)
+    with tempfile.TemporaryDirectory() as directory:
+        agent = make_agent(directory)
+        try:
+            cycle_ms, metrics = time_cycles(agent, 0, cycles)
+            delayed_ms, _ = time_cycles(agent, delay, delayed_cycles)
+            skipped_ms = time_skipped_speed_tests(agent, cycles)
+        finally:
+            agent.stop()
+    return {
+        'probes_per_cycle': probes,
+        'cycle_ms': round(cycle_ms, 3),
+        'payload_bytes': len(json.dumps(metrics)),
+        'probe_delay_ms': delay * 1000,
+        'delayed_cycle_ms': round(delayed_ms, 1),
+        'serial_cycle_ms': round(delay * 1000 * probes, 1),
+        'skipped_speed_test_cycle_ms': round(skipped_ms, 3)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cycles', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.05, help='Seconds every stub probe takes in the second pass')
+    parser.add_argument('--delayed-cycles', type=int, default=10)
+    args = parser.parse_args(argv)
+    json.dump(run(args.cycles, args.delay, args.delayed_cycles), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
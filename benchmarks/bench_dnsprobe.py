@@ -0,0 +1,170 @@
+"""DNS prober accuracy and behaviour against local stub resolvers.
+
+Starts tiny UDP DNS servers on localhost that answer after a fixed delay,
+drop some queries, return SERVFAIL for chosen names or echo the wrong
+question, then checks that dnsprobe reports each case correctly: latency
+close to the delay, failure rates and error codes, distinct IDs and
+randomized names, and resolvers probed concurrently rather than one after
+another. Also times how long a probe of an instant resolver takes.
+"""
+import sys
+import json
+import time
+import socket
+import struct
+import argparse
+import threading
+import statistics
+import dnsprobe
+
+
+class StubResolver:
+    """Answers every query with an empty NOERROR response after delay seconds.
+
+    Every drop_every-th query goes unanswered, names in servfail get
+    SERVFAIL and names in mismatch get a reply for another question.
+    """
+
+    def __init__(self, delay=0.0, drop_every=0, servfail=(), mismatch=()):
+        self.delay = delay
+        self.drop_every = drop_every
+        self.servfail = set(servfail)
+        self.mismatch = set(mismatch)
+        self.queries = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = f'127.0.0.1:{self.sock.getsockname()[1]}'
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                packet, address = self.sock.recvfrom(512)
+            except OSError:
+                return
+            query_id, flags = struct.unpack('!HH', packet[:4])
+            question = packet[12:]
+            name = decode_name(question)
+            self.queries.append((query_id, name))
+            if self.drop_every and len(self.queries) % self.drop_every == 0:
+                continue
+            rcode = 2 if name in self.servfail else 0
+            if name in self.mismatch:
+                question = dnsprobe.encode_name('other.' + name) + question[-4:]
+            response = struct.pack('!HHHHHH', query_id, 0x8000 | (flags & 0x0100) | 0x0080 | rcode, 1, 0, 0, 0)
+            self.reply(response + question, address)
+
+    def reply(self, packet, address):
+        if self.delay:
+            threading.Timer(self.delay, self.sock.sendto, (packet, address)).start()
+        else:
+            self.sock.sendto(packet, address)
+
+    def close(self):
+        self.sock.close()
+
+
+def decode_name(question):
+    labels, offset = [], 0
+    while question[offset]:
+        length = question[offset]
+        labels.append(question[offset + 1:offset + 1 + length].decode('ascii'))
+        offset += 1 + length
+    return '.'.join(labels)
+
+
+def closed_port():
+    """A localhost UDP port nothing listens on"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def check_behaviour(delay):
+    """Raise AssertionError at the first report that misdescribes a stub"""
+    names = ['example.com', 'example.org']
+    results = {}
+
+    stub = StubResolver(delay=delay)
+    stats = dnsprobe.probe_resolver(stub.address, names, count=5, timeout=2, randomize_names=False)
+    assert stats['queries'] == stats['answered'] == 10 and stats['failure_rate'] == 0.0, stats
+    assert delay * 1000 <= stats['min'] <= stats['p50'] <= stats['p95'] <= stats['max'], stats
+    assert len({query_id for query_id, _ in stub.queries}) == 10
+    assert sorted(name for _, name in stub.queries) == sorted(names * 5)
+    results['delay_error_ms'] = round(stats['p50'] - delay * 1000, 3)
+    stub.close()
+
+    stub = StubResolver()
+    dnsprobe.probe_resolver(stub.address, names, count=5, timeout=2, randomize_names=True)
+    seen = [name for _, name in stub.queries]
+    assert len(set(seen)) == 10 and all(name.split('.', 1)[1] in names for name in seen), seen
+    stub.close()
+
+    stub = StubResolver(drop_every=3)
+    stats = dnsprobe.probe_resolver(stub.address, names, count=3, timeout=0.3, randomize_names=False)
+    assert stats['answered'] == 4 and stats['errors'] == {'timeout': 2} and stats['failure_rate'] == 33.33, stats
+    stub.close()
+
+    stub = StubResolver(servfail={'broken.example'}, mismatch={'spoofed.example'})
+    stats = dnsprobe.probe_resolver(
+        stub.address, ['example.com', 'broken.example', 'spoofed.example'], count=2, timeout=0.3,
+        randomize_names=False
+    )
+    assert stats['answered'] == 2 and stats['errors'] == {'SERVFAIL': 2, 'timeout': 2}, stats
+    stub.close()
+
+    # Nothing listening: the probe fails fast or at its timeout, never raises
+    start = time.perf_counter()
+    stats = dnsprobe.probe_resolver(f'127.0.0.1:{closed_port()}', names, count=2, timeout=0.5)
+    assert stats['answered'] == 0 and stats['failure_rate'] == 100.0, stats
+    assert time.perf_counter() - start < 1.0
+
+    # Slow resolvers probed together take about as long as one
+    stubs = [StubResolver(delay=0.2) for _ in range(3)]
+    start = time.perf_counter()
+    for stub in stubs:
+        dnsprobe.probe_resolver(stub.address, names, count=3, timeout=2)
+    serial = time.perf_counter() - start
+    start = time.perf_counter()
+    report = dnsprobe.probe_resolvers([stub.address for stub in stubs], names, count=3, timeout=2)
+    concurrent = time.perf_counter() - start
+    assert all(s['answered'] == 6 for s in report['resolvers'].values()) and report['avg'] >= 200, report
+    assert concurrent < serial / 2, (serial, concurrent)
+    results['serial_resolvers_ms'] = round(serial * 1000, 1)
+    results['concurrent_resolvers_ms'] = round(concurrent * 1000, 1)
+    for stub in stubs:
+        stub.close()
+    return results
+
+
+def probe_cost(repeat, count):
+    stub = StubResolver()
+    names = ['example.com', 'example.org']
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        dnsprobe.probe_resolver(stub.address, names, count=count, timeout=2)
+        timings.append((time.perf_counter() - start) * 1000)
+    stub.close()
+    return {'queries_per_probe': count * len(names), 'probe_ms': round(statistics.median(timings), 3)}
+
+
+def run(delay=0.02, repeat=50, count=3):
+    return {'behaviour': check_behaviour(delay), 'cost': probe_cost(repeat, count)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--delay', type=float, default=0.02, help='Seconds the stub waits before answering')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--count', type=int, default=3, help='Queries per name')
+    args = parser.parse_args(argv)
+    json.dump(run(args.delay, args.repeat, args.count), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
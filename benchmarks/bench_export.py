@@ -0,0 +1,118 @@
+"""Bulk export throughput in rows/sec and peak memory, per output format.
+
+Builds a synthetic database, then streams the whole table through
+export.stream_export() in every available format and compares it with the
+load-everything-then-serialize approach of the paged JSON endpoint. Peak
+Python heap use is measured with tracemalloc at two export sizes to show
+that streaming memory stays flat.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from datetime import timedelta
+from sqlalchemy import create_engine, event, text
+import export
+import migrations
+from models import db
+from benchmarks.bench_metrics_query import build_database
+
+
+def measure(func, rows):
+    """Rows/sec and peak traced memory of one export run"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'rows': rows,
+        'rows_per_sec': round(rows / seconds) if seconds else None,
+        'output_mb': round(size / 1e6, 1),
+        'peak_mb': round(peak / 1e6, 2)
+    }
+
+
+def streamed(engine, export_format, since, until):
+    def run_export():
+        size = 0
+        for part in export.stream_export(engine, export_format, since, until):
+            size += len(part)
+        return size
+    return run_export
+
+
+def buffered(engine, since, until):
+    """The pre-export approach: fetch every row, then serialize one JSON document"""
+    def run_export():
+        with engine.connect() as conn:
+            rows = conn.execute(text(
+                'SELECT device_id, timestamp, dns_resolution_time, download_speed, upload_speed, latency '
+                'FROM network_metrics WHERE timestamp >= :since AND timestamp < :until '
+                'ORDER BY device_id, timestamp, id'
+            ), {'since': since, 'until': until}).all()
+        columns = export.export_columns('raw', export.ROLLUP_FIELDS)
+        body = json.dumps([dict(zip(columns, row)) for row in rows])
+        return len(body)
+    return run_export
+
+
+def export_rows(engine, since, until):
+    with engine.connect() as conn:
+        return conn.execute(text(
+            'SELECT COUNT(*) FROM network_metrics WHERE timestamp >= :since AND timestamp < :until'
+        ), {'since': since, 'until': until}).scalar()
+
+
+def run(rows=1_000_000, devices=100, path=None):
+    directory = None
+    if path is None:
+        directory = tempfile.TemporaryDirectory()
+        path = os.path.join(directory.name, 'network_monitor.db')
+
+    formats = ['csv', 'ndjson'] + (['parquet', 'arrow'] if export.ARROW_AVAILABLE else [])
+    results = {}
+    try:
+        now = build_database(path, rows, devices)
+        engine = create_engine(f'sqlite:///{path}')
+        event.listen(engine, 'connect', migrations.apply_sqlite_pragmas)
+        # The app creates tables added since the original schema before migrating
+        db.metadata.create_all(engine)
+        migrations.migrate(engine)
+
+        until = now + timedelta(seconds=1)
+        history = timedelta(seconds=300 * (rows // devices))
+        # A tenth of the data, then all of it
+        for label, since in (('tenth', now - history / 10), ('full', now - history - timedelta(seconds=1))):
+            count = export_rows(engine, since, until)
+            results[label] = {name: measure(streamed(engine, name, since, until), count) for name in formats}
+            results[label]['json_buffered'] = measure(buffered(engine, since, until), count)
+        engine.dispose()
+    finally:
+        if directory is not None:
+            directory.cleanup()
+
+    return {
+        'rows': rows,
+        'devices': devices,
+        'chunk_size': export.CHUNK_SIZE,
+        'results': results
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--path', help='Where to build the database (default: a temporary file)')
+    args = parser.parse_args(argv)
+    json.dump(run(args.rows, args.devices, args.path), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Cost of instrumentation: per-update overhead and its share of API requests.
+
+Times counter increments, histogram observations and a timed() probe
+wrapper in a tight loop, then serves the device list and per-device
+metrics queries through the Flask test client with the registry enabled
+and disabled, alternating rounds so both see the same cache and database
+state.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+
+def per_call_ns(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+def micro(iterations):
+    import instrumentation
+    registry = instrumentation.Registry()
+    counter = registry.counter('bench_total', 'Benchmark counter', ['kind'])
+    histogram = registry.histogram('bench_seconds', 'Benchmark histogram', ['kind'])
+
+    def noop():
+        return 1
+    wrapped = instrumentation.timed(histogram, 'probe')(noop)
+
+    results = {
+        'noop_call_ns': per_call_ns(noop, iterations),
+        'counter_inc_ns': per_call_ns(lambda: counter.inc('a'), iterations),
+        'histogram_observe_ns': per_call_ns(lambda: histogram.observe(0.0123, 'a'), iterations),
+        'timed_call_ns': per_call_ns(wrapped, iterations)
+    }
+    registry.enabled = False
+    results['disabled_histogram_observe_ns'] = per_call_ns(lambda: histogram.observe(0.0123, 'a'), iterations)
+    return {name: round(value, 1) for name, value in results.items()}
+
+
+def requests_overhead(devices, samples, rounds, requests_per_round):
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'network_monitor.db')}"
+        # Every request is served from the database, not the response cache
+        os.environ['RESPONSE_CACHE_SIZE'] = '0'
+        os.environ.setdefault('SPEEDTEST_BACKEND', 'fake')
+        import instrumentation
+        from app import app, db
+
+        client = app.test_client()
+        now = datetime.utcnow()
+        for i in range(devices):
+            client.post('/api/devices', json={'location': 'Bench', 'device_info': {'hostname': f'BENCH-{i:04d}'}})
+        batch = [{
+            'device_id': device_id,
+            'timestamp': (now - timedelta(seconds=30 * step)).isoformat(),
+            'dns_resolution_time': 20 + step % 7,
+            'ping_results': {'8.8.8.8': 30 + step % 11}
+        } for device_id in range(1, devices + 1) for step in range(samples)]
+        for i in range(0, len(batch), 1000):
+            client.post('/api/devices/metrics/batch', json={'samples': batch[i:i + 1000]})
+
+        paths = {'get_devices': '/api/devices', 'device_metrics': '/api/devices/1/metrics?timeframe=hour'}
+        timings = {(name, enabled): [] for name in paths for enabled in (True, False)}
+        for _ in range(rounds):
+            for enabled in (True, False):
+                instrumentation.REGISTRY.enabled = enabled
+                for name, path in paths.items():
+                    start = time.perf_counter()
+                    for _ in range(requests_per_round):
+                        client.get(path)
+                    timings[(name, enabled)].append((time.perf_counter() - start) / requests_per_round * 1e6)
+        instrumentation.REGISTRY.enabled = True
+        with app.app_context():
+            db.engine.dispose()
+
+    results = {}
+    for name in paths:
+        on = statistics.median(timings[(name, True)])
+        off = statistics.median(timings[(name, False)])
+        results[name] = {
+            'instrumented_us': round(on, 1),
+            'uninstrumented_us': round(off, 1),
+            'overhead_us': round(on - off, 1),
+            'overhead_pct': round((on - off) / off * 100, 2)
+        }
+    return results
+
+
+def run(iterations=200000, devices=20, samples=100, rounds=7, requests_per_round=200):
+    return {
+        'micro': micro(iterations),
+        'requests': requests_overhead(devices, samples, rounds, requests_per_round)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--devices', type=int, default=20)
+    parser.add_argument('--samples', type=int, default=100, help='Metric samples per device')
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per path per round')
+    args = parser.parse_args(argv)
+    json.dump(run(args.iterations, args.devices, args.samples, args.rounds, args.requests), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Metrics query latency on a synthetic database, before and after tuning.
+
+Builds a network_monitor.db with the original (unindexed) schema, times the
+queries the API runs, then applies migrations.migrate() and the SQLite
+pragmas the app uses and times them again.
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event
+import migrations
+from models import db
+
+SCHEMA = [
+    'CREATE TABLE device ('
+    'id INTEGER NOT NULL, hostname VARCHAR(100) NOT NULL, username VARCHAR(100), '
+    'location VARCHAR(100), last_seen DATETIME, connection_type VARCHAR(50), '
+    'wifi_ssid VARCHAR(100), signal_strength VARCHAR(20), internal_ip VARCHAR(50), '
+    'external_ip VARCHAR(50), status VARCHAR(20), PRIMARY KEY (id))',
+    'CREATE TABLE network_metrics ('
+    'id INTEGER NOT NULL, device_id INTEGER NOT NULL, timestamp DATETIME, '
+    'dns_resolution_time FLOAT, download_speed FLOAT, upload_speed FLOAT, latency FLOAT, '
+    'PRIMARY KEY (id), FOREIGN KEY(device_id) REFERENCES device (id))'
+]
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def build_database(path, rows, devices, interval=300):
+    """Create a database with the original schema and synthetic samples"""
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.executemany(
+        'INSERT INTO device (id, hostname, username, location, status) VALUES (?, ?, ?, ?, ?)',
+        ((i, f'HOST-{i:05d}', f'user{i}', f'Site {i % 20}', 'online') for i in range(1, devices + 1))
+    )
+
+    now = datetime.utcnow()
+    per_device = rows // devices
+    rng = random.Random(42)
+
+    def samples():
+        for step in range(per_device):
+            timestamp = (now - timedelta(seconds=interval * (per_device - step))).strftime(TIME_FORMAT)
+            for device_id in range(1, devices + 1):
+                yield (device_id, timestamp, rng.uniform(5, 80), None, None, rng.uniform(10, 200))
+
+    conn.executemany(
+        'INSERT INTO network_metrics (device_id, timestamp, dns_resolution_time, download_speed, '
+        'upload_speed, latency) VALUES (?, ?, ?, ?, ?, ?)',
+        samples()
+    )
+    conn.commit()
+    conn.close()
+    return now
+
+
+def time_queries(conn, now, devices, repeat):
+    """Median latency in ms of each API query"""
+    rng = random.Random(7)
+    hour_ago = (now - timedelta(hours=1)).strftime(TIME_FORMAT)
+    month_ago = (now - timedelta(days=30)).strftime(TIME_FORMAT)
+    until = now.strftime(TIME_FORMAT)
+
+    queries = {
+        'device_hour': lambda d: conn.execute(
+            'SELECT * FROM network_metrics WHERE device_id = ? AND timestamp >= ? AND timestamp < ? '
+            'ORDER BY timestamp', (d, hour_ago, until)).fetchall(),
+        'device_month_count': lambda d: conn.execute(
+            'SELECT COUNT(*) FROM network_metrics WHERE device_id = ? AND timestamp >= ? AND timestamp < ?',
+            (d, month_ago, until)).fetchall(),
+        'hostname_lookup': lambda d: conn.execute(
+            'SELECT id FROM device WHERE hostname = ? LIMIT 1', (f'HOST-{d:05d}',)).fetchall(),
+        'delete_device': lambda d: (
+            conn.execute('SAVEPOINT bench'),
+            conn.execute('DELETE FROM network_metrics WHERE device_id = ?', (d,)),
+            conn.execute('ROLLBACK TO bench'),
+            conn.execute('RELEASE bench')
+        )
+    }
+
+    results = {}
+    for name, query in queries.items():
+        timings = []
+        for _ in range(repeat):
+            device_id = rng.randint(1, devices)
+            start = time.perf_counter()
+            query(device_id)
+            timings.append((time.perf_counter() - start) * 1000)
+        results[name] = round(statistics.median(timings), 3)
+    return results
+
+
+def run(rows=10_000_000, devices=1000, repeat=5, path=None):
+    directory = None
+    if path is None:
+        directory = tempfile.TemporaryDirectory()
+        path = os.path.join(directory.name, 'network_monitor.db')
+
+    try:
+        start = time.perf_counter()
+        now = build_database(path, rows, devices)
+        build_seconds = time.perf_counter() - start
+
+        conn = sqlite3.connect(path, isolation_level=None)
+        before = time_queries(conn, now, devices, repeat)
+        conn.close()
+
+        engine = create_engine(f'sqlite:///{path}')
+        event.listen(engine, 'connect', migrations.apply_sqlite_pragmas)
+        # The app creates tables added since the original schema before migrating
+        db.metadata.create_all(engine)
+        start = time.perf_counter()
+        migrations.migrate(engine)
+        migrate_seconds = time.perf_counter() - start
+
+        conn = engine.raw_connection()
+        conn.isolation_level = None
+        after = time_queries(conn, now, devices, repeat)
+        conn.close()
+        engine.dispose()
+    finally:
+        if directory is not None:
+            directory.cleanup()
+
+    return {
+        'rows': rows,
+        'devices': devices,
+        'build_seconds': round(build_seconds, 1),
+        'migrate_seconds': round(migrate_seconds, 1),
+        'before_ms': before,
+        'after_ms': after
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--path', help='Where to build the database (default: a temporary file)')
+    args = parser.parse_args(argv)
+    json.dump(run(args.rows, args.devices, args.repeat, args.path), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Network state discovery: full lookups against the change-detecting cache.
+
+Times a full discovery of connection and IP details, which forks netsh
+or iw on Wi-Fi and resolves the host name, against a refresh that finds
+the fingerprint unchanged. How much the cache saves depends on the host:
+a wired Linux machine with the host name in /etc/hosts discovers almost
+as fast as it fingerprints, a Windows laptop on Wi-Fi does not. Also
+times the parsers for netsh, iw, /proc/net/route and /proc/net/wireless
+output on recorded samples, checking each result against the sample.
+"""
+import sys
+import json
+import time
+import argparse
+import statistics
+import psutil
+import netstate
+
+NETSH_WLAN = '''
+There are 2 interfaces on the system:
+
+    Name                   : Wi-Fi
+    Description            : Intel(R) Wi-Fi 6 AX201 160MHz
+    GUID                   : 2b1c5e7a-0f3d-4d8e-9a61-3c2f5b7d9e10
+    Physical address       : 3c:58:c2:aa:bb:cc
+    State                  : connected
+    SSID                   : Branch-Office: 2nd floor
+    BSSID                  : 70:3a:0e:11:22:33
+    Network type           : Infrastructure
+    Radio type             : 802.11ax
+    Authentication         : WPA2-Enterprise
+    Channel                : 36
+    Receive rate (Mbps)    : 1201
+    Transmit rate (Mbps)   : 1201
+    Signal                 : 84%
+    Profile                : Branch-Office
+
+    Name                   : Wi-Fi 2
+    Description            : USB Wireless Adapter
+    State                  : disconnected
+
+    Hosted network status  : Not available
+'''
+
+IW_LINK = '''Connected to 70:3a:0e:11:22:33 (on wlan0)
+\tSSID: Branch-Office
+\tfreq: 5180
+\tRX: 123456 bytes (789 packets)
+\tsignal: -58 dBm
+\ttx bitrate: 866.7 MBit/s VHT-MCS 9 80MHz short GI VHT-NSS 2
+'''
+
+PROC_NET_ROUTE = '''Iface\tDestination\tGateway \tFlags\tRefCnt\tUse\tMetric\tMask\t\tMTU\tWindow\tIRTT
+wlan0\t00000000\t0101A8C0\t0003\t0\t0\t600\t00000000\t0\t0\t0
+eth0\t00000000\t0100A8C0\t0003\t0\t0\t100\t00000000\t0\t0\t0
+eth0\t0000A8C0\t00000000\t0001\t0\t0\t100\t00FFFFFF\t0\t0\t0
+'''
+
+PROC_NET_WIRELESS = '''Inter-| sta-|   Quality        |   Discarded packets               | Missed | WE
+ face | tus | link level noise |  nwid  crypt   frag  retry   misc | beacon | 22
+ wlan0: 0000   54.  -56.  -256        0      0      0      0     12        0
+'''
+
+PARSERS = {
+    'netsh_wlan': (netstate.parse_netsh_wlan, NETSH_WLAN,
+                   {'wifi_ssid': 'Branch-Office: 2nd floor', 'signal_strength': '-58 dBm'}),
+    'iw_link': (netstate.parse_iw_link, IW_LINK, {'wifi_ssid': 'Branch-Office', 'signal_dbm': -58.0}),
+    'proc_route': (netstate.parse_proc_route, PROC_NET_ROUTE, 'eth0'),
+    'proc_wireless': (netstate.parse_proc_wireless, PROC_NET_WIRELESS,
+                      {'wlan0': {'link_quality': 54.0, 'signal_dbm': -56.0}})
+}
+
+
+def per_call_us(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def parsers(iterations):
+    results = {}
+    for name, (parse, sample, expected) in PARSERS.items():
+        got = parse(sample)
+        assert got == expected, f'{name}: {got!r} != {expected!r}'
+        results[f'{name}_us'] = round(per_call_us(lambda: parse(sample), iterations), 2)
+    return results
+
+
+def discovery(repeat, iterations):
+    state = netstate.NetworkState()
+    route = netstate.default_route(psutil.net_if_addrs(), psutil.net_if_stats())
+    full = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        state.discover(route)
+        full.append((time.perf_counter() - start) * 1000)
+
+    # What a Wi-Fi adapter adds to every full discovery: forking netsh or iw
+    wifi = []
+    for _ in range(repeat if route[0] else 0):
+        start = time.perf_counter()
+        netstate.wifi_details(route[0])
+        wifi.append((time.perf_counter() - start) * 1000)
+
+    def cycle():
+        # A new collection cycle, past the reuse interval of the last check
+        state.checked_at = None
+        state.connection_info()
+        state.ip_addresses()
+
+    state.refresh()
+    cached = per_call_us(cycle, iterations) / 1000
+    fingerprint = per_call_us(
+        lambda: netstate.fingerprint(psutil.net_if_addrs(), psutil.net_if_stats(), route), iterations
+    ) / 1000
+    return {
+        'interface': state.interface,
+        'connection_type': state.connection.get('connection_type'),
+        'full_discovery_ms': round(statistics.median(full), 3),
+        'wifi_lookup_ms': round(statistics.median(wifi), 3) if wifi else None,
+        'cached_cycle_ms': round(cached, 3),
+        'fingerprint_ms': round(fingerprint, 3),
+        'speedup': round(statistics.median(full) / cached, 2)
+    }
+
+
+def run(repeat=20, iterations=2000):
+    return {'discovery': discovery(repeat, iterations), 'parsers': parsers(iterations * 10)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20, help='Full discoveries to time')
+    parser.add_argument('--iterations', type=int, default=2000, help='Cached refreshes to time')
+    args = parser.parse_args(argv)
+    json.dump(run(args.repeat, args.iterations), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Agent output parsers: correctness and time per call on recorded output.
+
+Covers network_monitor.parse_ping_output on ping output from Linux,
+macOS and localized Windows, and the netstate parsers for netsh, iw and
+/proc on the samples recorded in bench_netstate. Every parser result is
+checked against the value the sample holds before it is timed.
+"""
+import sys
+import json
+import time
+import argparse
+from network_monitor import parse_ping_output
+from benchmarks.bench_netstate import PARSERS as NETSTATE_PARSERS
+
+PING_LINUX = '''PING 8.8.8.8 (8.8.8.8) 56(84) bytes of data.
+64 bytes from 8.8.8.8: icmp_seq=1 ttl=117 time=12.3 ms
+
+--- 8.8.8.8 ping statistics ---
+1 packets transmitted, 1 received, 0% packet loss, time 0ms
+rtt min/avg/max/mdev = 12.345/12.345/12.345/0.000 ms
+'''
+
+PING_MACOS = '''PING 8.8.8.8 (8.8.8.8): 56 data bytes
+64 bytes from 8.8.8.8: icmp_seq=0 ttl=117 time=11.842 ms
+
+--- 8.8.8.8 ping statistics ---
+1 packets transmitted, 1 packets received, 0.0% packet loss
+round-trip min/avg/max/stddev = 11.842/11.842/11.842/0.000 ms
+'''
+
+PING_WINDOWS = '''
+Pinging 8.8.8.8 with 32 bytes of data:
+Reply from 8.8.8.8: bytes=32 time=14ms TTL=117
+
+Ping statistics for 8.8.8.8:
+    Packets: Sent = 1, Received = 1, Lost = 0 (0% loss),
+Approximate round trip times in milli-seconds:
+    Minimum = 14ms, Maximum = 14ms, Average = 14ms
+'''
+
+PING_WINDOWS_GERMAN = '''
+Ping wird ausgeführt für 8.8.8.8 mit 32 Bytes Daten:
+Antwort von 8.8.8.8: Bytes=32 Zeit=15ms TTL=117
+
+Ping-Statistik für 8.8.8.8:
+    Pakete: Gesendet = 1, Empfangen = 1, Verloren = 0
+    (0% Verlust),
+Ca. Zeitangaben in Millisek.:
+    Minimum = 15ms, Maximum = 15ms, Mittelwert = 15ms
+'''
+
+PING_WINDOWS_LOCAL = '''
+Pinging 127.0.0.1 with 32 bytes of data:
+Reply from 127.0.0.1: bytes=32 time<1ms TTL=128
+
+Ping statistics for 127.0.0.1:
+    Packets: Sent = 1, Received = 1, Lost = 0 (0% loss),
+Approximate round trip times in milli-seconds:
+    Minimum = 0ms, Maximum = 0ms, Average = 0ms
+'''
+
+PING_TIMEOUT = '''
+Pinging 192.0.2.1 with 32 bytes of data:
+Request timed out.
+
+Ping statistics for 192.0.2.1:
+    Packets: Sent = 1, Received = 0, Lost = 1 (100% loss),
+'''
+
+PARSERS = {
+    'ping_linux': (parse_ping_output, PING_LINUX, 12.3),
+    'ping_macos': (parse_ping_output, PING_MACOS, 11.842),
+    'ping_windows': (parse_ping_output, PING_WINDOWS, 14.0),
+    'ping_windows_german': (parse_ping_output, PING_WINDOWS_GERMAN, 15.0),
+    'ping_windows_local': (parse_ping_output, PING_WINDOWS_LOCAL, 0.0),
+    'ping_timeout': (parse_ping_output, PING_TIMEOUT, None),
+    **NETSTATE_PARSERS
+}
+
+
+def run(iterations=20000):
+    results = {}
+    for name, (parse, sample, expected) in PARSERS.items():
+        got = parse(sample)
+        assert got == expected, f'{name}: {got!r} != {expected!r}'
+        start = time.perf_counter()
+        for _ in range(iterations):
+            parse(sample)
+        results[f'{name}_us'] = round((time.perf_counter() - start) / iterations * 1e6, 2)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args(argv)
+    json.dump(run(args.iterations), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Passive sampling cost and the synthetic traffic it saves.
+
+Times one read of the interface counters into the ring buffer and a
+summary over a full buffer, then replays days of agent cycles on
+synthetic traffic through SpeedTestPolicy and counts the speed tests it
+runs against the hourly schedule, together with the bytes those tests
+push through the link. Traffic profiles: an idle link, an office link
+whose working hours confirm the baseline, a link whose capacity drops
+halfway through, and one upgraded to a faster plan.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+from collections import namedtuple
+import passive
+
+Counters = namedtuple('Counters', 'bytes_recv bytes_sent')
+
+# Capacity in Mbps a speed test measures, and seconds it saturates each direction
+CAPACITY = {'download': 100.0, 'upload': 20.0}
+TEST_SECONDS = 10
+
+PROFILES = ('idle', 'office', 'degraded', 'upgraded')
+
+
+def sampling_cost(iterations, capacity):
+    sampler = passive.PassiveSampler(capacity=capacity)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        sampler.sample()
+    sample_us = (time.perf_counter() - start) / iterations * 1e6
+
+    # A full buffer of synthetic traffic on a few interfaces
+    clock = [0.0]
+    totals = {name: [0, 0] for name in ('eth0', 'wlan0', 'lo')}
+    rng = random.Random(1)
+
+    def counters():
+        for value in totals.values():
+            value[0] += rng.randrange(1_000_000)
+            value[1] += rng.randrange(100_000)
+        return {name: Counters(*value) for name, value in totals.items()}
+
+    sampler = passive.PassiveSampler(capacity=capacity, counters=counters, clock=lambda: clock[0])
+    for _ in range(capacity + 1):
+        sampler.sample()
+        clock[0] += 1
+    start = time.perf_counter()
+    summary = sampler.summary()
+    summary_ms = (time.perf_counter() - start) * 1000
+    return {
+        'sample_us': round(sample_us, 1),
+        'summary_full_buffer_ms': round(summary_ms, 3),
+        'buffer_samples': summary['samples'],
+        'summary_bytes': len(json.dumps(summary))
+    }
+
+
+def traffic_mbps(profile, hour, rng):
+    """Peak and 95th percentile download/upload in Mbps during one cycle"""
+    capacity = dict(CAPACITY)
+    if profile == 'degraded' and hour >= 12:
+        capacity = {'download': 40.0, 'upload': 8.0}
+    if profile == 'upgraded' and hour >= 12:
+        capacity = {'download': 300.0, 'upload': 50.0}
+    busy = profile in ('office', 'degraded', 'upgraded') and 8 <= hour % 24 < 18
+    load = rng.uniform(0.85, 1.0) if busy and rng.random() < 0.3 else rng.uniform(0.0, 0.1)
+    peak = {direction: capacity[direction] * load for direction in capacity}
+    return capacity, {
+        'rx_mbps': {'avg': peak['download'] / 3, 'p95': peak['download'] * 0.9, 'peak': peak['download']},
+        'tx_mbps': {'avg': peak['upload'] / 3, 'p95': peak['upload'] * 0.9, 'peak': peak['upload']}
+    }
+
+
+def replay(profile, days, cycle, check_interval, max_age):
+    """Speed tests and their bytes over days of agent cycles"""
+    rng = random.Random(profile)
+    clock = [0.0]
+    policy = passive.SpeedTestPolicy(max_age=max_age, clock=lambda: clock[0])
+    tests, test_bytes, stale = 0, 0, 0
+    next_check = 0.0
+    while clock[0] < days * 86400:
+        hour = int(clock[0] // 3600)
+        capacity, window = traffic_mbps(profile, hour, rng)
+        ran = False
+        if clock[0] >= next_check:
+            next_check += check_interval
+            if policy.reason_to_test():
+                tests += 1
+                test_bytes += sum(capacity.values()) * 1e6 / 8 * TEST_SECONDS
+                policy.record(capacity)
+                ran = True
+        if not ran:
+            policy.observe(window)
+        # Hours in which the baseline is more than 30% off the real capacity
+        if clock[0] % 3600 == 0 and abs(policy.baseline['download'] - capacity['download']) > 0.3 * capacity['download']:
+            stale += 1
+        clock[0] += cycle
+    hourly = days * 86400 // check_interval
+    hourly_bytes = hourly * sum(CAPACITY.values()) * 1e6 / 8 * TEST_SECONDS
+    return {
+        'speed_tests': tests,
+        'scheduled_tests': hourly,
+        'test_megabytes': round(test_bytes / 1e6, 1),
+        'scheduled_megabytes': round(hourly_bytes / 1e6, 1),
+        'reduction': round(hourly / max(tests, 1), 1),
+        'hours_with_stale_baseline': stale
+    }
+
+
+def run(iterations=2000, capacity=passive.PASSIVE_BUFFER_SIZE, days=7, cycle=30, check_interval=3600,
+        max_age=passive.SPEEDTEST_MAX_AGE):
+    return {
+        'sampling': sampling_cost(iterations, capacity),
+        'speed_tests': {profile: replay(profile, days, cycle, check_interval, max_age) for profile in PROFILES}
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000, help='Counter reads to time')
+    parser.add_argument('--capacity', type=int, default=passive.PASSIVE_BUFFER_SIZE, help='Ring buffer samples')
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--cycle', type=int, default=30, help='Seconds between agent cycles')
+    parser.add_argument('--check-interval', type=int, default=3600, help='Seconds between speed test checks')
+    parser.add_argument('--max-age', type=int, default=passive.SPEEDTEST_MAX_AGE)
+    args = parser.parse_args(argv)
+    results = run(args.iterations, args.capacity, args.days, args.cycle, args.check_interval, args.max_age)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
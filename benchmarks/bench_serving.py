@@ -0,0 +1,169 @@
+"""HTTP load test of serve.py: requests/sec by web worker count.
+
+Seeds a temporary SQLite database over the API, then for each worker
+count starts serve.py on a free port and drives it with client processes
+issuing keep-alive GETs of the device list and per-device metrics for a
+fixed duration. Scaling is bounded by the cores of the machine running
+both the server and the clients.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import argparse
+import tempfile
+import subprocess
+import statistics
+import http.client
+from multiprocessing import Pool
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(database_url, workers, threads, server):
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        PORT=str(port),
+        HOST='127.0.0.1',
+        WEB_CONCURRENCY=str(workers),
+        WEB_THREADS=str(threads),
+        SPEEDTEST_BACKEND='fake',
+        # Keep the response cache off so worker counts are compared on the
+        # work each request does
+        RESPONSE_CACHE_SIZE='0'
+    )
+    if server:
+        env['SERVER'] = server
+    process = subprocess.Popen(
+        [sys.executable, 'serve.py'], cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('Server did not start')
+
+
+def request(conn, method, path, body=None):
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = conn.getresponse()
+    data = response.read()
+    return response.status, data
+
+
+def seed(port, devices, samples):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    now = datetime.utcnow()
+    for i in range(devices):
+        request(conn, 'POST', '/api/devices', {
+            'location': f'Site {i % 5}',
+            'device_info': {'hostname': f'BENCH-{i:04d}', 'username': 'bench'}
+        })
+    batch = [{
+        'device_id': device_id,
+        'timestamp': (now - timedelta(seconds=30 * step)).isoformat(),
+        'dns_resolution_time': 20 + step % 7,
+        'ping_results': {'8.8.8.8': 30 + step % 11}
+    } for device_id in range(1, devices + 1) for step in range(samples)]
+    for i in range(0, len(batch), 1000):
+        request(conn, 'POST', '/api/devices/metrics/batch', {'samples': batch[i:i + 1000]})
+    conn.close()
+
+
+def client(args):
+    """Issue requests until the deadline; returns per-request latencies in ms"""
+    port, devices, deadline, seed_value = args
+    rng = random.Random(seed_value)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    latencies = []
+    errors = 0
+    while time.time() < deadline:
+        if rng.random() < 0.3:
+            path = '/api/devices'
+        else:
+            path = f'/api/devices/{rng.randint(1, devices)}/metrics?timeframe=hour'
+        start = time.perf_counter()
+        try:
+            status, _ = request(conn, 'GET', path)
+            if status != 200:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        latencies.append((time.perf_counter() - start) * 1000)
+    conn.close()
+    return latencies, errors
+
+
+def run(worker_counts=(1, 2, 4), clients=8, duration=10, devices=50, samples=100, threads=4, server=None):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = f"sqlite:///{os.path.join(directory, 'network_monitor.db')}"
+        process, port = start_server(database_url, 1, threads, server)
+        try:
+            seed(port, devices, samples)
+        finally:
+            process.terminate()
+            process.wait()
+
+        for workers in worker_counts:
+            process, port = start_server(database_url, workers, threads, server)
+            try:
+                deadline = time.time() + duration
+                with Pool(clients) as pool:
+                    outcomes = pool.map(client, [(port, devices, deadline, i) for i in range(clients)])
+            finally:
+                process.terminate()
+                process.wait()
+            latencies = sorted(ms for result, _ in outcomes for ms in result)
+            results[workers] = {
+                'requests': len(latencies),
+                'errors': sum(errors for _, errors in outcomes),
+                'requests_per_sec': round(len(latencies) / duration, 1),
+                'p50_ms': round(statistics.median(latencies), 2) if latencies else None,
+                'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1], 2) if latencies else None
+            }
+
+    return {
+        'cpus': os.cpu_count(),
+        'clients': clients,
+        'duration': duration,
+        'threads_per_worker': threads,
+        'by_workers': results
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=int, default=10)
+    parser.add_argument('--devices', type=int, default=50)
+    parser.add_argument('--samples', type=int, default=100, help='Metric samples per device')
+    parser.add_argument('--threads', type=int, default=4, help='Threads per web worker')
+    parser.add_argument('--server', choices=['gunicorn', 'waitress'])
+    args = parser.parse_args(argv)
+    json.dump(run(args.workers, args.clients, args.duration, args.devices, args.samples, args.threads, args.server), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
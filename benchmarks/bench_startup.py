@@ -0,0 +1,94 @@
+"""Agent cold start: import time of network_agent against a budget.
+
+Starts fresh interpreters with `-X importtime` and reports the median
+time to import network_agent, the modules it spends that time on, and
+any optional heavy modules (tray, Windows, speed test) that a headless
+start pulled in. Exits with status 1 when the median exceeds the budget.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Median milliseconds allowed for `import network_agent` in a fresh
+# interpreter; most of it is psutil and requests
+IMPORT_BUDGET_MS = 300
+
+# Modules a headless agent must not load at startup
+OPTIONAL_MODULES = ('win32gui', 'win32con', 'pystray', 'PIL', 'speedtest', 'wifi', 'system_tray')
+
+
+def parse_importtime(stderr):
+    """(module, depth, self_us, cumulative_us) for every line of -X importtime output"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return entries
+
+
+def import_once(module):
+    script = (
+        f'import sys, json; import {module}; '
+        f'print(json.dumps(sorted(m for m in {OPTIONAL_MODULES!r} if m in sys.modules)))'
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return parse_importtime(result.stderr), json.loads(result.stdout)
+
+
+def run(module='network_agent', repeat=7, budget_ms=IMPORT_BUDGET_MS, top=10):
+    totals = []
+    for _ in range(repeat):
+        entries, loaded = import_once(module)
+        totals.append(next(cumulative for name, depth, _, cumulative in entries if name == module and depth == 0))
+
+    # Direct imports of the module from the last run, most expensive first;
+    # importtime lists children before their parent
+    children = []
+    for name, depth, _, cumulative in entries:
+        if depth == 0:
+            if name == module:
+                break
+            children = []
+        elif depth == 1:
+            children.append((name, cumulative))
+    median_ms = statistics.median(totals) / 1000
+    return {
+        'module': module,
+        'import_ms': round(median_ms, 1),
+        'min_ms': round(min(totals) / 1000, 1),
+        'budget_ms': budget_ms,
+        'within_budget': median_ms <= budget_ms,
+        'optional_modules_loaded': loaded,
+        'slowest_imports_ms': {
+            name: round(cumulative / 1000, 1)
+            for name, cumulative in sorted(children, key=lambda c: -c[1])[:top]
+        }
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='network_agent')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS)
+    args = parser.parse_args(argv)
+    results = run(args.module, args.repeat, args.budget_ms)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    if not results['within_budget'] or results['optional_modules_loaded']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
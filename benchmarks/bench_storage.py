@@ -0,0 +1,223 @@
+"""Conformance and throughput of the raw metric stores.
+
+Runs the same conformance checks against every storage.MetricsStore
+implementation, then compares them on a synthetic fleet: sustained insert
+rate in agent-sized batches, one-device range queries, and full time-range
+scans. The SQL store uses a temporary SQLite database with the app's
+pragmas and indexes; the columnar store a temporary directory.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+import storage
+import migrations
+from models import db
+
+DAY = datetime(2024, 3, 1)
+
+
+def open_sql(directory):
+    engine = create_engine(f"sqlite:///{os.path.join(directory, 'network_monitor.db')}")
+    event.listen(engine, 'connect', migrations.apply_sqlite_pragmas)
+    db.metadata.create_all(engine)
+    migrations.migrate(engine)
+    session = Session(engine)
+    return storage.SqlMetricsStore(session), session.commit
+
+
+def open_columnar(directory):
+    return storage.ColumnarMetricsStore(os.path.join(directory, 'metrics_store')), lambda: None
+
+
+STORES = {'sql': open_sql, 'columnar': open_columnar}
+
+
+def conformance_rows():
+    """Three devices over three days, with missing values and equal timestamps"""
+    rows = []
+    for step in range(3 * 24 * 4):
+        timestamp = DAY + timedelta(minutes=15 * step)
+        for device_id in (1, 2, 3):
+            rows.append({
+                'device_id': device_id,
+                'timestamp': timestamp,
+                'latency': float(step + device_id),
+                'dns_resolution_time': None if step % 5 == 0 else step / 10,
+                'download_speed': 100.0 if step % 24 == 0 else None,
+                'upload_speed': None
+            })
+    # A second sample of device 1 with the same timestamp as the first
+    rows.append(dict(rows[0], latency=-1.0))
+    return rows
+
+
+def check_conformance(store, commit):
+    """Raise AssertionError at the first behaviour that differs from the contract"""
+    fields = ('latency', 'dns_resolution_time')
+    since, until = DAY + timedelta(hours=12), DAY + timedelta(days=2, hours=6)
+    assert store.count(1, DAY, DAY + timedelta(days=3)) == 0
+    assert store.query(1, DAY, DAY + timedelta(days=3)) == []
+    assert list(store.scan(DAY, DAY + timedelta(days=3))) == []
+
+    rows = conformance_rows()
+    # Out of order across days, as buffered agent uploads arrive
+    store.append(rows[len(rows) // 2:-1])
+    store.append(rows[:len(rows) // 2] + rows[-1:])
+    commit()
+
+    def expected(device_ids, start, end):
+        # Insertion order breaks timestamp ties
+        inserted = rows[len(rows) // 2:-1] + rows[:len(rows) // 2] + rows[-1:]
+        selected = [r for r in inserted if r['device_id'] in device_ids and start <= r['timestamp'] < end]
+        return sorted(selected, key=lambda r: r['timestamp'])
+
+    want = expected({1}, since, until)
+    assert store.count(1, since, until) == len(want)
+    got = store.query(1, since, until, fields)
+    assert [(r[1], *r[2:]) for r in got] == [(r['timestamp'], *[r[f] for f in fields]) for r in want]
+    first_day = store.query(1, DAY, DAY + timedelta(hours=1), ('latency',))
+    assert [r[2] for r in first_day[:2]] == [1.0, -1.0]
+    assert first_day[0][1] == first_day[1][1] and first_day[0][0] < first_day[1][0]
+
+    # Keyset pagination returns every row exactly once
+    pages, after = [], None
+    while True:
+        page = store.query(1, since, until, fields, after=after, limit=7)
+        pages.extend(page)
+        if len(page) < 7:
+            break
+        after = (page[-1][1], page[-1][0])
+    assert pages == got
+
+    scanned = [row for chunk in store.scan(since, until, [2, 3], fields, chunk_size=50) for row in chunk]
+    want = expected({2, 3}, since, until)
+    assert [row[1] for row in scanned] == sorted(row[1] for row in scanned)
+    assert sorted(scanned, key=lambda r: (r[1], r[0])) == sorted(
+        [(r['device_id'], r['timestamp'], *[r[f] for f in fields]) for r in want], key=lambda r: (r[1], r[0])
+    )
+    assert sum(len(chunk) for chunk in store.scan()) == len(rows)
+
+    device_column, values = store.read_column('dns_resolution_time', since, until)
+    want = sorted(expected({1, 2, 3}, since, until), key=lambda r: r['device_id'])
+    assert device_column.tolist() == [r['device_id'] for r in want]
+    assert all(
+        (math.isnan(value) and r['dns_resolution_time'] is None) or value == r['dns_resolution_time']
+        for value, r in zip(values.tolist(), want)
+    )
+
+    assert store.delete_device(2) == sum(1 for r in rows if r['device_id'] == 2)
+    commit()
+    assert store.count(2, DAY, DAY + timedelta(days=3)) == 0
+    assert all(row[0] != 2 for chunk in store.scan() for row in chunk)
+    assert store.count(3, DAY, DAY + timedelta(days=3)) == sum(1 for r in rows if r['device_id'] == 3)
+
+    # Day boundaries, where both stores purge exactly
+    purged = store.purge_before(DAY + timedelta(days=1))
+    commit()
+    assert purged >= sum(1 for r in rows if r['device_id'] != 2 and r['timestamp'] < DAY + timedelta(days=1))
+    assert store.count(1, DAY, DAY + timedelta(days=1)) == 0
+    assert store.count(1, DAY + timedelta(days=1), DAY + timedelta(days=3)) == sum(
+        1 for r in rows if r['device_id'] == 1 and r['timestamp'] >= DAY + timedelta(days=1)
+    )
+
+
+def fleet_batches(devices, days, interval, batch_size):
+    """Samples of every device in time order, split into upload batches"""
+    rng = random.Random(42)
+    batch = []
+    for step in range(days * 86400 // interval):
+        timestamp = DAY + timedelta(seconds=interval * step)
+        for device_id in range(1, devices + 1):
+            batch.append({
+                'device_id': device_id,
+                'timestamp': timestamp,
+                'latency': rng.uniform(10, 200),
+                'dns_resolution_time': rng.uniform(5, 80),
+                'download_speed': None,
+                'upload_speed': None
+            })
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def measure(store, commit, devices, days, interval, batch_size, repeat):
+    batches = list(fleet_batches(devices, days, interval, batch_size))
+    rows = sum(len(batch) for batch in batches)
+
+    start = time.perf_counter()
+    for batch in batches:
+        store.append(batch)
+        commit()
+    insert_seconds = time.perf_counter() - start
+
+    rng = random.Random(7)
+    until = DAY + timedelta(days=days)
+    timings = {}
+    for name, span in (('device_hour', timedelta(hours=1)), ('device_day', timedelta(days=1))):
+        samples = []
+        for _ in range(repeat):
+            since = DAY + timedelta(seconds=rng.randrange(max(int((until - DAY - span).total_seconds()), 1)))
+            start = time.perf_counter()
+            store.query(rng.randint(1, devices), since, since + span)
+            samples.append((time.perf_counter() - start) * 1000)
+        timings[f'{name}_ms'] = round(statistics.median(samples), 3)
+
+    start = time.perf_counter()
+    scanned = sum(len(chunk) for chunk in store.scan(DAY, until, fields=('latency',)))
+    scan_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    store.read_column('latency', DAY, until)
+    column_seconds = time.perf_counter() - start
+
+    return {
+        'rows': rows,
+        'inserts_per_sec': round(rows / insert_seconds),
+        **timings,
+        'scan_rows_per_sec': round(scanned / scan_seconds),
+        'read_column_rows_per_sec': round(rows / column_seconds)
+    }
+
+
+def run(devices=200, days=2, interval=60, batch_size=500, repeat=20, stores=tuple(STORES)):
+    results = {}
+    for name in stores:
+        with tempfile.TemporaryDirectory() as directory:
+            store, commit = STORES[name](directory)
+            check_conformance(store, commit)
+            results.setdefault('conformance', {})[name] = 'passed'
+
+        with tempfile.TemporaryDirectory() as directory:
+            store, commit = STORES[name](directory)
+            results[name] = measure(store, commit, devices, days, interval, batch_size, repeat)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=200)
+    parser.add_argument('--days', type=int, default=2)
+    parser.add_argument('--interval', type=int, default=60, help='Seconds between samples of a device')
+    parser.add_argument('--batch-size', type=int, default=500, help='Samples per append')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--store', choices=list(STORES), action='append', dest='stores')
+    args = parser.parse_args(argv)
+    results = run(args.devices, args.days, args.interval, args.batch_size, args.repeat, tuple(args.stores or STORES))
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Compare agent upload cost before and after the pooled, compressed transport.
+
+"Before" reproduces the original uploader: one requests.post per sample,
+uncompressed JSON with device_info embedded in every payload. "After"
+uses AgentTransport with device_info sent only at registration. Both run
+against a local HTTP/1.1 server that counts bytes and TCP connections.
+"""
+import sys
+import json
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from transport import AgentTransport
+
+# Agent collection interval used to extrapolate handshakes per hour
+INTERVAL = 300
+
+DEVICE_INFO = {
+    'hostname': 'BRANCH-LAPTOP-0042',
+    'username': 'BRANCH-LAPTOP-0042',
+    'system': 'Windows',
+    'version': '10.0.22631'
+}
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = 0
+    received_bytes = 0
+
+    def setup(self):
+        CountingHandler.connections += 1
+        super().setup()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        CountingHandler.received_bytes += len(self.rfile.read(length))
+        body = json.dumps({'id': 1, 'results': []}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def sample(index):
+    """A representative agent sample without device_info"""
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'connection_info': {'interface': 'wlan0', 'connection_type': 'Wi-Fi', 'wifi_ssid': 'Branch-Office', 'signal_strength': '-58 dBm'},
+        'ip_addresses': {'internal_ip': '192.168.1.42', 'external_ip': '192.168.1.42'},
+        'dns_resolution_time': 12.5 + index % 7,
+        'dns_stats': {
+            resolver: {'queries': 6, 'answered': 6, 'failure_rate': 0.0, 'min': 9.8, 'avg': 12.5, 'p50': 11.9,
+                       'p95': 16.2, 'max': 16.2, 'errors': {}, 'resolver': resolver}
+            for resolver in ['192.168.1.1', '8.8.8.8']
+        },
+        'ping_results': {'google.com': 21.3, '8.8.8.8': 19.8, '1.1.1.1': 17.2},
+        'ping_stats': {
+            host: {'sent': 5, 'received': 5, 'packet_loss': 0.0, 'min': 17.1, 'avg': 19.8,
+                   'max': 23.4, 'stddev': 2.1, 'jitter': 1.4, 'host': host, 'method': 'icmp'}
+            for host in ['google.com', '8.8.8.8', '1.1.1.1']
+        },
+        'probe_durations': {'connection_info': 85.2, 'ip_addresses': 3.1, 'dns': 12.9}
+    }
+
+
+def run(samples=100):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/api/devices'
+    results = {}
+
+    try:
+        CountingHandler.connections = CountingHandler.received_bytes = 0
+        for index in range(samples):
+            payload = dict(sample(index), device_info=DEVICE_INFO)
+            requests.post(f'{url}/1/metrics', json=payload, headers={'Content-Type': 'application/json'}, timeout=10)
+        results['before'] = {
+            'bytes_per_sample': round(CountingHandler.received_bytes / samples, 1),
+            'handshakes_per_hour': round(CountingHandler.connections / samples * 3600 / INTERVAL, 2)
+        }
+
+        CountingHandler.connections = CountingHandler.received_bytes = 0
+        transport = AgentTransport(url, user_agent='NetworkAgent/bench')
+        transport.post('', {'location': 'Local', 'device_info': DEVICE_INFO})
+        for index in range(samples):
+            transport.post('/1/metrics', sample(index), samples=1)
+        transport.close()
+        results['after'] = {
+            'encoding': transport.encoding,
+            'bytes_per_sample': round(CountingHandler.received_bytes / samples, 1),
+            'handshakes_per_hour': round(CountingHandler.connections / samples * 3600 / INTERVAL, 2)
+        }
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    results['samples'] = samples
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=100)
+    args = parser.parse_args(argv)
+    json.dump(run(args.samples), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Run benchmark suites and compare their results with a baseline.
+
+Runs every suite (or those named with --suite) in quick mode, or at each
+module's own defaults with --full, and prints one JSON document with the
+environment and every suite's results. With --baseline, each numeric
+result whose name gives its direction (timings and sizes lower is better,
+rates and speedups higher) is compared with the same result in an earlier
+run's output, and the run exits with status 1 if any got worse by more
+than --threshold. A suite that raises is reported under 'errors' and also
+fails the run.
+
+    python -m benchmarks.run --output baseline.json
+    python -m benchmarks.run --baseline baseline.json --threshold 0.2
+"""
+import os
+import sys
+import json
+import time
+import contextlib
+import fnmatch
+import argparse
+import platform
+import importlib
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Suffixes of result names, or of the name of the dict holding them, that
+# say which direction is better; other numbers are reported but not compared
+LOWER_IS_BETTER = ('_ms', '_us', '_ns', 'seconds', '_bytes', '_mb', '_megabytes', '_pct', 'bytes_per_sample',
+                   'handshakes_per_hour', 'failure_rate', 'stale_baseline')
+HIGHER_IS_BETTER = ('_per_sec', 'speedup', 'reduction')
+
+# Milliseconds per unit of timing results; differences in timings below
+# --min-ms are noise however large they are relative to the baseline
+TIME_UNITS = {'_ns': 1e-6, '_us': 1e-3, '_ms': 1.0, 'seconds': 1000.0}
+
+# Results too close to zero or too dependent on the host to compare
+DEFAULT_IGNORE = ('*overhead_*', '*delay_error_ms', 'startup.slowest_imports_ms.*', 'netstate.*discovery*',
+                  'netstate.*wifi_lookup_ms')
+
+# Row counts of the synthetic network_monitor.db for the metrics queries
+QUERY_ROWS = (10_000, 1_000_000)
+FULL_QUERY_ROWS = (10_000, 1_000_000, 10_000_000)
+
+
+def _suite(module, **quick):
+    """A suite running benchmarks.<module>.run with quick arguments, or its defaults when full"""
+    def run(full):
+        return importlib.import_module(f'benchmarks.{module}').run(**({} if full else quick))
+    return run
+
+
+def metrics_query(full):
+    from benchmarks import bench_metrics_query
+    return {
+        f'rows_{rows}': bench_metrics_query.run(rows=rows, devices=min(1000, rows // 100), repeat=5)
+        for rows in (FULL_QUERY_ROWS if full else QUERY_ROWS)
+    }
+
+
+SUITES = {
+    'parsers': _suite('bench_parsers', iterations=5000),
+    'collect': _suite('bench_collect', cycles=100),
+    'api': _suite('bench_api', devices=200, samples=2000, repeat=10),
+    'metrics_query': metrics_query,
+    'storage': _suite('bench_storage', devices=50, days=1),
+    'alerts': _suite('bench_alerts', devices=1000, rounds=5),
+    'analytics': _suite('bench_analytics', devices=500, load_rows=100_000),
+    'export': _suite('bench_export', rows=100_000),
+    'instrumentation': _suite('bench_instrumentation', iterations=50000, rounds=3, requests_per_round=50),
+    'transport': _suite('bench_transport'),
+    'startup': _suite('bench_startup', repeat=3),
+    'netstate': _suite('bench_netstate', repeat=5, iterations=500),
+    'dnsprobe': _suite('bench_dnsprobe', repeat=20),
+    'passive': _suite('bench_passive', iterations=500, days=2)
+}
+
+# Suites that start servers of their own; only run when named
+OPTIONAL_SUITES = {
+    'serving': _suite('bench_serving', worker_counts=(1, 2), duration=5)
+}
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'commit': commit,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    }
+
+
+def flatten(results, prefix=''):
+    """Numeric results by dotted name"""
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{name}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def direction(name):
+    """-1 if lower is better, 1 if higher is better, 0 if unknown"""
+    for part in reversed(name.split('.')):
+        if part.endswith(HIGHER_IS_BETTER):
+            return 1
+        if part.endswith(LOWER_IS_BETTER):
+            return -1
+    return 0
+
+
+def time_unit_ms(name):
+    """Milliseconds per unit of a timing result, None for other results"""
+    for part in reversed(name.split('.')):
+        for suffix, scale in TIME_UNITS.items():
+            if part.endswith(suffix):
+                return scale
+    return None
+
+
+def compare(current, baseline, threshold, ignore=DEFAULT_IGNORE, min_ms=0.05):
+    """Regressions and improvements beyond threshold, as fractions of the baseline"""
+    current, baseline = flatten(current), flatten(baseline)
+    regressions, improvements, compared = [], [], 0
+    for name, value in sorted(current.items()):
+        sign = direction(name)
+        before = baseline.get(name)
+        if not sign or not before or before < 0 or any(fnmatch.fnmatch(name, p) for p in ignore):
+            continue
+        compared += 1
+        change = (value - before) / before
+        scale = time_unit_ms(name)
+        if scale is not None and abs(value - before) * scale < min_ms:
+            continue
+        entry = {'name': name, 'baseline': before, 'current': value, 'change': round(change, 4)}
+        if change * sign < -threshold:
+            regressions.append(entry)
+        elif change * sign > threshold:
+            improvements.append(entry)
+    return {'threshold': threshold, 'compared': compared, 'regressions': regressions, 'improvements': improvements}
+
+
+def run_suite(name, full):
+    """Results of one suite, run in a fresh interpreter.
+
+    Benchmarks configure modules such as app through the environment at
+    import time, and none should run with another's caches warmed.
+    """
+    command = [sys.executable, '-m', 'benchmarks.run', '--in-process', name] + (['--full'] if full else [])
+    result = subprocess.run(command, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else f'exit status {result.returncode}')
+    return json.loads(result.stdout)
+
+
+def run(suites=tuple(SUITES), full=False, log=sys.stderr):
+    report = {'environment': environment(), 'mode': 'full' if full else 'quick', 'suites': {}, 'errors': {}}
+    for name in suites:
+        print(f'Running {name}...', file=log, flush=True)
+        start = time.perf_counter()
+        try:
+            report['suites'][name] = run_suite(name, full)
+        except Exception as e:
+            report['errors'][name] = str(e)
+            print(f'  {name} failed: {e}', file=log, flush=True)
+        print(f'  {name} finished in {time.perf_counter() - start:.1f}s', file=log, flush=True)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--suite', action='append', dest='suites', choices=list(SUITES) + list(OPTIONAL_SUITES),
+                        help='Suite to run; repeat for several (default: all but ' + ', '.join(OPTIONAL_SUITES) + ')')
+    parser.add_argument('--full', action='store_true', help="Run at each benchmark's own, larger defaults")
+    parser.add_argument('--output', help='Also write the results to this file')
+    parser.add_argument('--baseline', help='Results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Fraction a result may get worse by before it counts as a regression')
+    parser.add_argument('--min-ms', type=float, default=0.05,
+                        help='Smallest difference in a timing, in milliseconds, that can count as a change')
+    parser.add_argument('--ignore', action='append', default=list(DEFAULT_IGNORE),
+                        help='Glob of result names left out of the comparison')
+    parser.add_argument('--in-process', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.in_process:
+        # Anything the suite prints goes to stderr; stdout carries only the results
+        with contextlib.redirect_stdout(sys.stderr):
+            results = dict(SUITES, **OPTIONAL_SUITES)[args.in_process](args.full)
+        json.dump(results, sys.stdout)
+        return
+
+    os.chdir(ROOT)
+    report = run(tuple(args.suites or SUITES), args.full)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        report['comparison'] = compare(
+            report['suites'], baseline.get('suites', baseline), args.threshold, args.ignore, args.min_ms
+        )
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    if report['errors'] or report.get('comparison', {}).get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
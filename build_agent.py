@@ -18,6 +18,7 @@ hidden_imports = [
     'pywifi',
     'requests',
     'network_monitor',
+    'system_tray',
     'pystray',
     'PIL',
     'PIL._tkinter_finder',
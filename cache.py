@@ -0,0 +1,132 @@
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+from flask import Response, request
+
+# Response headers kept alongside a cached body
+CACHED_HEADERS = ('Content-Type', 'X-Resolution', 'X-Next-Cursor')
+
+
+class CacheEntry:
+    def __init__(self, body, etag, headers, tags):
+        self.body = body
+        self.etag = etag
+        self.headers = headers
+        self.tags = tags
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of serialized GET responses.
+
+    Entries carry tags naming the data they were built from, and the
+    ingestion path calls invalidate() with the tags it touched. Each body
+    gets a strong ETag so unchanged responses can be answered with 304
+    without serializing anything.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.tag_index = {}
+        self.version = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, headers, tags, version):
+        """Store a response unless an invalidation happened since version"""
+        entry = CacheEntry(body, f'"{hashlib.sha1(body).hexdigest()}"', headers, tags)
+        with self.lock:
+            if version != self.version:
+                return entry
+            self._remove(key)
+            self.entries[key] = entry
+            for tag in tags:
+                self.tag_index.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return entry
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            for tag in entry.tags:
+                keys = self.tag_index.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.tag_index[tag]
+
+    def invalidate(self, *tags):
+        """Drop every entry built from any of the given tags"""
+        with self.lock:
+            self.version += 1
+            for tag in tags:
+                for key in list(self.tag_index.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+            self.tag_index.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+                'not_modified': self.not_modified,
+                'evictions': self.evictions
+            }
+
+    def cached(self, tags, vary=None):
+        """Decorator caching a GET view.
+
+        tags(**view_kwargs) names the data the response is built from, and
+        vary(**view_kwargs), if given, adds anything besides the URL that
+        changes the response, such as a range relative to the current time.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                key = (request.path, tuple(sorted(request.args.items(multi=True))))
+                if vary is not None:
+                    key += (vary(**kwargs),)
+                entry = self.get(key)
+                if entry is None:
+                    version = self.version
+                    response = view(*args, **kwargs)
+                    if not isinstance(response, Response) or response.status_code != 200:
+                        return response
+                    headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+                    entry = self.put(key, response.get_data(), headers, tags(**kwargs), version)
+
+                if request.if_none_match.contains(entry.etag.strip('"')):
+                    with self.lock:
+                        self.not_modified += 1
+                    return Response(status=304, headers={'ETag': entry.etag})
+                return Response(entry.body, headers=dict(entry.headers, ETag=entry.etag))
+            return wrapper
+        return decorator
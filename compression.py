@@ -0,0 +1,85 @@
+import io
+import gzip
+import zlib
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Largest decompressed request body the server will accept
+MAX_DECOMPRESSED_SIZE = 16 * 1024 * 1024
+
+
+class UnsupportedEncoding(ValueError):
+    """Content-Encoding this server cannot decode"""
+
+
+class BodyTooLarge(ValueError):
+    """Request body larger than the limit once decompressed"""
+
+
+def compress(body, encoding):
+    """Compress a request body with the given Content-Encoding"""
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return body
+
+
+def decompress(body, encoding, limit=MAX_DECOMPRESSED_SIZE):
+    """Decompress a request body, refusing anything larger than limit.
+
+    Raises UnsupportedEncoding, BodyTooLarge, or ValueError for a corrupt body.
+    """
+    if encoding == 'gzip':
+        decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            data = decoder.decompress(body, limit + 1)
+        except zlib.error as e:
+            raise ValueError(f'Corrupt gzip request body: {e}')
+        if len(data) <= limit and not decoder.eof:
+            raise ValueError('Corrupt gzip request body: truncated')
+    elif encoding == 'zstd':
+        if not ZSTD_AVAILABLE:
+            raise UnsupportedEncoding('zstd request bodies are not supported by this server')
+        try:
+            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as reader:
+                data = reader.read(limit + 1)
+        except zstandard.ZstdError as e:
+            raise ValueError(f'Corrupt zstd request body: {e}')
+    else:
+        raise UnsupportedEncoding(f'Unsupported Content-Encoding: {encoding}')
+    if len(data) > limit:
+        raise BodyTooLarge('Decompressed request body is too large')
+    return data
+
+
+class DecompressMiddleware:
+    """WSGI middleware that transparently inflates compressed request bodies"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding and encoding != 'identity':
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            try:
+                body = decompress(environ['wsgi.input'].read(length), encoding)
+            except ValueError as e:
+                # Only an unsupported encoding makes the agent retry in gzip
+                if isinstance(e, UnsupportedEncoding):
+                    status = '415 Unsupported Media Type'
+                elif isinstance(e, BodyTooLarge):
+                    status = '413 Request Entity Too Large'
+                else:
+                    status = '400 Bad Request'
+                start_response(status, [('Content-Type', 'text/plain')])
+                return [str(e).encode()]
+            environ['wsgi.input'] = io.BytesIO(body)
+            environ['CONTENT_LENGTH'] = str(len(body))
+            del environ['HTTP_CONTENT_ENCODING']
+        return self.wsgi_app(environ, start_response)
@@ -0,0 +1,226 @@
+"""DNS resolution latency measured against the resolvers themselves.
+
+Queries go straight to each resolver over UDP, bypassing the operating
+system's resolver cache, so every sample is a real round trip. All
+queries for a resolver are sent at once from one socket and matched to
+replies by their random 16-bit IDs; resolvers are probed concurrently.
+With randomize_names a random label is prepended to every name, so the
+resolver cannot answer from its cache either and the figure includes
+recursive resolution. NXDOMAIN is then the expected answer and counts as
+a success.
+"""
+import os
+import sys
+import math
+import time
+import random
+import select
+import socket
+import struct
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+DNS_PORT = 53
+QTYPE_A = 1
+QCLASS_IN = 1
+FLAG_RD = 0x0100
+FLAG_QR = 0x8000
+
+RCODES = {0: 'NOERROR', 1: 'FORMERR', 2: 'SERVFAIL', 3: 'NXDOMAIN', 4: 'NOTIMP', 5: 'REFUSED'}
+
+# Response codes that mean the resolver did its job
+ANSWERED_RCODES = (0, 3)
+
+# Public resolvers probed when none are configured and none are found locally
+FALLBACK_RESOLVERS = ['8.8.8.8', '1.1.1.1']
+
+_rng = random.SystemRandom()
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def system_resolvers(path='/etc/resolv.conf'):
+    """Nameservers from resolv.conf, or an empty list where there is none"""
+    resolvers = []
+    try:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    resolvers.append(fields[1].split('%')[0])
+    except OSError:
+        pass
+    return resolvers
+
+
+# Comma-separated address or address:port list; empty means the system's resolvers
+DNS_RESOLVERS = _split(os.getenv('DNS_RESOLVERS', '')) or system_resolvers() or FALLBACK_RESOLVERS
+DNS_QUERY_NAMES = _split(os.getenv('DNS_QUERY_NAMES', 'google.com,cloudflare.com'))
+DNS_QUERY_COUNT = int(os.getenv('DNS_QUERY_COUNT', '3'))
+DNS_TIMEOUT = float(os.getenv('DNS_TIMEOUT', '2'))
+DNS_RANDOMIZE_NAMES = os.getenv('DNS_RANDOMIZE_NAMES', 'false').lower() in ('1', 'true', 'yes')
+
+
+def parse_resolver(resolver):
+    """(address, port) of '192.0.2.53', '192.0.2.53:5353', '2001:db8::53' or '[2001:db8::53]:5353'"""
+    if resolver.startswith('['):
+        address, _, port = resolver[1:].partition(']')
+        return address, int(port.lstrip(':') or DNS_PORT)
+    if resolver.count(':') == 1:
+        address, port = resolver.split(':')
+        return address, int(port)
+    return resolver, DNS_PORT
+
+
+def encode_name(name):
+    """Wire format of a domain name: length-prefixed labels ending in a zero byte"""
+    encoded = b''
+    for label in name.rstrip('.').split('.'):
+        raw = label.encode('idna')
+        if not 0 < len(raw) < 64:
+            raise ValueError(f'Invalid DNS label in {name!r}')
+        encoded += bytes([len(raw)]) + raw
+    return encoded + b'\0'
+
+
+def build_query(query_id, name, qtype=QTYPE_A):
+    """A recursive query for one name; returns (packet, question section)"""
+    question = encode_name(name) + struct.pack('!HH', qtype, QCLASS_IN)
+    return struct.pack('!HHHHHH', query_id, FLAG_RD, 1, 0, 0, 0) + question, question
+
+
+def parse_response(packet):
+    """(id, rcode, question section) of a response, or None if it is not one"""
+    if len(packet) < 12:
+        return None
+    query_id, flags, qdcount = struct.unpack('!HHH', packet[:6])
+    if not flags & FLAG_QR or qdcount != 1:
+        return None
+    # The question is echoed right after the header and ends 4 bytes after the name
+    end = packet.find(b'\0', 12)
+    if end < 0 or len(packet) < end + 5:
+        return None
+    return query_id, flags & 0x000f, packet[12:end + 5]
+
+
+def random_label(length=12):
+    return ''.join(_rng.choice('abcdefghijklmnopqrstuvwxyz0123456789') for _ in range(length))
+
+
+def _udp_probe(resolver, names, timeout):
+    """Send one query per name at once; (rtt in ms or None, rcode or 'timeout') per query"""
+    address, port = parse_resolver(resolver)
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    results = [(None, 'timeout')] * len(names)
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        sock.connect((address, port))
+        pending = {}
+        for index, (query_id, name) in enumerate(zip(_rng.sample(range(65536), len(names)), names)):
+            packet, question = build_query(query_id, name)
+            pending[query_id] = (index, question, time.perf_counter())
+            sock.send(packet)
+
+        deadline = time.monotonic() + timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                break
+            try:
+                packet = sock.recv(4096)
+            except OSError:
+                # ICMP port unreachable from an earlier query; keep waiting for the rest
+                continue
+            received = time.perf_counter()
+            response = parse_response(packet)
+            if response is None or response[0] not in pending:
+                continue
+            query_id, rcode, question = response
+            index, sent_question, sent = pending[query_id]
+            # A reply for another question with a colliding ID is not ours
+            if question.lower() != sent_question.lower():
+                continue
+            del pending[query_id]
+            results[index] = ((received - sent) * 1000, rcode)
+    except OSError as e:
+        results = [(None, type(e).__name__)] * len(names)
+    finally:
+        sock.close()
+    return results
+
+
+def _percentile(ordered, quantile):
+    """Nearest-rank percentile of sorted values"""
+    return ordered[max(math.ceil(quantile * len(ordered)) - 1, 0)]
+
+
+def summarize(results):
+    """Latency distribution and failure rate of one resolver's queries"""
+    rtts = sorted(rtt for rtt, rcode in results if rtt is not None and rcode in ANSWERED_RCODES)
+    errors = {}
+    for rtt, rcode in results:
+        if rtt is None or rcode not in ANSWERED_RCODES:
+            name = RCODES.get(rcode, str(rcode))
+            errors[name] = errors.get(name, 0) + 1
+    stats = {
+        'queries': len(results),
+        'answered': len(rtts),
+        'failure_rate': round(100 * (len(results) - len(rtts)) / len(results), 2) if results else None,
+        'min': None,
+        'avg': None,
+        'p50': None,
+        'p95': None,
+        'max': None,
+        'errors': errors
+    }
+    if rtts:
+        stats['min'] = round(rtts[0], 2)
+        stats['avg'] = round(statistics.fmean(rtts), 2)
+        stats['p50'] = round(_percentile(rtts, 0.5), 2)
+        stats['p95'] = round(_percentile(rtts, 0.95), 2)
+        stats['max'] = round(rtts[-1], 2)
+    return stats
+
+
+def probe_resolver(resolver, names=None, count=None, timeout=None, randomize_names=None):
+    """Query one resolver count times for each name and summarize the replies"""
+    names = DNS_QUERY_NAMES if names is None else names
+    count = DNS_QUERY_COUNT if count is None else count
+    timeout = DNS_TIMEOUT if timeout is None else timeout
+    randomize_names = DNS_RANDOMIZE_NAMES if randomize_names is None else randomize_names
+    queries = [f'{random_label()}.{name}' if randomize_names else name for name in names for _ in range(count)]
+    stats = summarize(_udp_probe(resolver, queries, timeout) if queries else [])
+    stats['resolver'] = resolver
+    return stats
+
+
+def probe_resolvers(resolvers=None, names=None, count=None, timeout=None, randomize_names=None):
+    """Probe several resolvers concurrently.
+
+    Returns the stats of each resolver under 'resolvers', and under 'avg'
+    the mean of every answered query across them, or None if none was.
+    """
+    resolvers = DNS_RESOLVERS if resolvers is None else resolvers
+    report = {'avg': None, 'resolvers': {}}
+    if not resolvers:
+        return report
+    with ThreadPoolExecutor(max_workers=len(resolvers)) as executor:
+        futures = {
+            resolver: executor.submit(probe_resolver, resolver, names, count, timeout, randomize_names)
+            for resolver in resolvers
+        }
+        report['resolvers'] = {resolver: future.result() for resolver, future in futures.items()}
+    answered = [stats for stats in report['resolvers'].values() if stats['answered']]
+    if answered:
+        total = sum(stats['answered'] for stats in answered)
+        report['avg'] = round(sum(stats['avg'] * stats['answered'] for stats in answered) / total, 2)
+    return report
+
+
+if __name__ == '__main__':
+    import json
+    json.dump(probe_resolvers(sys.argv[1:] or None), sys.stdout, indent=2)
+    print()
@@ -0,0 +1,165 @@
+import json
+import time
+import queue
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from models import StreamEvent
+
+# Seconds between keep-alive comments on an idle stream
+KEEPALIVE_INTERVAL = 15
+
+
+class Subscription:
+    """One connected stream client and its bounded message queue"""
+
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+
+class EventBroker:
+    """In-process fan-out of Server-Sent Events to every connected client.
+
+    Each event is serialized once and the same bytes are queued for every
+    subscriber, so publishing costs one encode plus a queue put per client
+    and never touches the database. A client that falls max_queue events
+    behind is disconnected; the browser reconnects and resynchronizes.
+    """
+
+    def __init__(self, max_queue=256):
+        self.max_queue = max_queue
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self):
+        subscription = Subscription(self.max_queue)
+        with self.lock:
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def publish(self, event, data):
+        """Queue an event for every subscriber"""
+        message = f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode('utf-8')
+        with self.lock:
+            subscribers = list(self.subscribers)
+            self.published += 1
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                subscription.overflowed = True
+                self.unsubscribe(subscription)
+                self.dropped += 1
+
+    def stream(self, subscription):
+        """Generator of SSE bytes for one client, ending if it falls behind"""
+        try:
+            yield b'retry: 5000\n\n'
+            while not subscription.overflowed:
+                try:
+                    yield subscription.queue.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    yield b': keepalive\n\n'
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'subscribers': len(self.subscribers),
+                'published': self.published,
+                'dropped': self.dropped
+            }
+
+
+class EventRelay:
+    """Hands events between the processes of a serve.py/worker.py deployment.
+
+    Each process has its own EventBroker and response cache, so send()
+    writes events to the stream_event table instead. Every process started
+    with start() polls the table and hands each new row to deliver, which
+    republishes it on that process's own EventBroker; a process also
+    receives the events it sent. Rows are deleted once they are max_age
+    seconds old.
+    """
+
+    def __init__(self, engine, deliver, interval=1.0, max_age=300):
+        self.table = StreamEvent.__table__
+        self.engine = engine
+        self.deliver = deliver
+        self.interval = interval
+        self.max_age = max_age
+        self.last_id = None
+        self.last_pruned = 0.0
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.relayed = 0
+
+    def send(self, event, data):
+        """Store an event for every process to pick up"""
+        self.send_many([(event, data)])
+
+    def send_many(self, events):
+        """Store several (event, data) pairs in one transaction"""
+        if not events:
+            return
+        now = datetime.utcnow()
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert(), [
+                {'created_at': now, 'event': event, 'data': json.dumps(data, separators=(',', ':'))}
+                for event, data in events
+            ])
+            if time.monotonic() - self.last_pruned > self.max_age / 10:
+                self.last_pruned = time.monotonic()
+                conn.execute(self.table.delete().where(
+                    self.table.c.created_at < now - timedelta(seconds=self.max_age)
+                ))
+
+    def poll(self):
+        """Deliver rows stored since the last poll; returns how many"""
+        with self.engine.connect() as conn:
+            if self.last_id is None:
+                # Events stored before this process started are not replayed
+                self.last_id = conn.execute(select(func.max(self.table.c.id))).scalar() or 0
+                return 0
+            rows = conn.execute(
+                select(self.table.c.id, self.table.c.event, self.table.c.data)
+                .where(self.table.c.id > self.last_id)
+                .order_by(self.table.c.id)
+            ).all()
+        for row_id, event, data in rows:
+            self.last_id = row_id
+            try:
+                self.deliver(event, json.loads(data))
+            except Exception as e:
+                logging.error(f"Relayed {event} event could not be delivered: {str(e)}")
+        self.relayed += len(rows)
+        return len(rows)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                logging.error(f"Event relay poll failed: {str(e)}")
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        """Start polling in the background; safe to call more than once"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='event-relay', daemon=True)
+                self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
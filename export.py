@@ -0,0 +1,228 @@
+import io
+import csv
+import json
+import argparse
+from itertools import groupby
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import storage
+from models import MetricsRollup
+from rollups import RESOLUTIONS, ROLLUP_FIELDS
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream'
+}
+
+# Rows fetched from the database cursor and written out per chunk
+CHUNK_SIZE = 10000
+
+# Per-bucket statistics exported for every rolled-up field
+ROLLUP_STATS = ('', '_min', '_max', '_p95', '_count')
+
+
+def export_columns(resolution, fields):
+    """Column names of an export, in output order"""
+    if resolution == 'raw':
+        return ['device_id', 'timestamp', *fields]
+    return ['device_id', 'timestamp', *[f'{field}{stat}' for field in fields for stat in ROLLUP_STATS]]
+
+
+def iter_chunks(engine, since, until, device_ids=None, resolution='raw', fields=ROLLUP_FIELDS, chunk_size=CHUNK_SIZE, store=None):
+    """Yield lists of export rows.
+
+    Rows are tuples in export_columns() order, read chunk_size at a time so
+    memory use does not grow with the size of the export. Raw rows come
+    from store (the SQL store on engine by default) in time order. Rollup
+    rows, stored one per metric, are read through a server-side cursor in
+    device and time order and pivoted into one row per bucket on the fly.
+    """
+    if resolution == 'raw':
+        store = store or storage.SqlMetricsStore(Session(engine))
+        yield from store.scan(since, until, device_ids, fields, chunk_size)
+        return
+
+    table = MetricsRollup.__table__
+    query = select(
+        table.c.device_id, table.c.bucket_start, table.c.metric,
+        table.c.sum, table.c.min, table.c.max, table.c.p95, table.c['count']
+    ).where(
+        table.c.resolution == resolution,
+        table.c.metric.in_(fields),
+        table.c.bucket_start >= since,
+        table.c.bucket_start < until
+    ).order_by(table.c.device_id, table.c.bucket_start, table.c.metric)
+    if device_ids:
+        query = query.where(table.c.device_id.in_(device_ids))
+
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(query)
+        yield from _pivot_rollups(result, fields, chunk_size)
+
+
+def _pivot_rollups(result, fields, chunk_size):
+    """Merge per-metric rollup rows of the same bucket into one export row"""
+    slots = {field: i for i, field in enumerate(fields)}
+    chunk = []
+    for (device_id, start), metrics in groupby(result, key=lambda r: (r[0], r[1])):
+        values = [None] * (len(fields) * len(ROLLUP_STATS))
+        for _, _, metric, total, low, high, p95, count in metrics:
+            offset = slots[metric] * len(ROLLUP_STATS)
+            values[offset:offset + len(ROLLUP_STATS)] = [
+                round(total / count, 3) if count else None, low, high, p95, count
+            ]
+        chunk.append((device_id, start, *values))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def write_csv(chunks, columns):
+    """Encode chunks as CSV text, one string per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_json_value(value) for value in row] for row in chunk)
+        yield buffer.getvalue()
+
+
+def write_ndjson(chunks, columns):
+    """Encode chunks as newline-delimited JSON objects, one string per chunk"""
+    for chunk in chunks:
+        yield ''.join(
+            json.dumps(dict(zip(columns, map(_json_value, row))), separators=(',', ':')) + '\n'
+            for row in chunk
+        )
+
+
+class _Drain:
+    """Write-only file object whose contents are taken after each chunk"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _arrow_schema(columns):
+    types = {'device_id': pyarrow.int64(), 'timestamp': pyarrow.timestamp('us')}
+    return pyarrow.schema([
+        (column, types.get(column, pyarrow.int64() if column.endswith('_count') else pyarrow.float64()))
+        for column in columns
+    ])
+
+
+def write_arrow(chunks, columns, container='parquet'):
+    """Encode chunks as Parquet (one row group per chunk) or an Arrow IPC stream"""
+    if not ARROW_AVAILABLE:
+        raise ValueError(f'{container} export requires pyarrow')
+    schema = _arrow_schema(columns)
+    sink = _Drain()
+    if container == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pyarrow.ipc.new_stream(sink, schema)
+    try:
+        for chunk in chunks:
+            batch = pyarrow.RecordBatch.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(zip(*chunk), schema)],
+                schema=schema
+            )
+            if container == 'parquet':
+                writer.write_table(pyarrow.Table.from_batches([batch]))
+            else:
+                writer.write_batch(batch)
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def stream_export(engine, export_format, since, until, device_ids=None, resolution='raw', fields=ROLLUP_FIELDS, chunk_size=CHUNK_SIZE, store=None):
+    """Generator of encoded export output; text formats yield str, binary ones bytes"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format {export_format}; expected any of {', '.join(EXPORT_FORMATS)}")
+    if resolution != 'raw' and resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution {resolution}; expected raw or any of {', '.join(RESOLUTIONS)}")
+    unknown = [field for field in fields if field not in ROLLUP_FIELDS]
+    if unknown or not fields:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}; expected any of {', '.join(ROLLUP_FIELDS)}")
+    if export_format in ('parquet', 'arrow') and not ARROW_AVAILABLE:
+        raise ValueError(f'{export_format} export requires pyarrow')
+
+    columns = export_columns(resolution, fields)
+    chunks = iter_chunks(engine, since, until, device_ids, resolution, fields, chunk_size, store)
+    if export_format == 'csv':
+        return write_csv(chunks, columns)
+    if export_format == 'ndjson':
+        return write_ndjson(chunks, columns)
+    return write_arrow(chunks, columns, export_format)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export stored network metrics')
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+    parser.add_argument('--resolution', choices=['raw', *RESOLUTIONS], default='raw')
+    parser.add_argument('--device', type=int, action='append', dest='device_ids', help='device id; repeat for several')
+    parser.add_argument('--since', type=datetime.fromisoformat, required=True, help='UTC start, ISO 8601')
+    parser.add_argument('--until', type=datetime.fromisoformat, default=None, help='UTC end, ISO 8601 (default now)')
+    parser.add_argument('--fields', default=','.join(ROLLUP_FIELDS))
+    parser.add_argument('--output', required=True, help='file to write')
+    args = parser.parse_args(argv)
+
+    from app import app, db, metrics_store
+    fields = tuple(f.strip() for f in args.fields.split(',') if f.strip())
+    with app.app_context():
+        output = stream_export(
+            db.engine, args.format, args.since, args.until or datetime.utcnow(),
+            args.device_ids, args.resolution, fields, store=metrics_store
+        )
+        binary = args.format in ('parquet', 'arrow')
+        with open(args.output, 'wb' if binary else 'w', newline=None if binary else '') as f:
+            for part in output:
+                f.write(part)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import { Container, Grid, Paper, Typography, Box } from '@mui/material'
 import { ThemeProvider, createTheme } from '@mui/material/styles'
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend } from 'recharts'
@@ -6,6 +6,12 @@ import DeviceList from './components/DeviceList'
 import DeviceFilters from './components/DeviceFilters'
 import NetworkQualityCard from './components/NetworkQualityCard'
 
+// Points requested for the selected device's hour; the server answers with
+// rollup buckets instead of raw samples when the hour holds more
+const METRICS_MAX_POINTS = 300
+// Delay before refetching a rollup series that new samples have changed
+const METRICS_REFETCH_DELAY = 5000
+
 const theme = createTheme({
   palette: {
     primary: {
@@ -21,6 +27,9 @@ function App() {
   const [devices, setDevices] = useState([])
   const [selectedDevice, setSelectedDevice] = useState(null)
   const [metrics, setMetrics] = useState([])
+  const selectedDeviceId = useRef(null)
+  const metricsResolution = useRef('raw')
+  const metricsRefetch = useRef(null)
   const [filters, setFilters] = useState({
     location: '',
     user: '',
@@ -29,23 +38,69 @@ function App() {
 
   useEffect(() => {
     fetchDevices()
-    const interval = setInterval(fetchDevices, 30000) // Refresh every 30 seconds
+
+    // Device changes and new samples are pushed by the server; the full
+    // list is only fetched again after a reconnect to resynchronize
+    const events = new EventSource('http://localhost:5000/api/stream')
+    let connected = false
+    events.onopen = () => {
+      if (connected) fetchDevices()
+      connected = true
+    }
+    events.addEventListener('device', (event) => {
+      const device = JSON.parse(event.data)
+      setDevices((current) => {
+        const index = current.findIndex((d) => d.id === device.id)
+        if (index === -1) return [...current, device]
+        const next = [...current]
+        next[index] = device
+        return next
+      })
+      setSelectedDevice((current) => (current && current.id === device.id ? device : current))
+    })
+    events.addEventListener('device_deleted', (event) => {
+      const { id } = JSON.parse(event.data)
+      setDevices((current) => current.filter((d) => d.id !== id))
+      setSelectedDevice((current) => (current && current.id === id ? null : current))
+    })
+    events.addEventListener('metrics', (event) => {
+      const { device_id, samples } = JSON.parse(event.data)
+      if (selectedDeviceId.current !== device_id) return
+      // Raw samples cannot be appended to rollup buckets, and past
+      // METRICS_MAX_POINTS the server would return buckets too
+      if (metricsResolution.current !== 'raw') {
+        scheduleMetricsRefetch()
+        return
+      }
+      const hourStart = new Date()
+      hourStart.setUTCMinutes(0, 0, 0)
+      setMetrics((current) => {
+        const next = [...current, ...samples].filter((m) => Date.parse(m.timestamp) >= hourStart.getTime())
+        if (next.length > METRICS_MAX_POINTS) scheduleMetricsRefetch()
+        return next.slice(-METRICS_MAX_POINTS)
+      })
+    })
     
     // Add event listener for device refresh
     const handleRefresh = () => fetchDevices()
     window.addEventListener('refreshDevices', handleRefresh)
     
     return () => {
-      clearInterval(interval)
+      events.close()
+      clearTimeout(metricsRefetch.current)
       window.removeEventListener('refreshDevices', handleRefresh)
     }
   }, [])
 
+  useEffect(() => {
+    selectedDeviceId.current = selectedDevice ? selectedDevice.id : null
+  }, [selectedDevice])
+
   useEffect(() => {
     if (selectedDevice) {
       fetchDeviceMetrics(selectedDevice.id)
     }
-  }, [selectedDevice])
+  }, [selectedDevice?.id])
 
   const fetchDevices = async () => {
     try {
@@ -59,14 +114,25 @@ function App() {
 
   const fetchDeviceMetrics = async (deviceId) => {
     try {
-      const response = await fetch(`http://localhost:5000/api/devices/${deviceId}/metrics?timeframe=hour`)
+      const response = await fetch(`http://localhost:5000/api/devices/${deviceId}/metrics?timeframe=hour&max_points=${METRICS_MAX_POINTS}`)
       const data = await response.json()
+      // A slow response for a device that is no longer selected is dropped
+      if (selectedDeviceId.current !== deviceId) return
+      metricsResolution.current = response.headers.get('X-Resolution') || 'raw'
       setMetrics(data)
     } catch (error) {
       console.error('Error fetching metrics:', error)
     }
   }
 
+  const scheduleMetricsRefetch = () => {
+    if (metricsRefetch.current) return
+    metricsRefetch.current = setTimeout(() => {
+      metricsRefetch.current = null
+      if (selectedDeviceId.current !== null) fetchDeviceMetrics(selectedDeviceId.current)
+    }, METRICS_REFETCH_DELAY)
+  }
+
   const filteredDevices = devices.filter(device => {
     return (
       (!filters.location || device.location.toLowerCase().includes(filters.location.toLowerCase())) &&
@@ -40,8 +40,20 @@ const DeviceList = ({ devices, selectedDevice, onDeviceSelect, onRefresh }) => {
       const data = await response.json()
       if (data.error) {
         alert(`Speed test failed: ${data.error}`)
+        return
+      }
+
+      // The test runs as a background job; poll it until it finishes
+      let job = data.job
+      while (job.status === 'queued' || job.status === 'running') {
+        await new Promise((resolve) => setTimeout(resolve, 2000))
+        const status = await fetch(`http://localhost:5000${data.status_url}`)
+        job = await status.json()
+      }
+      if (job.status === 'completed') {
+        alert(`Speed test results:\nDownload: ${job.result.download} Mbps\nUpload: ${job.result.upload} Mbps`)
       } else {
-        alert(`Speed test results:\nDownload: ${data.download} Mbps\nUpload: ${data.upload} Mbps`)
+        alert(`Speed test failed: ${job.error}`)
       }
     } catch (error) {
       alert('Failed to run speed test')
@@ -0,0 +1,325 @@
+"""Low-overhead counters, gauges and histograms.
+
+Metrics live in a Registry that renders them in the Prometheus text
+exposition format for the server's /metrics endpoint, or as a plain dict
+for the agent's status file. Label values are passed positionally in
+the order of the metric's label names. An update takes one lock and one
+dict lookup, and nothing is allocated once a label set has been seen.
+"""
+import os
+import json
+import math
+import time
+import bisect
+import threading
+from functools import wraps
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds in seconds of the default histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Probes range from sub-millisecond socket calls to minute-long speed tests
+PROBE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named metric with a value per label set.
+
+    set_function() replaces the stored values with a callable evaluated at
+    collection time, returning a number or a dict of label tuples to
+    numbers; use it to expose counters other objects already keep.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        self.lock = threading.Lock()
+        self.values = {}
+        self.function = None
+
+    def set_function(self, function):
+        self.function = function
+        return self
+
+    def collect(self):
+        """(label values, value) pairs"""
+        if self.function is not None:
+            value = self.function()
+            return list(value.items()) if isinstance(value, dict) else [((), value)]
+        with self.lock:
+            return list(self.values.items())
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for labels, value in self.collect():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+    def snapshot(self):
+        values = self.collect()
+        if not self.labelnames:
+            return values[0][1] if values else 0
+        return {','.join(map(str, labels)): value for labels, value in values}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        if not self.registry.enabled:
+            return
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, *labels):
+        if not self.registry.enabled:
+            return
+        with self.lock:
+            self.values[labels] = value
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram(Metric):
+    """Counts of observations per bucket, with their sum.
+
+    Buckets are upper bounds; each observation is counted once, in the
+    first bucket it fits, and made cumulative when rendered.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        if not self.registry.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def time(self, *labels):
+        """Context manager observing the time spent inside it"""
+        return _Timer(self, labels)
+
+    def collect(self):
+        with self.lock:
+            return [(labels, (list(counts), total)) for labels, (counts, total) in self.values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total) in self.collect():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{_format_labels(self.labelnames, labels, ("le", _format_value(float(bound))))} {cumulative}'
+                )
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+    def _summary(self, counts, total):
+        count = sum(counts)
+        summary = {'count': count, 'sum': round(total, 6)}
+        if count:
+            summary['avg'] = round(total / count, 6)
+            # Upper bound of the bucket holding the 95th percentile
+            seen = 0
+            for bound, bucket in zip((*self.buckets, math.inf), counts):
+                seen += bucket
+                if seen >= 0.95 * count:
+                    summary['p95_le'] = bound if bound != math.inf else None
+                    break
+        return summary
+
+    def snapshot(self):
+        values = {','.join(map(str, labels)): self._summary(*state) for labels, state in self.collect()}
+        if not self.labelnames:
+            return values.get('', self._summary([0], 0.0))
+        return values
+
+
+class Registry:
+    """Set of metrics rendered together; setting enabled to False turns updates into no-ops"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.enabled = True
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        # Idempotent, so modules can declare their metrics at import time
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, labelnames, self, **kwargs)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered with a different type or labels")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f'# {metric.name} could not be collected: {_escape(e)}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """All metrics as a JSON-serializable dict; histograms are summarized"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+# Network probes of network_monitor and latency, in the agent and the server
+PROBE_DURATION = histogram(
+    'network_probe_duration_seconds', 'Time taken by a network probe', ['probe'], buckets=PROBE_BUCKETS
+)
+PROBE_FAILURES = counter('network_probe_failures_total', 'Network probes that raised or returned no result', ['probe'])
+
+
+def timed(metric, *labels, failures=None, failed=None):
+    """Decorator observing the duration of every call in a histogram.
+
+    failures, if given, is a counter incremented when the call raises or
+    failed(result) is true.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                if failures is not None:
+                    failures.inc(*labels)
+                raise
+            finally:
+                metric.observe(time.perf_counter() - start, *labels)
+            if failures is not None and failed is not None and failed(result):
+                failures.inc(*labels)
+            return result
+        return wrapper
+    return decorator
+
+
+def probe(name, failed=lambda result: result is None):
+    """timed() for a network probe"""
+    return timed(PROBE_DURATION, name, failures=PROBE_FAILURES, failed=failed)
+
+
+def instrument_sqlalchemy(engine, session):
+    """Time every statement run on engine and every commit of session"""
+    from sqlalchemy import event
+
+    statements = histogram('db_statement_duration_seconds', 'Time to execute a SQL statement', ['operation'])
+    commits = histogram('db_commit_duration_seconds', 'Time to flush and commit a session')
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['statement_started'].pop()
+        statements.observe(time.perf_counter() - started, statement.lstrip().split(None, 1)[0].upper())
+
+    def before_commit(session):
+        session.info['commit_started'] = time.perf_counter()
+
+    def after_commit(session):
+        started = session.info.pop('commit_started', None)
+        if started is not None:
+            commits.observe(time.perf_counter() - started)
+
+    def handle_error(context):
+        # after_cursor_execute does not run for a failed statement
+        if context.connection is not None and context.connection.info.get('statement_started'):
+            context.connection.info['statement_started'].pop()
+
+    def after_soft_rollback(session, previous_transaction):
+        session.info.pop('commit_started', None)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', handle_error)
+    event.listen(session, 'before_commit', before_commit)
+    event.listen(session, 'after_commit', after_commit)
+    event.listen(session, 'after_soft_rollback', after_soft_rollback)
+
+
+def write_status(path, **extra):
+    """Write the registry snapshot and extra fields to a JSON file atomically"""
+    status = dict(extra, updated_at=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), metrics=REGISTRY.snapshot())
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(status, f, indent=2, default=str)
+    os.replace(temporary, path)
@@ -0,0 +1,178 @@
+import os
+import time
+import errno
+import socket
+import struct
+import select
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+import instrumentation
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+# Port used for TCP connect probes when ICMP sockets are not permitted
+DEFAULT_TCP_PORT = 443
+
+
+def _checksum(data):
+    """Internet checksum of an ICMP packet"""
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def _echo_request(ident, seq):
+    """Build an ICMP echo request carrying its sequence number"""
+    payload = b'network-monitor'
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    checksum = _checksum(header + payload)
+    return struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, ident, seq) + payload
+
+
+def icmp_available():
+    """Whether this process may open an unprivileged ICMP datagram socket"""
+    try:
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP).close()
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+def _icmp_probe(address, count, timeout):
+    """Send count echo requests at once and return the RTT of each in ms"""
+    rtts = [None] * count
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+    try:
+        sock.setblocking(False)
+        ident = os.getpid() & 0xffff
+        sent = {}
+        for seq in range(count):
+            sent[seq] = time.perf_counter()
+            sock.sendto(_echo_request(ident, seq), (address, 0))
+
+        deadline = time.monotonic() + timeout
+        pending = count
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                break
+            packet = sock.recv(1024)
+            received = time.perf_counter()
+            # Some platforms (macOS) hand back the IP header as well
+            if packet and packet[0] >> 4 == 4:
+                packet = packet[(packet[0] & 0x0f) * 4:]
+            if len(packet) < 8:
+                continue
+            icmp_type, _, _, _, seq = struct.unpack('!BBHHH', packet[:8])
+            # The kernel rewrites the identifier, so only the sequence is checked
+            if icmp_type == ICMP_ECHO_REPLY and seq in sent and rtts[seq] is None:
+                rtts[seq] = (received - sent[seq]) * 1000
+                pending -= 1
+    finally:
+        sock.close()
+    return rtts
+
+
+def _tcp_probe(address, port, count, timeout):
+    """Open count TCP connections at once and return each handshake RTT in ms"""
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    rtts = [None] * count
+    sockets = {}
+    try:
+        for index in range(count):
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            started = time.perf_counter()
+            result = sock.connect_ex((address, port))
+            if result == 0:
+                rtts[index] = (time.perf_counter() - started) * 1000
+                sock.close()
+            elif result in (errno.EINPROGRESS, errno.EWOULDBLOCK, getattr(errno, 'WSAEWOULDBLOCK', -1)):
+                sockets[sock] = (index, started)
+            else:
+                sock.close()
+
+        deadline = time.monotonic() + timeout
+        while sockets:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            _, writable, failed = select.select([], list(sockets), list(sockets), remaining)
+            finished = time.perf_counter()
+            for sock in set(writable) | set(failed):
+                index, started = sockets.pop(sock)
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                # A refused connection still proves the host answered
+                if error in (0, errno.ECONNREFUSED, getattr(errno, 'WSAECONNREFUSED', -1)):
+                    rtts[index] = (finished - started) * 1000
+                sock.close()
+    finally:
+        for sock in sockets:
+            sock.close()
+    return rtts
+
+
+def summarize(rtts):
+    """Reduce raw RTT samples (None for lost probes) to latency statistics"""
+    received = [rtt for rtt in rtts if rtt is not None]
+    stats = {
+        'sent': len(rtts),
+        'received': len(received),
+        'packet_loss': round(100 * (len(rtts) - len(received)) / len(rtts), 2) if rtts else None,
+        'min': None,
+        'avg': None,
+        'max': None,
+        'stddev': None,
+        'jitter': None
+    }
+    if received:
+        stats['min'] = round(min(received), 2)
+        stats['avg'] = round(statistics.fmean(received), 2)
+        stats['max'] = round(max(received), 2)
+        stats['stddev'] = round(statistics.pstdev(received), 2)
+        # Mean difference between consecutive replies, as in RFC 3550
+        deltas = [abs(b - a) for a, b in zip(received, received[1:])]
+        stats['jitter'] = round(statistics.fmean(deltas), 2) if deltas else 0.0
+    return stats
+
+
+@instrumentation.probe('ping', failed=lambda stats: stats['avg'] is None)
+def measure_latency(host, count=4, timeout=2, port=DEFAULT_TCP_PORT, method=None):
+    """Measure round-trip latency to a host without spawning a process.
+
+    Uses an unprivileged ICMP datagram socket when the platform allows it
+    and falls back to timing TCP handshakes against port otherwise. Pass
+    method='icmp' or method='tcp' to force one of them.
+    """
+    if method is None:
+        method = 'icmp' if icmp_available() else 'tcp'
+
+    try:
+        family = socket.AF_INET if method == 'icmp' else 0
+        address = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)[0][4][0]
+    except (socket.gaierror, IndexError):
+        stats = summarize([None] * count)
+        stats.update(host=host, method=method, error='Could not resolve host')
+        return stats
+
+    if method == 'icmp':
+        rtts = _icmp_probe(address, count, timeout)
+    else:
+        rtts = _tcp_probe(address, port, count, timeout)
+
+    stats = summarize(rtts)
+    stats.update(host=host, method=method)
+    return stats
+
+
+def measure_many(hosts, count=4, timeout=2, port=DEFAULT_TCP_PORT, method=None):
+    """Measure latency to several hosts concurrently"""
+    if not hosts:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+        futures = {host: executor.submit(measure_latency, host, count, timeout, port, method) for host in hosts}
+        return {host: future.result() for host, future in futures.items()}
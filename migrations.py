@@ -0,0 +1,64 @@
+import os
+import logging
+from datetime import datetime
+from sqlalchemy import text
+
+# SQLite connection settings, applied to every new connection
+SQLITE_PRAGMAS = {
+    'auto_vacuum': 'INCREMENTAL',  # only takes effect on new databases
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536')),  # negative means KiB
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000
+}
+
+# Ordered schema changes for databases created by older versions. New
+# databases get the same objects from db.create_all(), so every statement
+# must be safe to run against a schema that already has them.
+MIGRATIONS = [
+    (1, 'Index metrics by device and time, devices by hostname', [
+        'CREATE INDEX IF NOT EXISTS ix_network_metrics_device_timestamp ON network_metrics (device_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS ix_device_hostname ON device (hostname)',
+        'ANALYZE'
+    ]),
+    (2, 'Index metrics and rollups by age for retention', [
+        'CREATE INDEX IF NOT EXISTS ix_network_metrics_timestamp ON network_metrics (timestamp)',
+        'CREATE INDEX IF NOT EXISTS ix_metrics_rollup_resolution_bucket ON metrics_rollup (resolution, bucket_start)'
+    ])
+]
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Engine 'connect' listener that tunes each new SQLite connection"""
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
+
+def migrate(engine):
+    """Apply pending migrations in order and return the resulting version"""
+    with engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations ('
+            'version INTEGER PRIMARY KEY, '
+            'name VARCHAR(200) NOT NULL, '
+            'applied_at DATETIME NOT NULL)'
+        ))
+        current = conn.execute(text('SELECT MAX(version) FROM schema_migrations')).scalar() or 0
+
+    for version, name, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        logging.info(f"Applying migration {version}: {name}")
+        with engine.begin() as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+            conn.execute(
+                text('INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)'),
+                {'version': version, 'name': name, 'applied_at': datetime.utcnow()}
+            )
+        current = version
+    return current
@@ -0,0 +1,107 @@
+from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime
+
+db = SQLAlchemy()
+
+# Database Models
+class Device(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    hostname = db.Column(db.String(100), nullable=False, index=True)
+    username = db.Column(db.String(100))
+    location = db.Column(db.String(100))
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    connection_type = db.Column(db.String(50))
+    wifi_ssid = db.Column(db.String(100))
+    signal_strength = db.Column(db.String(20))
+    internal_ip = db.Column(db.String(50))
+    external_ip = db.Column(db.String(50))
+    status = db.Column(db.String(20), default='offline')
+
+class NetworkMetrics(db.Model):
+    __table_args__ = (
+        db.Index('ix_network_metrics_device_timestamp', 'device_id', 'timestamp'),
+        db.Index('ix_network_metrics_timestamp', 'timestamp'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.Integer, db.ForeignKey('device.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    dns_resolution_time = db.Column(db.Float)
+    download_speed = db.Column(db.Float)
+    upload_speed = db.Column(db.Float)
+    latency = db.Column(db.Float)
+
+# Diagnostics an agent sends with a sample: the passive traffic summary,
+# per-resolver DNS and per-host ping statistics and probe durations, as one
+# JSON object. Kept for RETENTION_DETAIL_DAYS; never rolled up.
+class SampleDetail(db.Model):
+    __table_args__ = (
+        db.Index('ix_sample_detail_device_timestamp', 'device_id', 'timestamp'),
+        db.Index('ix_sample_detail_timestamp', 'timestamp'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.Integer, db.ForeignKey('device.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    data = db.Column(db.Text, nullable=False)
+
+# Pre-aggregated metrics, one row per device, resolution, bucket and metric
+class MetricsRollup(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('device_id', 'resolution', 'metric', 'bucket_start', name='uq_metrics_rollup_bucket'),
+        db.Index('ix_metrics_rollup_resolution_bucket', 'resolution', 'bucket_start'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.Integer, db.ForeignKey('device.id'), nullable=False)
+    resolution = db.Column(db.String(3), nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    metric = db.Column(db.String(32), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    min = db.Column(db.Float)
+    max = db.Column(db.Float)
+    sum = db.Column(db.Float)
+    p95 = db.Column(db.Float)
+    histogram = db.Column(db.Text)
+
+# Speed test jobs, queued by any web process and run by the job worker. At
+# most one job per device is queued or running at a time.
+class SpeedTest(db.Model):
+    __table_args__ = (
+        db.Index(
+            'uq_speed_test_active_device', 'device_id', unique=True,
+            sqlite_where=db.text("status IN ('queued', 'running')"),
+            postgresql_where=db.text("status IN ('queued', 'running')")
+        ),
+        db.Index('ix_speed_test_status_created', 'status', 'created_at'),
+    )
+
+    id = db.Column(db.String(32), primary_key=True)
+    device_id = db.Column(db.Integer, db.ForeignKey('device.id'), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+
+# Events and cache invalidations handed between the web processes and the
+# job worker, which poll for rows newer than the last one they saw. Ids must
+# never be reused once old rows are deleted.
+class StreamEvent(db.Model):
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    event = db.Column(db.String(32), nullable=False)
+    data = db.Column(db.Text, nullable=False)
+
+# Alerts currently firing, kept by the job worker so that every web
+# process can list them
+class ActiveAlert(db.Model):
+    rule = db.Column(db.String(64), primary_key=True)
+    device_id = db.Column(db.Integer, primary_key=True)
+    severity = db.Column(db.String(16), nullable=False)
+    since = db.Column(db.DateTime, nullable=False)
+    value = db.Column(db.Float)
+    message = db.Column(db.Text)
@@ -0,0 +1,307 @@
+"""Change-driven discovery of the active connection and its addresses.
+
+Finding the Wi-Fi network forks netsh or iw and the external address
+takes a host name lookup, yet neither changes until the network does.
+NetworkState fingerprints the interfaces, their addresses and the default
+route, which psutil and /proc answer in well under a millisecond, and
+repeats the full discovery only when that fingerprint changes or the last
+discovery is older than max_age. Signal strength drifts without the
+fingerprint changing, so on Linux it is re-read from /proc/net/wireless
+on every call.
+"""
+import os
+import sys
+import socket
+import threading
+import subprocess
+import time
+import psutil
+import instrumentation
+
+# Seconds after which discovery runs again even if the network looks unchanged
+NETWORK_STATE_MAX_AGE = int(os.getenv('NETWORK_STATE_MAX_AGE', '600'))
+
+PROC_NET_ROUTE = '/proc/net/route'
+PROC_NET_WIRELESS = '/proc/net/wireless'
+SYS_CLASS_NET = '/sys/class/net'
+
+# Seconds a fingerprint check is reused, so the connection and IP probes of
+# one collection cycle fingerprint the network once
+CHECK_INTERVAL = 1.0
+
+# Route flag in /proc/net/route for a route that is up
+RTF_UP = 0x1
+
+# Substrings of wireless adapter names where /sys/class/net is not available
+WIRELESS_NAME_HINTS = ('wi-fi', 'wifi', 'wireless', 'wlan', '802.11')
+
+DISCOVERIES = instrumentation.counter(
+    'network_state_discoveries_total', 'Full discoveries of connection and IP details', ['reason']
+)
+
+
+def _read(path):
+    try:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _run(command, timeout=5):
+    """Output of a command, or None if it is missing, fails or hangs"""
+    try:
+        return subprocess.check_output(
+            command, timeout=timeout, stderr=subprocess.DEVNULL
+        ).decode('utf-8', errors='replace')
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def parse_proc_route(text):
+    """Interface of the IPv4 default route with the lowest metric in /proc/net/route"""
+    best = None
+    for line in text.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) < 8:
+            continue
+        try:
+            flags, metric = int(fields[3], 16), int(fields[6])
+        except ValueError:
+            continue
+        if fields[1] == '00000000' and fields[7] == '00000000' and flags & RTF_UP:
+            if best is None or metric < best[0]:
+                best = (metric, fields[0])
+    return best[1] if best else None
+
+
+def parse_proc_wireless(text):
+    """Link quality and signal level in dBm per interface from /proc/net/wireless"""
+    wireless = {}
+    # Two header lines, then e.g. ' wlan0: 0000   54.  -56.  -256  0 0 0 0 0  0'
+    for line in text.splitlines()[2:]:
+        name, sep, rest = line.partition(':')
+        fields = rest.split()
+        if not sep or len(fields) < 3:
+            continue
+        try:
+            quality, level = float(fields[1].rstrip('.')), float(fields[2].rstrip('.'))
+        except ValueError:
+            continue
+        # Some drivers report dBm as an unsigned byte, e.g. 200 for -56
+        if level > 0:
+            level -= 256
+        wireless[name.strip()] = {'link_quality': quality, 'signal_dbm': level}
+    return wireless
+
+
+def parse_iw_link(output):
+    """SSID and signal level in dBm from `iw dev <interface> link`"""
+    info = {}
+    for line in output.splitlines():
+        key, sep, value = line.strip().partition(':')
+        if not sep:
+            continue
+        if key == 'SSID':
+            info['wifi_ssid'] = value.strip()
+        elif key == 'signal':
+            try:
+                info['signal_dbm'] = float(value.split()[0])
+            except (IndexError, ValueError):
+                pass
+    return info
+
+
+def parse_netsh_wlan(output, interface=None):
+    """SSID and signal strength from `netsh wlan show interfaces`.
+
+    With several wireless adapters, the block naming interface is used,
+    else the first with an SSID. A key seen twice starts the next block,
+    which holds for localized output too. Signal is reported in percent and
+    converted to approximate dBm.
+    """
+    blocks, block = [], {}
+    for line in output.splitlines():
+        key, sep, value = line.partition(':')
+        key, value = key.strip(), value.strip()
+        if not sep or not key:
+            continue
+        if key in block:
+            blocks.append(block)
+            block = {}
+        block[key] = value
+    if block:
+        blocks.append(block)
+
+    chosen = next((b for b in blocks if interface is not None and interface in b.values()), None)
+    if chosen is None:
+        chosen = next((b for b in blocks if b.get('SSID')), None)
+    if chosen is None or not chosen.get('SSID'):
+        return {}
+
+    info = {'wifi_ssid': chosen['SSID']}
+    signal = next((value for key, value in chosen.items() if key.startswith('Signal')), None)
+    if signal:
+        try:
+            percent = int(signal.strip().rstrip('%'))
+            # -100 dBm at 0% up to -50 dBm at 100%
+            info['signal_strength'] = f"{int(-100 + percent / 2)} dBm"
+        except ValueError:
+            pass
+    return info
+
+
+def is_loopback(addresses):
+    return any(a.address.startswith('127.') or a.address == '::1' for a in addresses)
+
+
+def is_wireless(interface):
+    """Whether an interface is a Wi-Fi adapter"""
+    if os.path.isdir(SYS_CLASS_NET):
+        return os.path.exists(os.path.join(SYS_CLASS_NET, interface, 'wireless'))
+    name = interface.lower()
+    return name.startswith('wl') or any(hint in name for hint in WIRELESS_NAME_HINTS)
+
+
+def _ipv4(addresses):
+    return next((a.address for a in addresses if a.family == socket.AF_INET), None)
+
+
+def _source_address():
+    """Local address the OS picks to reach the internet; connecting a UDP socket sends nothing"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(('8.8.8.8', 80))
+        return s.getsockname()[0]
+    except OSError:
+        return None
+    finally:
+        s.close()
+
+
+def default_route(if_addrs, if_stats):
+    """(interface, IPv4 address) the default route leaves through.
+
+    Linux reads the routing table; elsewhere the source address of a
+    connected UDP socket is matched to an interface. Without a default
+    route the first interface that is up and not loopback is used.
+    """
+    interface = None
+    route = _read(PROC_NET_ROUTE)
+    if route is not None:
+        interface = parse_proc_route(route)
+    else:
+        address = _source_address()
+        interface = next(
+            (name for name, addresses in if_addrs.items() if any(a.address == address for a in addresses)), None
+        )
+    if interface is None:
+        interface = next((
+            name for name, addresses in if_addrs.items()
+            if name in if_stats and if_stats[name].isup and not is_loopback(addresses) and _ipv4(addresses)
+        ), None)
+    if interface is None:
+        return None, None
+    return interface, _ipv4(if_addrs.get(interface, ()))
+
+
+def fingerprint(if_addrs, if_stats, route):
+    """Hashable summary of everything that changes when the network does"""
+    return (route, tuple(sorted(
+        (name, name in if_stats and if_stats[name].isup,
+         tuple(sorted((int(a.family), a.address, a.netmask or '') for a in if_addrs.get(name, ()))))
+        for name in set(if_addrs) | set(if_stats)
+    )))
+
+
+def wifi_details(interface):
+    """SSID and signal strength of a Wi-Fi interface; forks netsh or iw"""
+    if sys.platform == 'win32':
+        output = _run(['netsh', 'wlan', 'show', 'interfaces'])
+        return parse_netsh_wlan(output, interface) if output else {}
+    if sys.platform.startswith('linux'):
+        output = _run(['iw', 'dev', interface, 'link'])
+        info = parse_iw_link(output) if output else {}
+        if 'wifi_ssid' not in info:
+            ssid = _run(['iwgetid', '-r', interface])
+            if ssid and ssid.strip():
+                info['wifi_ssid'] = ssid.strip()
+        if 'signal_dbm' in info:
+            info['signal_strength'] = f"{int(info.pop('signal_dbm'))} dBm"
+        return info
+    return {}
+
+
+class NetworkState:
+    """Connection and IP details, rediscovered only when the network changes"""
+
+    def __init__(self, max_age=NETWORK_STATE_MAX_AGE, clock=time.monotonic):
+        self.max_age = max_age
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.fingerprint = None
+        self.discovered_at = None
+        self.checked_at = None
+        self.interface = None
+        self.connection = {}
+        self.addresses = {}
+
+    def refresh(self):
+        """Rediscover if the fingerprint changed or discovery is stale; True if it ran"""
+        checked_at = self.checked_at
+        if checked_at is not None and self.clock() - checked_at < CHECK_INTERVAL:
+            return False
+        if_addrs, if_stats = psutil.net_if_addrs(), psutil.net_if_stats()
+        route = default_route(if_addrs, if_stats)
+        current = fingerprint(if_addrs, if_stats, route)
+        with self.lock:
+            if self.fingerprint is None:
+                reason = 'initial'
+            elif current != self.fingerprint:
+                reason = 'changed'
+            elif self.clock() - self.discovered_at >= self.max_age:
+                reason = 'expired'
+            else:
+                self.checked_at = self.clock()
+                return False
+            self.discover(route)
+            self.fingerprint = current
+            self.discovered_at = self.checked_at = self.clock()
+        DISCOVERIES.inc(reason)
+        return True
+
+    def discover(self, route):
+        """Run the expensive part: Wi-Fi details and the host name lookup"""
+        interface, internal_ip = route
+        connection = {}
+        if interface is not None:
+            connection['interface'] = interface
+            connection['connection_type'] = 'Wi-Fi' if is_wireless(interface) else 'Ethernet'
+            if connection['connection_type'] == 'Wi-Fi':
+                try:
+                    connection.update(wifi_details(interface))
+                except Exception as e:
+                    connection['wifi_error'] = str(e)
+        try:
+            external_ip = socket.gethostbyname(socket.gethostname())
+        except OSError:
+            external_ip = 'N/A'
+        self.interface = interface
+        self.connection = connection
+        self.addresses = {'internal_ip': internal_ip or 'N/A', 'external_ip': external_ip}
+
+    def connection_info(self):
+        self.refresh()
+        with self.lock:
+            info = dict(self.connection)
+        if info.get('connection_type') == 'Wi-Fi':
+            text = _read(PROC_NET_WIRELESS)
+            current = parse_proc_wireless(text).get(info['interface']) if text else None
+            if current:
+                info['signal_strength'] = f"{int(current['signal_dbm'])} dBm"
+        return info
+
+    def ip_addresses(self):
+        self.refresh()
+        with self.lock:
+            return dict(self.addresses)
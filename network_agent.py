@@ -1,42 +1,80 @@
 import time
-import json
+import threading
+import psutil
 import logging
 import requests
 import os
 import sys
-import win32gui
-import win32con
-from datetime import datetime
+import signal
+import argparse
+from datetime import datetime, timezone
 from network_monitor import (
     get_connection_info,
     get_ip_addresses,
-    measure_dns_resolution,
-    ping_host,
+    measure_dns,
     run_speed_test,
-    get_device_info
+    get_device_info,
+    network_state
 )
-from system_tray import SystemTrayIcon
+from latency import measure_latency
+from probe_runner import Probe, ProbeRunner
+from spool import MetricsSpool
+from transport import AgentTransport
+from agent_schedule import CollectionSchedule
+from passive import PassiveSampler, SpeedTestPolicy
+import instrumentation
 
 # Get cloud configuration from environment variables
 CLOUD_ENDPOINT = os.getenv('CLOUD_ENDPOINT', 'https://network-monitor-api.example.com/api')
 API_KEY = os.getenv('API_KEY', '')  # Required for authentication
+# Upload compression: gzip, zstd (needs zstandard here and on the server) or identity
+UPLOAD_ENCODING = os.getenv('UPLOAD_ENCODING', 'gzip')
 
-# Configure logging to file only, no console output
-if not os.path.exists('logs'):
-    os.makedirs('logs')
-
-log_file = os.path.join('logs', 'network_agent.log')
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file, mode='a', encoding='utf-8')
-    ]
-)
+# Collection interval in seconds of each probe group
+METRIC_INTERVAL = int(os.getenv('METRIC_INTERVAL', '300'))
+PROBE_INTERVALS = {
+    'ping': int(os.getenv('PING_INTERVAL', '30')),
+    'dns': int(os.getenv('DNS_INTERVAL', '60')),
+    'connection': METRIC_INTERVAL,
+    'speed_test': int(os.getenv('SPEEDTEST_INTERVAL', '3600'))
+}
+
+# Every cycle's sample is spooled; the spool is uploaded in one batch
+# request per UPLOAD_INTERVAL, so fast ping cycles do not each cost a request
+UPLOAD_INTERVAL = int(os.getenv('UPLOAD_INTERVAL', str(METRIC_INTERVAL)))
+
+# Offline buffer configuration. By default the buffer holds BUFFER_HOURS of
+# samples at the fastest probe interval.
+BUFFER_HOURS = 8
+BUFFER_SIZE = int(os.getenv('BUFFER_SIZE') or BUFFER_HOURS * 3600 // min(PROBE_INTERVALS.values()))
+BUFFER_MAX_BYTES = int(os.getenv('BUFFER_MAX_BYTES', str(10 * 1024 * 1024)))
+SPOOL_PATH = os.getenv('SPOOL_PATH', 'metrics_spool.db')
+
+# Largest factor intervals are stretched by while degraded or on battery
+MAX_BACKOFF = 8
+
+# Average packet loss (%) above which the link counts as degraded
+DEGRADED_PACKET_LOSS = 50
+
+# Hosts pinged on every collection cycle
+PING_HOSTS = ['google.com', '8.8.8.8', '1.1.1.1']
 
-# Hide console window
-hwnd = win32gui.GetForegroundWindow()
-win32gui.ShowWindow(hwnd, win32con.SW_HIDE)
+# Echo probes sent to each host per cycle
+PING_COUNT = 5
+
+# Maximum number of buffered samples uploaded per batch request
+BATCH_SIZE = 500
+
+# JSON file rewritten after every cycle with the agent's counters and the
+# probe timings recorded by network_monitor
+AGENT_STATUS_FILE = os.getenv('AGENT_STATUS_FILE', os.path.join('logs', 'agent_status.json'))
+
+CYCLES = instrumentation.counter('agent_cycles_total', 'Collection cycles run')
+UPLOADS = instrumentation.counter('agent_uploads_total', 'Upload requests by kind and outcome', ['kind', 'outcome'])
+SAMPLES_BUFFERED = instrumentation.counter('agent_samples_buffered_total', 'Samples written to the offline buffer')
+SPEED_TEST_DECISIONS = instrumentation.counter(
+    'agent_speed_test_decisions_total', 'Scheduled speed tests run or skipped on passive data', ['decision']
+)
 
 # Properly handle stdout/stderr to prevent console window
 class NullWriter:
@@ -45,118 +83,240 @@ class NullWriter:
     def flush(self):
         pass
 
-# Always redirect output to prevent console window
-sys.stdout = NullWriter()
-sys.stderr = NullWriter()
+def configure_logging(headless):
+    """Log to logs/network_agent.log, and to stderr when running headless"""
+    if not os.path.exists('logs'):
+        os.makedirs('logs')
+
+    handlers = [logging.FileHandler(os.path.join('logs', 'network_agent.log'), mode='a', encoding='utf-8')]
+    if headless:
+        handlers.append(logging.StreamHandler())
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=handlers
+    )
+
+def hide_console():
+    """Hide the console window of the Windows tray build and silence its output"""
+    try:
+        import win32gui
+        import win32con
+        hwnd = win32gui.GetForegroundWindow()
+        if hwnd:
+            win32gui.ShowWindow(hwnd, win32con.SW_HIDE)
+    except ImportError:
+        logging.warning("pywin32 is not installed; console window left visible")
+
+    # Redirect output so nothing reopens a console window
+    sys.stdout = NullWriter()
+    sys.stderr = NullWriter()
+
+def start_tray(agent):
+    """Show the system tray icon; None when pystray or Pillow is missing"""
+    try:
+        from system_tray import SystemTrayIcon
+    except ImportError as e:
+        logging.warning(f"System tray unavailable, running headless: {str(e)}")
+        return None
+    tray_icon = SystemTrayIcon(agent)
+    tray_icon.run()
+    return tray_icon
 
 class NetworkAgent:
-    def __init__(self, cloud_endpoint=CLOUD_ENDPOINT, interval=300):
+    def __init__(self, cloud_endpoint=CLOUD_ENDPOINT, interval=METRIC_INTERVAL, headless=True):
         self.cloud_endpoint = cloud_endpoint
-        self.interval = interval  # Default 5 minutes
         self.device_info = get_device_info()
-        self.buffer = []
-        self.max_buffer_size = 100
+        self.schedule = CollectionSchedule(
+            dict(PROBE_INTERVALS, connection=interval),
+            self.device_info['hostname']
+        )
+        self.degraded_cycles = 0
+        self.stop_event = threading.Event()
+        self.buffer = MetricsSpool(SPOOL_PATH, max_records=BUFFER_SIZE, max_bytes=BUFFER_MAX_BYTES)
         self.running = True
-        self.tray_icon = SystemTrayIcon(self)
-        self.tray_icon.run()
+        self.next_upload = time.monotonic()
+        self.probe_runner = ProbeRunner()
+        # Interface byte counters sampled in the background; speed tests
+        # only run when they cannot vouch for the last measured capacity
+        self.passive = PassiveSampler().start()
+        self.speed_test_policy = SpeedTestPolicy()
+        self.traffic_since = None
+        self.transport = AgentTransport(
+            cloud_endpoint,
+            api_key=API_KEY,
+            user_agent=f'NetworkAgent/{self.device_info["hostname"]}',
+            encoding=UPLOAD_ENCODING
+        )
+        instrumentation.gauge('agent_buffer_depth', 'Samples waiting in the offline buffer').set_function(
+            lambda: len(self.buffer)
+        )
+        instrumentation.gauge('agent_backoff_factor', 'Factor collection intervals are stretched by').set_function(
+            lambda: self.schedule.backoff
+        )
+        # The tray is an optional plugin; headless agents have no UI at all
+        self.tray_icon = None if headless else start_tray(self)
         # Register device with server
         self.register_device()
 
-    def collect_metrics(self):
-        """Collect all network metrics"""
+    def collect_metrics(self, groups=PROBE_INTERVALS):
+        """Collect the given probe groups concurrently"""
         try:
+            probes = []
+            if 'connection' in groups:
+                probes.append(Probe('connection_info', get_connection_info, timeout=15))
+                probes.append(Probe('ip_addresses', get_ip_addresses, timeout=10))
+            if 'dns' in groups:
+                probes.append(Probe('dns', measure_dns, timeout=10))
+            if 'ping' in groups:
+                probes.extend(Probe(f'ping:{host}', measure_latency, (host, PING_COUNT), timeout=10) for host in PING_HOSTS)
+            speed_test = None
+            if 'speed_test' in groups:
+                speed_test = self.speed_test_policy.reason_to_test()
+                SPEED_TEST_DECISIONS.inc('run' if speed_test else 'skipped')
+                if speed_test:
+                    logging.info(f"Running speed test: {speed_test}")
+                    probes.append(Probe('speed_test', run_speed_test, timeout=120, isolated=True))
+
+            report = self.probe_runner.run(probes)
+            results = report['results']
             metrics = {
-                'timestamp': datetime.now().isoformat(),
-                'device_info': self.device_info,
-                'connection_info': get_connection_info(),
-                'ip_addresses': get_ip_addresses(),
-                'dns_resolution_time': measure_dns_resolution(),
-                'ping_results': {}
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'probe_durations': report['durations']
             }
+            if 'connection' in groups:
+                metrics['connection_info'] = results['connection_info'] or {}
+                metrics['ip_addresses'] = results['ip_addresses'] or {}
+            if 'dns' in groups:
+                metrics['dns_resolution_time'] = (results['dns'] or {}).get('avg')
+                metrics['dns_stats'] = (results['dns'] or {}).get('resolvers', {})
+            if 'ping' in groups:
+                metrics['ping_results'] = {host: (results[f'ping:{host}'] or {}).get('avg') for host in PING_HOSTS}
+                metrics['ping_stats'] = {host: results[f'ping:{host}'] for host in PING_HOSTS}
+            if speed_test:
+                metrics['speed_test'] = results['speed_test'] or {'error': 'Speed test timed out'}
+                self.speed_test_policy.record(metrics['speed_test'])
 
-            # Collect ping metrics
-            for host in ['google.com', '8.8.8.8', '1.1.1.1']:
-                metrics['ping_results'][host] = ping_host(host)
-
-            # Run speed test every hour (controlled by parameter)
-            if datetime.now().minute < 5:  # Run in first 5 minutes of every hour
-                metrics['speed_test'] = run_speed_test()
+            # Traffic since the previous cycle; a window holding our own
+            # speed test says nothing about the capacity it measured
+            until = self.passive.clock()
+            metrics['traffic'] = self.passive.summary(since=self.traffic_since, until=until)
+            self.traffic_since = until
+            if not speed_test:
+                self.speed_test_policy.observe(metrics['traffic']['interfaces'].get(network_state.interface))
 
+            # A speed test group that skips its test runs no probes at all
+            slowest = max(report['durations'], key=report['durations'].get, default=None)
+            if slowest is not None:
+                logging.info(f"Collected {', '.join(groups)} in {report['total']}ms (slowest probe: {slowest})")
             return metrics
         except Exception as e:
             logging.error(f"Error collecting metrics: {str(e)}")
             return None
 
+    def link_degraded(self, metrics, sent):
+        """Whether the last cycle suggests a failing or overloaded link"""
+        if not sent:
+            return True
+        stats = [s for s in (metrics or {}).get('ping_stats', {}).values() if s]
+        if stats:
+            loss = sum(s['packet_loss'] for s in stats) / len(stats)
+            return loss > DEGRADED_PACKET_LOSS
+        return False
+
+    def update_backoff(self, degraded):
+        """Stretch collection intervals on battery power or a degraded link"""
+        self.degraded_cycles = self.degraded_cycles + 1 if degraded else 0
+        factor = min(2 ** self.degraded_cycles, MAX_BACKOFF)
+        battery = psutil.sensors_battery() if hasattr(psutil, 'sensors_battery') else None
+        if battery is not None and not battery.power_plugged:
+            factor = min(factor * 2, MAX_BACKOFF)
+        if factor != self.schedule.backoff:
+            logging.info(f"Collection backoff factor set to {factor}")
+        self.schedule.set_backoff(factor)
+
     def register_device(self):
         """Register device with the server"""
         try:
-            response = requests.post(
-                self.cloud_endpoint,
-                json={'location': 'Local'},
-                headers={'Content-Type': 'application/json'},
-                timeout=10
-            )
-            response.raise_for_status()
+            # Static device details are only sent once, at registration
+            response = self.transport.post('', {'location': 'Local', 'device_info': self.device_info})
             self.device_id = response.json()['id']
             logging.info(f"Device registered successfully with ID: {self.device_id}")
-            if hasattr(self, 'tray_icon'):
+            if self.tray_icon:
                 self.tray_icon.update_status('Active')
             return True
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
             logging.error(f"Error registering device: {str(e)}")
-            if hasattr(self, 'tray_icon'):
+            if self.tray_icon:
                 self.tray_icon.update_status('Error')
             return False
 
-    def send_to_cloud(self, metrics):
-        """Send metrics to cloud endpoint"""
+    def buffer_metrics(self, metrics):
+        """Spool a sample until the next upload"""
+        self.buffer.append(metrics)
+        SAMPLES_BUFFERED.inc()
+
+    def send_batch(self, samples):
+        """Send several samples to the batch endpoint in one request.
+
+        Returns the per-sample results reported by the server, or None if
+        the request failed.
+        """
         try:
-            headers = {
-                'Content-Type': 'application/json',
-                'User-Agent': f'NetworkAgent/{self.device_info["hostname"]}',
-                'Authorization': f'Bearer {API_KEY}'
-            }
-            response = requests.post(
-                f"{self.cloud_endpoint}/{self.device_id}/metrics",
-                json=metrics,
-                headers=headers,
-                timeout=10
+            response = self.transport.post(
+                "/metrics/batch",
+                {'samples': [dict(sample, device_id=self.device_id) for sample in samples]},
+                samples=len(samples),
+                timeout=30
             )
-            response.raise_for_status()
-            return True
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error sending data to cloud: {str(e)}")
-            return False
-
-    def buffer_metrics(self, metrics):
-        """Buffer metrics when cloud connection fails"""
-        if len(self.buffer) < self.max_buffer_size:
-            self.buffer.append(metrics)
-            logging.info(f"Metrics buffered. Buffer size: {len(self.buffer)}")
-        else:
-            logging.warning("Buffer full, dropping oldest metrics")
-            self.buffer.pop(0)
-            self.buffer.append(metrics)
+            results = response.json()['results']
+            UPLOADS.inc('batch', 'sent')
+            return results
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            logging.error(f"Error sending batch to cloud: {str(e)}")
+            UPLOADS.inc('batch', 'failed')
+            return None
 
     def send_buffered_metrics(self):
-        """Attempt to send buffered metrics"""
+        """Upload spooled samples in batches; False if an upload failed"""
         if not self.buffer:
-            return
+            return True
 
-        logging.info(f"Attempting to send {len(self.buffer)} buffered metrics")
-        successful_sends = []
+        logging.info(f"Sending {len(self.buffer)} buffered metrics")
 
-        for metrics in self.buffer:
-            if self.send_to_cloud(metrics):
-                successful_sends.append(metrics)
+        while self.buffer:
+            batch = self.buffer.peek(BATCH_SIZE)
+            results = self.send_batch([sample for _, sample in batch])
+            if results is None:
+                return False
 
-        # Remove successfully sent metrics from buffer
-        for metrics in successful_sends:
-            self.buffer.remove(metrics)
+            # Rejected samples would be rejected again, so they are acknowledged too
+            rejected = [r for r in results if r.get('status') != 'accepted']
+            for result in rejected:
+                logging.warning(f"Buffered sample rejected: {result.get('error')}")
+            self.buffer.ack(batch[-1][0])
+        return True
+
+    def write_status(self):
+        """Write counters and upload stats to AGENT_STATUS_FILE"""
+        try:
+            instrumentation.write_status(
+                AGENT_STATUS_FILE,
+                device_id=getattr(self, 'device_id', None),
+                hostname=self.device_info['hostname'],
+                transport=self.transport.stats()
+            )
+        except OSError as e:
+            logging.error(f"Error writing status file: {str(e)}")
 
     def stop(self):
         """Stop the network agent and cleanup"""
         self.running = False
+        self.stop_event.set()
+        self.probe_runner.shutdown()
+        self.passive.stop()
+        self.buffer.close()
+        self.transport.close()
         logging.info("Stopping Network Agent...")
 
     def run(self):
@@ -165,27 +325,64 @@ class NetworkAgent:
 
         while self.running:
             try:
-                # Collect metrics
-                metrics = self.collect_metrics()
-                if metrics:
-                    # Try to send any buffered metrics first
-                    self.send_buffered_metrics()
-
-                    # Try to send current metrics
-                    if not self.send_to_cloud(metrics):
+                groups = self.schedule.due()
+                if groups:
+                    metrics = self.collect_metrics(groups)
+                    for group in groups:
+                        self.schedule.mark_run(group)
+
+                    if metrics:
                         self.buffer_metrics(metrics)
 
-                # Wait for next collection interval
-                time.sleep(self.interval)
+                    # A failed upload is retried at the next cycle
+                    sent = True
+                    if time.monotonic() >= self.next_upload:
+                        sent = self.send_buffered_metrics()
+                        if sent:
+                            self.next_upload = time.monotonic() + UPLOAD_INTERVAL
+                        logging.info(f"Upload stats: {self.transport.stats()}")
+                    self.update_backoff(self.link_degraded(metrics, sent))
+                    CYCLES.inc()
+                    self.write_status()
+
+                # Sleep until the next probe is due
+                self.stop_event.wait(self.schedule.next_wakeup())
 
             except Exception as e:
                 logging.error(f"Error in main loop: {str(e)}")
-                time.sleep(60)  # Wait a minute before retrying
+                self.stop_event.wait(60)  # Wait a minute before retrying
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Network monitoring agent')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--headless', dest='headless', action='store_true',
+                      help='run without the tray icon, logging to stderr as well (default on Linux/macOS)')
+    mode.add_argument('--tray', dest='headless', action='store_false',
+                      help='show the system tray icon (default on Windows)')
+    parser.set_defaults(
+        headless=(os.getenv('AGENT_HEADLESS') or ('true' if sys.platform != 'win32' else 'false')).lower() == 'true'
+    )
+    args = parser.parse_args(argv)
+
+    configure_logging(args.headless)
+    if not args.headless and sys.platform == 'win32':
+        hide_console()
+
+    agent = NetworkAgent(headless=args.headless)
+
+    def request_stop(signum, frame):
+        agent.running = False
+        agent.stop_event.set()
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
 
-if __name__ == '__main__':
-    agent = NetworkAgent()
     try:
         agent.run()
     finally:
-        if hasattr(agent, 'tray_icon') and agent.tray_icon:
-            agent.tray_icon.stop_agent()
\ No newline at end of file
+        if agent.tray_icon:
+            agent.tray_icon.stop_agent()
+        else:
+            agent.stop()
+
+if __name__ == '__main__':
+    main()
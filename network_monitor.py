@@ -1,128 +1,155 @@
-import psutil
+import os
 import socket
 import subprocess
 import platform
 import time
 import json
+import re
+import threading
 from datetime import datetime
+import latency
+import netstate
+import dnsprobe
+import instrumentation
 
-try:
-    import wifi
-    WIFI_AVAILABLE = True
-except ImportError:
-    WIFI_AVAILABLE = False
+# Connection and IP details are only rediscovered when the network changes
+network_state = netstate.NetworkState()
 
+@instrumentation.probe('connection_info')
 def get_connection_info():
     """Get network connection type and details"""
-    info = {}
-    interfaces = psutil.net_if_stats()
-    
-    # Find active network interface
-    active_interface = None
-    for interface, stats in interfaces.items():
-        if stats.isup:
-            active_interface = interface
-            info['connection_type'] = 'Ethernet' if 'Ethernet' in interface else 'Wi-Fi'
-            break
-    
-    # Get Wi-Fi details if available
-    if WIFI_AVAILABLE and info.get('connection_type') == 'Wi-Fi':
-        try:
-            import subprocess
-            output = subprocess.check_output(['netsh', 'wlan', 'show', 'interfaces']).decode('utf-8')
-            for line in output.split('\n'):
-                if 'Signal' in line:
-                    signal = int(line.split(':')[1].strip().strip('%'))
-                    # Convert percentage to dBm (approximate conversion)
-                    dbm = -100 + (signal / 2)  # This gives a range from -100 dBm (0%) to -50 dBm (100%)
-                    info['signal_strength'] = f"{int(dbm)} dBm"
-                elif 'SSID' in line and not 'BSSID' in line:
-                    info['wifi_ssid'] = line.split(':')[1].strip()
-        except Exception as e:
-            info['wifi_error'] = str(e)
-    
-    return info
+    return network_state.connection_info()
 
+@instrumentation.probe('ip_addresses')
 def get_ip_addresses():
     """Get internal and external IP addresses"""
-    # Get internal IP
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try:
-        s.connect(('8.8.8.8', 80))
-        internal_ip = s.getsockname()[0]
-    except Exception:
-        internal_ip = 'N/A'
-    finally:
-        s.close()
-    
-    # Get external IP
-    try:
-        external_ip = socket.gethostbyname(socket.gethostname())
-    except Exception:
-        external_ip = 'N/A'
-    
-    return {
-        'internal_ip': internal_ip,
-        'external_ip': external_ip
-    }
+    return network_state.ip_addresses()
+
+@instrumentation.probe('dns', failed=lambda report: report['avg'] is None)
+def measure_dns():
+    """Query the configured resolvers directly; latency stats per resolver"""
+    return dnsprobe.probe_resolvers()
 
 def measure_dns_resolution():
     """Measure DNS resolution time"""
-    start_time = time.time()
-    try:
-        socket.gethostbyname('google.com')
-        resolution_time = (time.time() - start_time) * 1000  # Convert to milliseconds
-        return round(resolution_time, 2)
-    except Exception:
-        return None
+    return measure_dns()['avg']
 
-def ping_host(host):
-    """Ping a host and return the latency"""
+def parse_ping_output(output):
+    """Extract a latency in ms from system ping output in any locale.
+
+    Reply lines look like 'time=12.3 ms', 'Zeit=12ms' or 'time<1ms' and the
+    Windows summary ends with the localized average, e.g. 'Average = 12ms'.
+    The last such value is the average on Windows and the reply on Unix.
+    """
+    matches = re.findall(r'[=<]\s*(\d+(?:[.,]\d+)?)\s*ms', output)
+    if matches:
+        return float(matches[-1].replace(',', '.'))
+    return None
+
+def system_ping(host, timeout=5):
+    """Ping a host with the system ping binary and return the latency"""
     param = '-n' if platform.system().lower() == 'windows' else '-c'
     command = ['ping', param, '1', host]
     try:
-        output = subprocess.check_output(command).decode().strip()
-        if platform.system().lower() == 'windows':
-            if 'Average' in output:
-                return float(output.split('Average = ')[-1].split('ms')[0])
-        else:
-            if 'time=' in output:
-                return float(output.split('time=')[-1].split(' ms')[0])
-    except:
-        pass
-    return None
+        output = subprocess.check_output(command, timeout=timeout).decode(errors='replace').strip()
+        return parse_ping_output(output)
+    except Exception:
+        return None
+
+def ping_host(host, timeout=5, count=3):
+    """Ping a host and return the average latency"""
+    stats = latency.measure_latency(host, count=count, timeout=min(timeout, 2))
+    if stats['avg'] is None and stats['method'] == 'tcp':
+        # Hosts that drop TCP on the probe port may still answer ICMP
+        return system_ping(host, timeout)
+    return stats['avg']
+
+# How long the speedtest.net server list and best server choice are reused
+SPEEDTEST_SERVER_TTL = int(os.getenv('SPEEDTEST_SERVER_TTL', '3600'))
+
+class SpeedtestBackend:
+    """speedtest.net backend that reuses its server selection for a TTL"""
+
+    def __init__(self, server_ttl=SPEEDTEST_SERVER_TTL):
+        self.server_ttl = server_ttl
+        self.best_server = None
+        self.selected_at = 0
+        self.lock = threading.Lock()
+
+    def run(self):
+        """Run internet speed test using speedtest-cli module"""
+        try:
+            import speedtest
+        except ImportError:
+            return {'error': 'speedtest-cli is not installed'}
+
+        try:
+            s = speedtest.Speedtest(secure=True)
+
+            # Set acceptable distance (km) for servers
+            s.config['distance_threshold'] = 500
+
+            # Server list and latency ranking are only refreshed once per TTL
+            with self.lock:
+                if self.best_server is None or time.monotonic() - self.selected_at > self.server_ttl:
+                    s.get_servers()
+                    self.best_server = s.get_best_server()
+                    self.selected_at = time.monotonic()
+                s._best = self.best_server
+                s.results.server = self.best_server
 
+            # Get download speed with a timeout
+            download_speed = s.download(threads=None) / 1_000_000  # Convert to Mbps
+
+            # Get upload speed with a timeout
+            upload_speed = s.upload(threads=None) / 1_000_000  # Convert to Mbps
+
+            return {
+                'download': round(download_speed, 2),
+                'upload': round(upload_speed, 2)
+            }
+        except speedtest.ConfigRetrievalError as e:
+            return {'error': f'Failed to retrieve speedtest configuration: {str(e)}'}
+        except speedtest.NoMatchedServers as e:
+            return {'error': f'No matched servers: {str(e)}'}
+        except speedtest.SpeedtestBestServerFailure as e:
+            return {'error': f'Failed to find best server: {str(e)}'}
+        except Exception as e:
+            # A failing server should not be reused for the rest of the TTL
+            self.best_server = None
+            return {'error': str(e)}
+
+class FakeSpeedtestBackend:
+    """Deterministic stand-in for speedtest.net, for tests and development"""
+
+    def __init__(self, download=100.0, upload=20.0, duration=0.0, error=None):
+        self.download = download
+        self.upload = upload
+        self.duration = duration
+        self.error = error
+        self.runs = 0
+
+    def run(self):
+        self.runs += 1
+        if self.duration:
+            time.sleep(self.duration)
+        if self.error:
+            return {'error': self.error}
+        return {'download': self.download, 'upload': self.upload}
+
+def create_speedtest_backend(name=None):
+    """Build the backend named by SPEEDTEST_BACKEND ('speedtest' or 'fake')"""
+    name = name or os.getenv('SPEEDTEST_BACKEND', 'speedtest')
+    if name == 'fake':
+        return FakeSpeedtestBackend(duration=float(os.getenv('FAKE_SPEEDTEST_DURATION', '0')))
+    return SpeedtestBackend()
+
+speedtest_backend = create_speedtest_backend()
+
+@instrumentation.probe('speed_test', failed=lambda result: 'error' in result)
 def run_speed_test():
-    """Run internet speed test using speedtest-cli module"""
-    try:
-        import speedtest
-        s = speedtest.Speedtest(secure=True)
-        
-        # Configure test
-        s.get_servers()  # Get server list first
-        s.get_best_server()  # Then get best server
-        
-        # Set acceptable distance (km) for servers
-        s.config['distance_threshold'] = 500
-        
-        # Get download speed with a timeout
-        download_speed = s.download(threads=None) / 1_000_000  # Convert to Mbps
-        
-        # Get upload speed with a timeout
-        upload_speed = s.upload(threads=None) / 1_000_000  # Convert to Mbps
-        
-        return {
-            'download': round(download_speed, 2),
-            'upload': round(upload_speed, 2)
-        }
-    except speedtest.ConfigRetrievalError as e:
-        return {'error': f'Failed to retrieve speedtest configuration: {str(e)}'}
-    except speedtest.NoMatchedServers as e:
-        return {'error': f'No matched servers: {str(e)}'}
-    except speedtest.SpeedtestBestServerFailure as e:
-        return {'error': f'Failed to find best server: {str(e)}'}
-    except Exception as e:
-        return {'error': str(e)}
+    """Run internet speed test with the configured backend"""
+    return speedtest_backend.run()
 
 def get_device_info():
     """Get device hostname and user information"""
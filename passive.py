@@ -0,0 +1,219 @@
+"""Passive bandwidth sampling from interface byte counters.
+
+PassiveSampler reads psutil.net_io_counters(pernic=True) every second on
+a background thread and keeps the receive and transmit rate of every
+interface in a fixed-size ring buffer, so an hour of history costs a few
+hundred kilobytes and each sample under a millisecond. summary() reduces
+a window to average, 95th percentile and peak rates per interface.
+
+SpeedTestPolicy decides from those summaries whether an active speed test
+would tell us anything new. Traffic that reaches most of the last
+measured capacity confirms it without pushing a test's worth of data
+through the link; a test runs only without a baseline, when traffic
+exceeds the baseline, or when nothing has confirmed it for max_age.
+"""
+import os
+import math
+import time
+import threading
+from array import array
+import psutil
+
+# Seconds between counter samples and number of samples kept per interface
+PASSIVE_SAMPLE_INTERVAL = float(os.getenv('PASSIVE_SAMPLE_INTERVAL', '1'))
+PASSIVE_BUFFER_SIZE = int(os.getenv('PASSIVE_BUFFER_SIZE', '3600'))
+
+# Fraction of the last measured download/upload speed that observed traffic
+# must reach to confirm it, and the factor above which it is outdated
+PASSIVE_CONFIRM_FRACTION = float(os.getenv('PASSIVE_CONFIRM_FRACTION', '0.8'))
+PASSIVE_EXCEED_FACTOR = 1.2
+
+# Seconds an unconfirmed speed test result is trusted before testing again
+SPEEDTEST_MAX_AGE = int(os.getenv('SPEEDTEST_MAX_AGE', str(12 * 3600)))
+
+
+def is_loopback_name(name):
+    lower = name.lower()
+    return lower == 'lo' or lower.startswith('lo0') or lower.startswith('loopback')
+
+
+def _percentile(ordered, quantile):
+    """Nearest-rank percentile of sorted values"""
+    return ordered[max(math.ceil(quantile * len(ordered)) - 1, 0)]
+
+
+def _rate_summary(values):
+    """avg, p95 and peak in Mbps of bits-per-second samples"""
+    ordered = sorted(values)
+    return {
+        'avg': round(sum(ordered) / len(ordered) / 1e6, 3),
+        'p95': round(_percentile(ordered, 0.95) / 1e6, 3),
+        'peak': round(ordered[-1] / 1e6, 3)
+    }
+
+
+class PassiveSampler:
+    """Ring buffer of per-interface receive/transmit rates in bits per second"""
+
+    def __init__(self, interval=PASSIVE_SAMPLE_INTERVAL, capacity=PASSIVE_BUFFER_SIZE,
+                 counters=None, clock=time.monotonic):
+        self.interval = interval
+        self.capacity = capacity
+        self.counters = counters or (lambda: psutil.net_io_counters(pernic=True))
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        # Sample times shared by every interface; rates[name] = (rx, tx)
+        self.times = array('d', [0.0] * capacity)
+        self.rates = {}
+        self.next_index = 0
+        self.count = 0
+        self.previous = None
+
+    def sample(self):
+        """Read the counters once and append the rates since the last read"""
+        now = self.clock()
+        counters = self.counters()
+        with self.lock:
+            previous, self.previous = self.previous, (now, counters)
+            if previous is None:
+                return
+            elapsed = now - previous[0]
+            if elapsed <= 0:
+                return
+            index = self.next_index
+            self.times[index] = now
+            for name, current in counters.items():
+                if name not in self.rates:
+                    self.rates[name] = (array('d', [0.0] * self.capacity), array('d', [0.0] * self.capacity))
+                rx, tx = self.rates[name]
+                before = previous[1].get(name)
+                if before is None:
+                    rx[index] = tx[index] = 0.0
+                    continue
+                # A counter that went backwards belongs to a reset interface
+                rx[index] = max(current.bytes_recv - before.bytes_recv, 0) * 8 / elapsed
+                tx[index] = max(current.bytes_sent - before.bytes_sent, 0) * 8 / elapsed
+            for name, (rx, tx) in self.rates.items():
+                if name not in counters:
+                    rx[index] = tx[index] = 0.0
+            self.next_index = (index + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def _indices(self, since, until):
+        """Ring positions of samples in (since, until], oldest first"""
+        indices = []
+        for offset in range(1, self.count + 1):
+            index = (self.next_index - offset) % self.capacity
+            if since is not None and self.times[index] <= since:
+                break
+            if until is None or self.times[index] <= until:
+                indices.append(index)
+        indices.reverse()
+        return indices
+
+    def summary(self, since=None, until=None, interfaces=None):
+        """Rate statistics per interface over samples taken in (since, until].
+
+        interfaces defaults to every interface other than loopback that
+        carried traffic in the window. Link speed comes from the OS and is
+        None where it is unknown.
+        """
+        with self.lock:
+            indices = self._indices(since, until)
+            if not indices:
+                return {'samples': 0, 'window': 0.0, 'interfaces': {}}
+            window = self.times[indices[-1]] - self.times[indices[0]] + self.interval
+            selected = {}
+            for name, (rx, tx) in self.rates.items():
+                if interfaces is not None and name not in interfaces:
+                    continue
+                rx_values = [rx[i] for i in indices]
+                tx_values = [tx[i] for i in indices]
+                if interfaces is None and (is_loopback_name(name) or not any(rx_values) and not any(tx_values)):
+                    continue
+                selected[name] = (rx_values, tx_values)
+
+        stats = psutil.net_if_stats()
+        summary = {}
+        for name, (rx_values, tx_values) in selected.items():
+            speed = stats[name].speed if name in stats else 0
+            summary[name] = {
+                'rx_mbps': _rate_summary(rx_values),
+                'tx_mbps': _rate_summary(tx_values),
+                'link_mbps': speed or None
+            }
+        return {'samples': len(indices), 'window': round(window, 1), 'interfaces': summary}
+
+    def run(self):
+        next_sample = self.clock()
+        while not self.stop_event.is_set():
+            try:
+                self.sample()
+            except Exception:
+                # Counters can be briefly unreadable while interfaces change
+                pass
+            # After a suspend, resume the schedule instead of catching up
+            next_sample = max(next_sample + self.interval, self.clock())
+            self.stop_event.wait(max(0.0, next_sample - self.clock()))
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='passive-sampler', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+
+class SpeedTestPolicy:
+    """Whether passive traffic data makes an active speed test unnecessary.
+
+    Feed it the summary of the active interface for every window that did
+    not include a speed test; a test's own traffic says nothing new.
+    """
+
+    def __init__(self, max_age=SPEEDTEST_MAX_AGE, confirm_fraction=PASSIVE_CONFIRM_FRACTION,
+                 exceed_factor=PASSIVE_EXCEED_FACTOR, clock=time.monotonic):
+        self.max_age = max_age
+        self.confirm_fraction = confirm_fraction
+        self.exceed_factor = exceed_factor
+        self.clock = clock
+        self.baseline = None
+        self.confirmed_at = None
+        self.exceeded = False
+
+    def record(self, result):
+        """Take a successful speed test result as the new baseline"""
+        if result and 'error' not in result:
+            self.baseline = {'download': result['download'], 'upload': result['upload']}
+            self.confirmed_at = self.clock()
+            self.exceeded = False
+
+    def observe(self, interface_summary):
+        """Compare one window's traffic on the active interface with the baseline"""
+        if self.baseline is None or not interface_summary:
+            return
+        rx, tx = interface_summary['rx_mbps'], interface_summary['tx_mbps']
+        # Sustained rather than one-second peaks, so bursts into buffers do not count
+        if rx['p95'] > self.exceed_factor * self.baseline['download'] or \
+                tx['p95'] > self.exceed_factor * self.baseline['upload']:
+            self.exceeded = True
+        elif rx['peak'] >= self.confirm_fraction * self.baseline['download'] or \
+                tx['peak'] >= self.confirm_fraction * self.baseline['upload']:
+            self.confirmed_at = self.clock()
+
+    def reason_to_test(self):
+        """Why an active test should run now, or None if passive data suffices"""
+        if self.baseline is None:
+            return 'no baseline'
+        if self.exceeded:
+            return 'traffic exceeded baseline'
+        if self.clock() - self.confirmed_at >= self.max_age:
+            return 'baseline expired'
+        return None
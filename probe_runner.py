@@ -0,0 +1,105 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+class Probe:
+    """A single named measurement with its own deadline.
+
+    Isolated probes, such as a long speed test, run on a thread of their
+    own instead of taking a slot in the shared pool.
+    """
+
+    def __init__(self, name, func, args=(), timeout=10, isolated=False):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.timeout = timeout
+        self.isolated = isolated
+
+
+def _timed_call(func, args):
+    """Run a probe and return its result with the time it took in ms"""
+    start = time.monotonic()
+    try:
+        return func(*args), (time.monotonic() - start) * 1000, None
+    except Exception as e:
+        return None, (time.monotonic() - start) * 1000, e
+
+
+class ProbeRunner:
+    """Execute independent probes concurrently on a shared thread pool.
+
+    Every probe gets its own deadline measured from the moment the batch
+    was submitted, so one cycle takes as long as its slowest probe instead
+    of the sum of all of them. Probes that miss their deadline are reported
+    as timed out and their result is None; the rest are returned as usual.
+
+    A thread cannot be stopped, so a probe that misses its deadline may keep
+    running. Until it returns, later runs of the same probe are skipped
+    rather than queued behind it, and the pool it holds a thread of is
+    replaced so hung probes cannot starve later cycles.
+    """
+
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self.executor = self._new_executor()
+        self.stragglers = {}
+
+    def _new_executor(self, max_workers=None, name='probe'):
+        return ThreadPoolExecutor(max_workers=max_workers or self.max_workers, thread_name_prefix=name)
+
+    def _submit(self, probe):
+        # Isolated probes get a single-use thread that exits once they return
+        executor = self._new_executor(1, f'probe-{probe.name}') if probe.isolated else self.executor
+        future = executor.submit(_timed_call, probe.func, probe.args)
+        if probe.isolated:
+            executor.shutdown(wait=False)
+        return future
+
+    def run(self, probes):
+        """Run probes and return their results, durations and failures"""
+        start = time.monotonic()
+        self.stragglers = {name: future for name, future in self.stragglers.items() if not future.done()}
+        report = {'results': {}, 'durations': {}, 'timed_out': [], 'failed': [], 'skipped': []}
+        futures = []
+        for probe in probes:
+            if probe.name in self.stragglers:
+                logging.warning(f"Probe {probe.name} skipped; its last run has not returned yet")
+                report['results'][probe.name] = None
+                report['durations'][probe.name] = 0.0
+                report['skipped'].append(probe.name)
+            else:
+                futures.append((probe, self._submit(probe)))
+
+        for probe, future in futures:
+            remaining = max(0, start + probe.timeout - time.monotonic())
+            try:
+                value, duration, error = future.result(timeout=remaining)
+            except TimeoutError:
+                logging.warning(f"Probe {probe.name} timed out after {probe.timeout}s")
+                report['results'][probe.name] = None
+                report['durations'][probe.name] = round(probe.timeout * 1000, 2)
+                report['timed_out'].append(probe.name)
+                # A probe still queued never starts; one already running keeps its thread
+                if not future.cancel():
+                    self.stragglers[probe.name] = future
+                continue
+
+            if error is not None:
+                logging.error(f"Probe {probe.name} failed: {str(error)}")
+                report['failed'].append(probe.name)
+            report['results'][probe.name] = value
+            report['durations'][probe.name] = round(duration, 2)
+
+        # Later cycles get a fresh pool; the old one's threads exit as their probes return
+        if any(not probe.isolated for probe, future in futures if probe.name in self.stragglers):
+            self.executor.shutdown(wait=False)
+            self.executor = self._new_executor()
+
+        report['total'] = round((time.monotonic() - start) * 1000, 2)
+        return report
+
+    def shutdown(self):
+        """Stop accepting probes without waiting for stragglers"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
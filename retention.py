@@ -0,0 +1,129 @@
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import text
+import storage
+from models import db, MetricsRollup, SampleDetail
+from rollups import RESOLUTIONS
+
+
+def _days(name, default):
+    value = os.getenv(name, default).strip()
+    return int(value) if value and int(value) > 0 else None
+
+# Days each resolution is kept for; None keeps it forever
+RETENTION_DAYS = {
+    'raw': _days('RETENTION_RAW_DAYS', '7'),
+    '1m': _days('RETENTION_1M_DAYS', '7'),
+    '1h': _days('RETENTION_1H_DAYS', '90'),
+    '1d': _days('RETENTION_1D_DAYS', '0'),
+    'details': _days('RETENTION_DETAIL_DAYS', '7')
+}
+
+# Free pages returned to the filesystem per incremental vacuum step
+VACUUM_STEP_PAGES = 1000
+
+last_report = None
+
+
+def cutoff(resolution, now=None):
+    """Oldest timestamp still retained at a resolution, or None if kept forever"""
+    days = RETENTION_DAYS.get(resolution)
+    if days is None:
+        return None
+    return (now or datetime.utcnow()) - timedelta(days=days)
+
+
+def retained_since(now=None):
+    """Cutoff of every resolution, for query planning"""
+    return {resolution: cutoff(resolution, now) for resolution in ['raw', *RESOLUTIONS]}
+
+
+def _sqlite_pages():
+    page_count = db.session.execute(text('PRAGMA page_count')).scalar()
+    page_size = db.session.execute(text('PRAGMA page_size')).scalar()
+    return page_count, page_size
+
+
+def _incremental_vacuum():
+    """Return free pages to the filesystem a few at a time"""
+    if db.session.execute(text('PRAGMA auto_vacuum')).scalar() != 2:
+        return False
+    db.session.commit()
+    # executescript() runs the pragma to completion; execute() would only
+    # step it once and free a single page
+    connection = db.session.connection().connection
+    free_pages = db.session.execute(text('PRAGMA freelist_count')).scalar()
+    while free_pages:
+        connection.executescript(f'PRAGMA incremental_vacuum({VACUUM_STEP_PAGES});')
+        remaining = db.session.execute(text('PRAGMA freelist_count')).scalar()
+        if remaining >= free_pages:
+            break
+        free_pages = remaining
+        time.sleep(storage.SqlMetricsStore.batch_pause)
+    db.session.commit()
+    return True
+
+
+def compact(now=None, store=None):
+    """Delete data past its retention and reclaim the space it used.
+
+    Raw samples are purged from store, the SQL store by default. Returns a
+    report with rows purged per resolution, bytes reclaimed and the time
+    spent.
+    """
+    global last_report
+    start = time.monotonic()
+    sqlite = db.engine.dialect.name == 'sqlite'
+    if sqlite:
+        pages_before, page_size = _sqlite_pages()
+
+    # Rollups are always in the database, purged in the SQL store's batches
+    sql_store = storage.SqlMetricsStore(db.session)
+    purged = {}
+    raw_cutoff = cutoff('raw', now)
+    if raw_cutoff is not None:
+        purged['raw'] = (store or sql_store).purge_before(raw_cutoff)
+    for resolution in RESOLUTIONS:
+        resolution_cutoff = cutoff(resolution, now)
+        if resolution_cutoff is not None:
+            purged[resolution] = sql_store.purge_where(
+                MetricsRollup.__tablename__,
+                'resolution = :resolution AND bucket_start < :cutoff',
+                {'resolution': resolution, 'cutoff': resolution_cutoff}
+            )
+
+    details_cutoff = cutoff('details', now)
+    if details_cutoff is not None:
+        purged['details'] = sql_store.purge_where(
+            SampleDetail.__tablename__, 'timestamp < :cutoff', {'cutoff': details_cutoff}
+        )
+
+    report = {'rows_purged': purged, 'bytes_reclaimed': None, 'incremental_vacuum': False}
+    if sqlite:
+        report['incremental_vacuum'] = _incremental_vacuum()
+        pages_after, _ = _sqlite_pages()
+        report['bytes_reclaimed'] = (pages_before - pages_after) * page_size
+    report['seconds'] = round(time.monotonic() - start, 3)
+    report['finished_at'] = datetime.utcnow().isoformat()
+
+    logging.info(f"Compaction finished: {report}")
+    last_report = report
+    return report
+
+
+def enable_incremental_vacuum():
+    """One-off conversion of an existing SQLite file; rewrites the whole database"""
+    with db.engine.connect() as conn:
+        conn.execute(text('PRAGMA auto_vacuum=INCREMENTAL'))
+        conn.execute(text('VACUUM'))
+
+
+if __name__ == '__main__':
+    import sys
+    from app import app, metrics_store
+    with app.app_context():
+        if '--enable-incremental-vacuum' in sys.argv:
+            enable_incremental_vacuum()
+        print(compact(store=metrics_store))
@@ -0,0 +1,210 @@
+import json
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+import storage
+from models import db, MetricsRollup
+
+# Bucket width in seconds of each rollup resolution, finest first
+RESOLUTIONS = {
+    '1m': 60,
+    '1h': 3600,
+    '1d': 86400
+}
+
+# Raw sample columns that are aggregated
+ROLLUP_FIELDS = ('latency', 'dns_resolution_time', 'download_speed', 'upload_speed')
+
+# Relative width of a histogram bin; p95 is accurate to about this much
+HISTOGRAM_GROWTH = 1.05
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def bucket_start(timestamp, resolution):
+    """Start of the bucket that contains timestamp"""
+    width = RESOLUTIONS[resolution]
+    seconds = int((timestamp - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=seconds - seconds % width)
+
+
+def histogram_bin(value):
+    """Log-scale histogram bin of a value; bin 0 holds everything up to 1"""
+    if value <= 1:
+        return 0
+    return int(math.log(value, HISTOGRAM_GROWTH)) + 1
+
+
+def histogram_quantile(histogram, count, quantile, high):
+    """Approximate a quantile from a histogram, clamped to the observed max"""
+    rank = quantile * count
+    seen = 0
+    for key in sorted(histogram, key=int):
+        seen += histogram[key]
+        if seen >= rank:
+            upper = HISTOGRAM_GROWTH ** int(key) if int(key) else 1
+            return round(min(upper, high), 3)
+    return high
+
+
+class Aggregate:
+    """Running count/min/max/sum and histogram for one bucket of one metric"""
+
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.sum = 0.0
+        self.histogram = defaultdict(int)
+
+    def add(self, value):
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.sum += value
+        self.histogram[str(histogram_bin(value))] += 1
+
+    def merge_into(self, rollup):
+        """Fold this aggregate into a stored MetricsRollup row"""
+        histogram = json.loads(rollup.histogram) if rollup.histogram else {}
+        for key, count in self.histogram.items():
+            histogram[key] = histogram.get(key, 0) + count
+        rollup.count = (rollup.count or 0) + self.count
+        rollup.min = self.min if rollup.min is None else min(rollup.min, self.min)
+        rollup.max = self.max if rollup.max is None else max(rollup.max, self.max)
+        rollup.sum = (rollup.sum or 0) + self.sum
+        rollup.p95 = histogram_quantile(histogram, rollup.count, 0.95, rollup.max)
+        rollup.histogram = json.dumps(histogram, separators=(',', ':'))
+
+
+def update_rollups(rows):
+    """Fold newly ingested raw rows into every rollup resolution.
+
+    Rows are dicts with device_id, timestamp and the ROLLUP_FIELDS. All
+    touched buckets are loaded with one locking query and updated in the
+    current session; the caller commits together with the raw insert.
+    """
+    pending = defaultdict(Aggregate)
+    for row in rows:
+        for resolution in RESOLUTIONS:
+            start = bucket_start(row['timestamp'], resolution)
+            for field in ROLLUP_FIELDS:
+                value = row.get(field)
+                if value is not None:
+                    pending[(row['device_id'], resolution, field, start)].add(value)
+    if not pending:
+        return
+
+    # Create missing buckets first so concurrent writers never race on the
+    # unique constraint; existing buckets are left alone. Buckets are
+    # written in key order so two writers cannot deadlock on each other.
+    keys = sorted(pending)
+    db.session.execute(_insert_ignore(MetricsRollup.__table__), [{
+        'device_id': device_id,
+        'resolution': resolution,
+        'metric': metric,
+        'bucket_start': start,
+        'count': 0
+    } for device_id, resolution, metric, start in keys])
+
+    # The histogram is merged in Python, so the rows stay locked until the
+    # caller commits; a concurrent ingest for the same bucket waits instead
+    # of overwriting this one's counts. SQLite already serializes writers.
+    rollups = MetricsRollup.query.filter(
+        MetricsRollup.resolution.in_({key[1] for key in keys}),
+        MetricsRollup.device_id.in_({key[0] for key in keys}),
+        MetricsRollup.bucket_start.in_({key[3] for key in keys})
+    ).order_by(
+        MetricsRollup.device_id, MetricsRollup.resolution, MetricsRollup.metric, MetricsRollup.bucket_start
+    ).with_for_update()
+    for rollup in rollups:
+        aggregate = pending.get((rollup.device_id, rollup.resolution, rollup.metric, rollup.bucket_start))
+        if aggregate is not None:
+            aggregate.merge_into(rollup)
+
+
+def _insert_ignore(table):
+    """INSERT that skips rows violating a unique constraint"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert(table).on_conflict_do_nothing()
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing()
+    return table.insert().prefix_with('IGNORE')
+
+
+def choose_resolution(device_id, since, until, max_points, retained=None, store=None):
+    """Most detailed resolution whose point count fits within max_points.
+
+    retained maps a resolution to the oldest timestamp it still holds;
+    resolutions that no longer cover since are skipped. Raw samples are
+    counted in store, the SQL store by default.
+    """
+    retained = retained or {}
+    store = store or storage.SqlMetricsStore(db.session)
+
+    def covers(resolution):
+        oldest = retained.get(resolution)
+        return oldest is None or since >= oldest
+
+    if covers('raw'):
+        raw_count = store.count(device_id, since, until)
+        if raw_count <= max_points:
+            return 'raw'
+
+    span = (until - since).total_seconds()
+    for resolution, width in RESOLUTIONS.items():
+        if covers(resolution) and math.ceil(span / width) <= max_points:
+            return resolution
+    return list(RESOLUTIONS)[-1]
+
+
+def query_rollups(device_id, resolution, since, until, fields=ROLLUP_FIELDS):
+    """Rollup points in time order, one dict per bucket.
+
+    Each field is reported as its bucket average, with the min, max, p95
+    and sample count alongside as <field>_min, <field>_max and so on.
+    """
+    rollups = MetricsRollup.query.filter(
+        MetricsRollup.device_id == device_id,
+        MetricsRollup.resolution == resolution,
+        MetricsRollup.metric.in_(fields),
+        MetricsRollup.bucket_start >= bucket_start(since, resolution),
+        MetricsRollup.bucket_start < until
+    ).order_by(MetricsRollup.bucket_start).all()
+
+    points = {}
+    for r in rollups:
+        point = points.setdefault(r.bucket_start, {field: None for field in fields})
+        point[r.metric] = round(r.sum / r.count, 3) if r.count else None
+        point[f'{r.metric}_min'] = r.min
+        point[f'{r.metric}_max'] = r.max
+        point[f'{r.metric}_p95'] = r.p95
+        point[f'{r.metric}_count'] = r.count
+    return [(start, point) for start, point in points.items()]
+
+
+def rebuild(device_id=None, chunk_size=10000, store=None):
+    """Recompute rollups from raw rows, e.g. for databases that predate them"""
+    store = store or storage.SqlMetricsStore(db.session)
+    query = MetricsRollup.query
+    if device_id is not None:
+        query = query.filter(MetricsRollup.device_id == device_id)
+    query.delete(synchronize_session=False)
+    db.session.commit()
+
+    device_ids = [device_id] if device_id is not None else None
+    for chunk in store.scan(device_ids=device_ids, fields=ROLLUP_FIELDS, chunk_size=chunk_size):
+        update_rollups([{
+            'device_id': row[0],
+            'timestamp': row[1],
+            **dict(zip(ROLLUP_FIELDS, row[2:]))
+        } for row in chunk])
+        db.session.commit()
+
+if __name__ == '__main__':
+    from app import app, metrics_store
+    with app.app_context():
+        rebuild(store=metrics_store)
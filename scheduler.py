@@ -0,0 +1,154 @@
+import heapq
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """A periodic task owned by the scheduler"""
+
+    def __init__(self, key, func, interval, jitter):
+        self.key = key
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.next_base = None
+        self.running = False
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_duration = None
+
+
+class Scheduler:
+    """Single timer thread plus a bounded worker pool for periodic jobs.
+
+    Jobs are kept in a heap ordered by due time and identified by a key, so
+    registering the same key twice does not create a second job. Each run is
+    dispatched to the worker pool; if the previous run of a job is still in
+    progress when it comes due again, the new run is skipped rather than
+    piling up. Due times advance from the ideal schedule, not from when a run
+    finished, and every run is delayed by a random fraction of the interval
+    to spread load.
+    """
+
+    def __init__(self, max_workers=4, jitter=0.1):
+        self.jitter = jitter
+        self.jobs = {}
+        self.heap = []
+        self.counter = 0
+        self.pending = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scheduler')
+        self.thread = None
+        self.running = False
+
+    def add_job(self, key, func, interval, jitter=None, delay=0):
+        """Register a periodic job; returns False if key is already scheduled"""
+        with self.condition:
+            if key in self.jobs:
+                return False
+            job = Job(key, func, interval, self.jitter if jitter is None else jitter)
+            job.next_base = time.monotonic() + delay
+            self.jobs[key] = job
+            self._push(job)
+            self.condition.notify()
+            return True
+
+    def remove_job(self, key):
+        """Stop scheduling a job; a run already in progress is not interrupted"""
+        with self.condition:
+            return self.jobs.pop(key, None) is not None
+
+    def _push(self, job):
+        due = job.next_base + random.uniform(0, job.jitter * job.interval)
+        self.counter += 1
+        heapq.heappush(self.heap, (due, self.counter, job))
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self, wait=True):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread:
+            self.thread.join()
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _loop(self):
+        while True:
+            with self.condition:
+                while self.running:
+                    now = time.monotonic()
+                    if self.heap and self.heap[0][0] <= now:
+                        break
+                    self.condition.wait(self.heap[0][0] - now if self.heap else None)
+                if not self.running:
+                    return
+
+                due, _, job = heapq.heappop(self.heap)
+                if self.jobs.get(job.key) is not job:
+                    continue
+
+                self.lag = time.monotonic() - due
+                self.max_lag = max(self.max_lag, self.lag)
+                job.next_base += job.interval
+                # After a long stall, skip missed runs instead of bursting
+                if job.next_base < time.monotonic():
+                    job.next_base = time.monotonic()
+                self._push(job)
+
+                if job.running:
+                    job.skipped += 1
+                    logging.warning(f"Job {job.key} still running, skipping this run")
+                    continue
+                job.running = True
+                self.pending += 1
+            self.executor.submit(self._run, job)
+
+    def _run(self, job):
+        with self.condition:
+            self.pending -= 1
+        start = time.monotonic()
+        try:
+            job.func()
+        except Exception as e:
+            job.failures += 1
+            logging.error(f"Job {job.key} failed: {str(e)}")
+        finally:
+            with self.condition:
+                job.running = False
+                job.runs += 1
+                job.last_duration = round(time.monotonic() - start, 3)
+
+    def stats(self):
+        """Queue depth, lag and per-job counters"""
+        with self.condition:
+            now = time.monotonic()
+            return {
+                'jobs': len(self.jobs),
+                'queue_depth': self.pending + sum(1 for due, _, job in self.heap if due <= now and self.jobs.get(job.key) is job),
+                'running': sum(1 for job in self.jobs.values() if job.running),
+                'lag': round(self.lag, 3),
+                'max_lag': round(self.max_lag, 3),
+                'job_stats': {
+                    key: {
+                        'interval': job.interval,
+                        'runs': job.runs,
+                        'skipped': job.skipped,
+                        'failures': job.failures,
+                        'last_duration': job.last_duration
+                    }
+                    for key, job in self.jobs.items()
+                }
+            }
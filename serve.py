@@ -0,0 +1,78 @@
+"""Production entry point for the API.
+
+Runs app.py under gunicorn (Linux/macOS) or waitress (Windows, or when
+gunicorn is not installed) instead of the Werkzeug development server.
+Background jobs are not started here; run worker.py as a separate, single
+process for those. Events, cache invalidations and samples for alert
+evaluation are shared with the other workers and worker.py through the
+database. Configured from the environment:
+
+    DATABASE_URL       SQLAlchemy URL (default sqlite:///network_monitor.db)
+    HOST, PORT         listen address (default 0.0.0.0:5000)
+    WEB_CONCURRENCY    worker processes (default 2)
+    WEB_THREADS        threads per worker; every open event stream holds one
+    SERVER             force 'gunicorn' or 'waitress'
+"""
+import os
+import sys
+import logging
+
+try:
+    import gunicorn.app.base
+    GUNICORN_AVAILABLE = True
+except ImportError:
+    GUNICORN_AVAILABLE = False
+
+HOST = os.getenv('HOST', '0.0.0.0')
+PORT = int(os.getenv('PORT', '5000'))
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '2'))
+WEB_THREADS = int(os.getenv('WEB_THREADS', '8'))
+
+
+def post_fork(server, worker):
+    """Give each forked worker its own database connections"""
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def run_gunicorn():
+    class Server(gunicorn.app.base.BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{HOST}:{PORT}')
+            self.cfg.set('workers', WEB_CONCURRENCY)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', WEB_THREADS)
+            # Import (and migrate) once in the master, then fork
+            self.cfg.set('preload_app', True)
+            self.cfg.set('post_fork', post_fork)
+            self.cfg.set('accesslog', os.getenv('ACCESS_LOG'))
+
+        def load(self):
+            from app import app, use_event_relay
+            use_event_relay()
+            return app
+
+    Server().run()
+
+
+def run_waitress():
+    # waitress serves from a single process; scale with threads instead
+    import waitress
+    from app import app, use_event_relay
+    use_event_relay()
+    waitress.serve(app, host=HOST, port=PORT, threads=WEB_CONCURRENCY * WEB_THREADS)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = os.getenv('SERVER') or ('gunicorn' if GUNICORN_AVAILABLE and sys.platform != 'win32' else 'waitress')
+    logging.info(f"Serving on {HOST}:{PORT} with {server}")
+    if server == 'gunicorn':
+        run_gunicorn()
+    else:
+        run_waitress()
+
+
+if __name__ == '__main__':
+    main()
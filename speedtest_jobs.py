@@ -0,0 +1,210 @@
+import json
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from models import db, SpeedTest
+
+# Job states that hold a device's single active slot
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class SpeedTestRejected(Exception):
+    """Raised when a speed test cannot be queued right now"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def job_dict(job):
+    """API representation of a SpeedTest row"""
+    return {
+        'id': job.id,
+        'device_id': job.device_id,
+        'status': job.status,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error
+    }
+
+
+class SpeedTestQueue:
+    """Queue of speed test jobs kept in the database.
+
+    Any web process can queue a job or report its state, because both live
+    in the speed_test table. Jobs are only run by the process that calls
+    dispatch(), the job worker, so the global cap of max_concurrent tests
+    holds across every process; the server probe's run_exclusive() shares
+    the same slots. A device with a queued or running test gets that job
+    back instead of a new one, and a device whose last test was requested
+    less than cooldown seconds ago is rejected. Finished jobs are kept for
+    polling up to max_history.
+
+    submit(), get() and stats() use the caller's app context; jobs run in
+    contexts made by app_context.
+    """
+
+    def __init__(self, run_test, app_context, max_concurrent=1, max_queued=20, cooldown=600,
+                 on_update=None, max_history=500):
+        self.run_test = run_test
+        self.app_context = app_context
+        self.max_queued = max_queued
+        self.cooldown = cooldown
+        self.on_update = on_update
+        self.max_history = max_history
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='speedtest')
+        self.max_concurrent = max_concurrent
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+
+    def _active(self, device_id):
+        return SpeedTest.query.filter(
+            SpeedTest.device_id == device_id,
+            SpeedTest.status.in_(ACTIVE_STATUSES)
+        ).first()
+
+    def submit(self, device_id):
+        """Queue a test for a device and return its job"""
+        job = self._active(device_id)
+        if job is not None:
+            return job
+
+        now = datetime.utcnow()
+        last_requested = db.session.query(func.max(SpeedTest.created_at)).filter(
+            SpeedTest.device_id == device_id
+        ).scalar()
+        if last_requested is not None:
+            elapsed = (now - last_requested).total_seconds()
+            if elapsed < self.cooldown:
+                raise SpeedTestRejected('Speed test cooldown in effect', int(self.cooldown - elapsed) + 1)
+        if SpeedTest.query.filter_by(status='queued').count() >= self.max_queued:
+            raise SpeedTestRejected('Too many speed tests queued', 30)
+
+        job = SpeedTest(id=uuid.uuid4().hex, device_id=device_id, status='queued', created_at=now)
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another process queued a test for this device first
+            db.session.rollback()
+            job = self._active(device_id)
+            if job is None:
+                raise SpeedTestRejected('Speed test cooldown in effect', self.cooldown)
+            return job
+        self._notify(job)
+        return job
+
+    def get(self, job_id):
+        return SpeedTest.query.get(job_id)
+
+    def run_exclusive(self):
+        """Run a test synchronously, sharing the concurrency cap with queued jobs"""
+        with self.slots:
+            return self.run_test()
+
+    def dispatch(self):
+        """Claim queued jobs while slots are free and start them; returns how many.
+
+        A slot is taken before a job is marked running, so a job never waits
+        behind the server probe's run_exclusive() while reported as running.
+        """
+        started = []
+        with self.app_context():
+            while self.slots.acquire(blocking=False):
+                job = self._claim()
+                if job is None:
+                    self.slots.release()
+                    break
+                started.append(job.id)
+                self._notify(job)
+        for job_id in started:
+            self.executor.submit(self._run, job_id)
+        return len(started)
+
+    def _claim(self):
+        """Mark the oldest queued job running and return it, or None"""
+        while True:
+            job = SpeedTest.query.filter_by(status='queued').order_by(SpeedTest.created_at).first()
+            if job is None:
+                return None
+            # Only one dispatcher should run, but a job is claimed at most once anyway
+            claimed = SpeedTest.query.filter_by(id=job.id, status='queued').update(
+                {SpeedTest.status: 'running', SpeedTest.started_at: datetime.utcnow()},
+                synchronize_session=False
+            )
+            db.session.commit()
+            if claimed:
+                db.session.refresh(job)
+                return job
+
+    def recover(self):
+        """Fail jobs left running by a previous process; call before dispatching"""
+        with self.app_context():
+            interrupted = SpeedTest.query.filter_by(status='running').update({
+                SpeedTest.status: 'failed',
+                SpeedTest.error: 'Interrupted by a worker restart',
+                SpeedTest.finished_at: datetime.utcnow()
+            }, synchronize_session=False)
+            db.session.commit()
+        if interrupted:
+            logging.warning(f"Marked {interrupted} interrupted speed tests as failed")
+
+    def _run(self, job_id):
+        """Run a claimed job in the slot dispatch() took for it"""
+        try:
+            try:
+                result = self.run_test()
+                error = result.get('error')
+            except Exception as e:
+                result, error = None, str(e)
+            with self.app_context():
+                job = SpeedTest.query.get(job_id)
+                job.finished_at = datetime.utcnow()
+                if error is not None:
+                    job.status, job.error = 'failed', error
+                else:
+                    job.status, job.result = 'completed', json.dumps(result)
+                db.session.commit()
+                self._prune()
+                self._notify(job)
+        except Exception as e:
+            logging.error(f"Speed test job {job_id} could not be recorded: {str(e)}")
+        finally:
+            self.slots.release()
+
+    def _prune(self):
+        """Delete finished jobs beyond max_history, oldest first"""
+        cutoff = db.session.query(SpeedTest.created_at).order_by(
+            SpeedTest.created_at.desc()
+        ).offset(self.max_history).limit(1).scalar()
+        if cutoff is not None:
+            SpeedTest.query.filter(
+                SpeedTest.created_at <= cutoff,
+                SpeedTest.status.notin_(ACTIVE_STATUSES)
+            ).delete(synchronize_session=False)
+            db.session.commit()
+
+    def _notify(self, job):
+        if self.on_update is not None:
+            try:
+                self.on_update(job)
+            except Exception as e:
+                logging.error(f"Speed test update handler failed: {str(e)}")
+
+    def stats(self):
+        counts = dict(db.session.query(SpeedTest.status, func.count()).group_by(SpeedTest.status))
+        return {
+            'max_concurrent': self.max_concurrent,
+            'cooldown': self.cooldown,
+            'queued': counts.get('queued', 0),
+            'running': counts.get('running', 0),
+            'tracked_jobs': sum(counts.values())
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,111 @@
+import json
+import logging
+import sqlite3
+import threading
+
+
+class MetricsSpool:
+    """Append-only, crash-safe queue of metric samples backed by SQLite.
+
+    Samples are appended with a monotonically increasing sequence number
+    and drained oldest first. A drained batch stays on disk until ack() is
+    called with the sequence of its last sample, so samples that were read
+    but never confirmed are delivered again after a restart. When the
+    record or byte cap is exceeded the oldest samples are dropped.
+    """
+
+    def __init__(self, path, max_records=100, max_bytes=None):
+        self.path = path
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS spool ('
+            'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'payload TEXT NOT NULL, '
+            'size INTEGER NOT NULL)'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS spool_state ('
+            'id INTEGER PRIMARY KEY CHECK (id = 0), '
+            'acked INTEGER NOT NULL)'
+        )
+        self.conn.execute('INSERT OR IGNORE INTO spool_state (id, acked) VALUES (0, 0)')
+        self.count, self.bytes = self.conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool'
+        ).fetchone()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def acked(self):
+        """Sequence number of the last acknowledged sample"""
+        return self.conn.execute('SELECT acked FROM spool_state').fetchone()[0]
+
+    def append(self, sample):
+        """Persist a sample, dropping the oldest ones if the spool is full"""
+        payload = json.dumps(sample, separators=(',', ':'))
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.execute('INSERT INTO spool (payload, size) VALUES (?, ?)', (payload, len(payload)))
+                self.count += 1
+                self.bytes += len(payload)
+                dropped = self._enforce_limits()
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                self.count, self.bytes = self.conn.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool'
+                ).fetchone()
+                raise
+        if dropped:
+            logging.warning(f"Spool full, dropped {dropped} oldest metrics")
+
+    def _enforce_limits(self):
+        """Delete the oldest samples until both caps hold"""
+        dropped = 0
+        while self.count > 1 and (
+            (self.max_records is not None and self.count > self.max_records) or
+            (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            excess = max(1, self.count - self.max_records) if self.max_records is not None else 1
+            rows = self.conn.execute('SELECT seq, size FROM spool ORDER BY seq LIMIT ?', (excess,)).fetchall()
+            self.conn.execute('DELETE FROM spool WHERE seq <= ?', (rows[-1][0],))
+            self.count -= len(rows)
+            self.bytes -= sum(size for _, size in rows)
+            dropped += len(rows)
+        return dropped
+
+    def peek(self, limit):
+        """Return up to limit unacknowledged samples as (seq, sample) pairs"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT seq, payload FROM spool ORDER BY seq LIMIT ?', (limit,)
+            ).fetchall()
+        return [(seq, json.loads(payload)) for seq, payload in rows]
+
+    def ack(self, seq):
+        """Acknowledge every sample up to and including seq"""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                count, size = self.conn.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool WHERE seq <= ?', (seq,)
+                ).fetchone()
+                self.conn.execute('DELETE FROM spool WHERE seq <= ?', (seq,))
+                self.conn.execute('UPDATE spool_state SET acked = MAX(acked, ?)', (seq,))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.count -= count
+            self.bytes -= size
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,473 @@
+"""Storage backends for raw metric samples.
+
+The ingestion path, metric queries, export, analytics and retention read
+and write raw samples through a MetricsStore. SqlMetricsStore keeps them
+in the network_metrics table; ColumnarMetricsStore keeps them in
+append-only column files partitioned by day. Rollups and devices stay in
+the SQL database with either store. Select one with METRICS_STORE.
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import threading
+import numpy as np
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, func, text, and_, or_
+from models import NetworkMetrics
+
+if sys.platform == 'win32':
+    import msvcrt
+else:
+    import fcntl
+
+# Raw sample columns kept by every store
+STORE_FIELDS = ('latency', 'dns_resolution_time', 'download_speed', 'upload_speed')
+
+# Rows returned per chunk by scan()
+CHUNK_SIZE = 10000
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class MetricsStore(ABC):
+    """Raw samples of every device.
+
+    Rows are dicts with device_id, a naive UTC timestamp and any of
+    STORE_FIELDS; missing fields are stored as None. Every sample gets an
+    integer id that orders samples with equal timestamps.
+    """
+
+    name = None
+
+    @abstractmethod
+    def append(self, rows):
+        """Store new samples"""
+
+    @abstractmethod
+    def count(self, device_id, since, until):
+        """Number of samples of a device in [since, until)"""
+
+    @abstractmethod
+    def query(self, device_id, since, until, fields=STORE_FIELDS, after=None, limit=None):
+        """(id, timestamp, *fields) tuples of one device ordered by time and id.
+
+        after is a (timestamp, id) cursor; only samples ordered after it are
+        returned.
+        """
+
+    @abstractmethod
+    def scan(self, since=None, until=None, device_ids=None, fields=STORE_FIELDS, chunk_size=CHUNK_SIZE):
+        """Yield lists of (device_id, timestamp, *fields) tuples ordered by time.
+
+        since and until may be None for an open range. Memory use does not
+        grow with the number of samples scanned.
+        """
+
+    @abstractmethod
+    def read_column(self, field, since, until, device_ids=None):
+        """Arrays of device ids and values of one field, ordered by device and time.
+
+        Missing values are NaN.
+        """
+
+    @abstractmethod
+    def delete_device(self, device_id):
+        """Remove every sample of a device; returns how many went"""
+
+    @abstractmethod
+    def purge_before(self, cutoff):
+        """Remove samples older than cutoff; returns how many went"""
+
+    def stats(self):
+        return {'store': self.name}
+
+
+class SqlMetricsStore(MetricsStore):
+    """Samples in the network_metrics table.
+
+    append() and delete_device() only execute in the given session, so they
+    commit together with the caller's rollup and device changes.
+    purge_before() commits its own small batches.
+    """
+
+    name = 'sql'
+
+    # Rows deleted per transaction by purge_before() and purge_where(), and
+    # the pause between batches that lets ingestion take the write lock
+    batch_size = 5000
+    batch_pause = 0.05
+
+    # Rows fetched from the database cursor at a time by read_column()
+    column_chunk_size = 100000
+
+    def __init__(self, session):
+        self.session = session
+        self.table = NetworkMetrics.__table__
+
+    def _range(self, since, until):
+        conditions = []
+        if since is not None:
+            conditions.append(self.table.c.timestamp >= since)
+        if until is not None:
+            conditions.append(self.table.c.timestamp < until)
+        return conditions
+
+    def append(self, rows):
+        if rows:
+            self.session.execute(self.table.insert(), rows)
+
+    def count(self, device_id, since, until):
+        return self.session.execute(
+            select(func.count()).select_from(self.table).where(
+                self.table.c.device_id == device_id, *self._range(since, until)
+            )
+        ).scalar()
+
+    def query(self, device_id, since, until, fields=STORE_FIELDS, after=None, limit=None):
+        t = self.table
+        query = select(t.c.id, t.c.timestamp, *[t.c[field] for field in fields]).where(
+            t.c.device_id == device_id, *self._range(since, until)
+        ).order_by(t.c.timestamp, t.c.id)
+        if after is not None:
+            query = query.where(or_(
+                t.c.timestamp > after[0],
+                and_(t.c.timestamp == after[0], t.c.id > after[1])
+            ))
+        if limit is not None:
+            query = query.limit(limit)
+        return [tuple(row) for row in self.session.execute(query)]
+
+    def scan(self, since=None, until=None, device_ids=None, fields=STORE_FIELDS, chunk_size=CHUNK_SIZE):
+        t = self.table
+        query = select(t.c.device_id, t.c.timestamp, *[t.c[field] for field in fields]).where(
+            *self._range(since, until)
+        ).order_by(t.c.timestamp, t.c.id)
+        if device_ids:
+            query = query.where(t.c.device_id.in_(device_ids))
+        # A dedicated connection with a server-side cursor, so a scan can
+        # outlive the request session and never holds the whole result
+        with self.session.get_bind().connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(query)
+            for partition in result.partitions(chunk_size):
+                yield [tuple(row) for row in partition]
+
+    def read_column(self, field, since, until, device_ids=None):
+        t = self.table
+        query = select(t.c.device_id, t.c[field]).where(
+            *self._range(since, until)
+        ).order_by(t.c.device_id, t.c.timestamp)
+        if device_ids:
+            query = query.where(t.c.device_id.in_(device_ids))
+
+        parts = []
+        with self.session.get_bind().connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(query)
+            for partition in result.partitions(self.column_chunk_size):
+                # None becomes NaN in a float array; plain tuples convert much
+                # faster than Row objects
+                parts.append(np.array([tuple(row) for row in partition], dtype=np.float64).reshape(-1, 2))
+        data = np.concatenate(parts) if parts else np.zeros((0, 2))
+        return data[:, 0].astype(np.int64), data[:, 1]
+
+    def delete_device(self, device_id):
+        return self.session.execute(delete(self.table).where(self.table.c.device_id == device_id)).rowcount
+
+    def purge_before(self, cutoff):
+        return self.purge_where(self.table.name, 'timestamp < :cutoff', {'cutoff': cutoff})
+
+    def purge_where(self, table, condition, params):
+        """Delete rows matching condition from a table with an id column in
+        committed batches; retention purges the rollups with it too"""
+        purged = 0
+        statement = text(
+            f'DELETE FROM {table} WHERE id IN '
+            f'(SELECT id FROM {table} WHERE {condition} LIMIT :batch_size)'
+        )
+        while True:
+            deleted = self.session.execute(statement, dict(params, batch_size=self.batch_size)).rowcount
+            self.session.commit()
+            purged += deleted
+            if deleted < self.batch_size:
+                return purged
+            time.sleep(self.batch_pause)
+
+
+# Column files of a columnar partition and their little-endian types;
+# timestamps are microseconds since the epoch, missing metrics are NaN
+COLUMN_TYPES = {
+    'device_id': '<i8',
+    'timestamp': '<i8',
+    **{field: '<f8' for field in STORE_FIELDS}
+}
+
+# Device id written over the samples of a deleted device
+DELETED_DEVICE = -1
+
+
+def _micros(timestamp):
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def _datetimes(micros):
+    return micros.astype('datetime64[us]').astype(object).tolist()
+
+
+def _values(column):
+    return np.where(np.isnan(column), None, column).tolist()
+
+
+class ColumnarMetricsStore(MetricsStore):
+    """Append-only column files, one directory per UTC day.
+
+    Each day holds one file per column of fixed-width values. An append
+    writes every column to the end of its file while holding a lock shared
+    with other processes; readers take no lock, memory-map the files and
+    filter them with numpy. Readers only use the rows present in every
+    column, and the next append truncates the remains of one that was
+    interrupted. A sample's id is its day number and its position within
+    the day, so ids never change.
+
+    Appends are durable once written but are not part of the SQL
+    transaction that updates the rollups. Retention drops whole days, so
+    raw samples may be kept up to a day longer than configured. A deleted
+    device's samples are overwritten with DELETED_DEVICE and their space
+    is reclaimed when their day is dropped.
+    """
+
+    name = 'columnar'
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        """Serialize writers across threads and processes.
+
+        The lock file is opened on every use: flock() locks belong to the
+        open file, which forked web workers would otherwise share.
+        """
+        with self.lock, open(os.path.join(self.path, '.lock'), 'a+b') as f:
+            if sys.platform == 'win32':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            else:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if sys.platform == 'win32':
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _directory(self, day):
+        return os.path.join(self.path, (EPOCH + timedelta(days=day)).strftime('%Y-%m-%d'))
+
+    def _partitions(self, since=None, until=None):
+        """(day number, directory) of every day overlapping [since, until), oldest first"""
+        first = (since - EPOCH).days if since is not None else None
+        last = (until - timedelta(microseconds=1) - EPOCH).days if until is not None else None
+        partitions = []
+        for name in os.listdir(self.path):
+            try:
+                day = (datetime.strptime(name, '%Y-%m-%d') - EPOCH).days
+            except ValueError:
+                continue
+            if (first is None or day >= first) and (last is None or day <= last):
+                partitions.append((day, os.path.join(self.path, name)))
+        return sorted(partitions)
+
+    def _length(self, directory):
+        """Rows completely written to every column of a partition"""
+        lengths = []
+        for column in COLUMN_TYPES:
+            try:
+                lengths.append(os.path.getsize(os.path.join(directory, column)) // 8)
+            except OSError:
+                return 0
+        return min(lengths)
+
+    def _open(self, directory, columns, mode='r'):
+        """Memory-map columns of a partition; None when it is empty"""
+        length = self._length(directory)
+        if not length:
+            return None
+        return {
+            column: np.memmap(os.path.join(directory, column), dtype=COLUMN_TYPES[column], mode=mode, shape=(length,))
+            for column in columns
+        }
+
+    def _mask(self, data, since, until, device_ids):
+        device_column = data['device_id']
+        if device_ids is None:
+            mask = device_column != DELETED_DEVICE
+        elif len(device_ids) == 1:
+            mask = device_column == device_ids[0]
+        else:
+            mask = np.isin(device_column, device_ids)
+        if since is not None:
+            mask &= data['timestamp'] >= _micros(since)
+        if until is not None:
+            mask &= data['timestamp'] < _micros(until)
+        return mask
+
+    def _select(self, since, until, device_ids, fields):
+        """Yield matching columns of each day in time and id order"""
+        for day, directory in self._partitions(since, until):
+            data = self._open(directory, ['device_id', 'timestamp', *fields])
+            if data is None:
+                continue
+            index = np.flatnonzero(self._mask(data, since, until, device_ids))
+            if not len(index):
+                continue
+            # Positions are ascending, so a stable sort on time keeps id order
+            index = index[np.argsort(data['timestamp'][index], kind='stable')]
+            selected = {column: values[index] for column, values in data.items()}
+            selected['id'] = (day << 32) + index
+            yield selected
+
+    def append(self, rows):
+        by_day = defaultdict(list)
+        for row in rows:
+            by_day[(row['timestamp'] - EPOCH).days].append(row)
+        for day, day_rows in sorted(by_day.items()):
+            columns = {
+                'device_id': np.array([row['device_id'] for row in day_rows], dtype='<i8'),
+                'timestamp': np.array([_micros(row['timestamp']) for row in day_rows], dtype='<i8'),
+                **{field: np.array([row.get(field) for row in day_rows], dtype='<f8') for field in STORE_FIELDS}
+            }
+            directory = self._directory(day)
+            with self._locked():
+                os.makedirs(directory, exist_ok=True)
+                length = self._length(directory)
+                for column, values in columns.items():
+                    with open(os.path.join(directory, column), 'ab') as f:
+                        f.truncate(length * 8)
+                        f.write(values.tobytes())
+
+    def count(self, device_id, since, until):
+        total = 0
+        for _, directory in self._partitions(since, until):
+            data = self._open(directory, ['device_id', 'timestamp'])
+            if data is not None:
+                total += int(np.count_nonzero(self._mask(data, since, until, [device_id])))
+        return total
+
+    def query(self, device_id, since, until, fields=STORE_FIELDS, after=None, limit=None):
+        rows = []
+        for selected in self._select(since, until, [device_id], fields):
+            if after is not None:
+                after_micros = _micros(after[0])
+                keep = (selected['timestamp'] > after_micros) | (
+                    (selected['timestamp'] == after_micros) & (selected['id'] > after[1])
+                )
+                selected = {column: values[keep] for column, values in selected.items()}
+            if limit is not None:
+                selected = {column: values[:limit - len(rows)] for column, values in selected.items()}
+            rows.extend(zip(
+                selected['id'].tolist(),
+                _datetimes(selected['timestamp']),
+                *[_values(selected[field]) for field in fields]
+            ))
+            if limit is not None and len(rows) >= limit:
+                break
+        return rows
+
+    def scan(self, since=None, until=None, device_ids=None, fields=STORE_FIELDS, chunk_size=CHUNK_SIZE):
+        for selected in self._select(since, until, device_ids or None, fields):
+            for start in range(0, len(selected['id']), chunk_size):
+                end = start + chunk_size
+                yield list(zip(
+                    selected['device_id'][start:end].tolist(),
+                    _datetimes(selected['timestamp'][start:end]),
+                    *[_values(selected[field][start:end]) for field in fields]
+                ))
+
+    def read_column(self, field, since, until, device_ids=None):
+        devices, timestamps, values = [], [], []
+        for _, directory in self._partitions(since, until):
+            data = self._open(directory, ['device_id', 'timestamp', field])
+            if data is None:
+                continue
+            mask = self._mask(data, since, until, device_ids or None)
+            devices.append(data['device_id'][mask])
+            timestamps.append(data['timestamp'][mask])
+            values.append(data[field][mask])
+        if not devices:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        devices = np.concatenate(devices)
+        order = np.lexsort((np.concatenate(timestamps), devices))
+        return devices[order].astype(np.int64), np.concatenate(values)[order].astype(np.float64)
+
+    def delete_device(self, device_id):
+        deleted = 0
+        with self._locked():
+            for _, directory in self._partitions():
+                data = self._open(directory, ['device_id'], mode='r+')
+                if data is None:
+                    continue
+                matches = data['device_id'] == device_id
+                count = int(np.count_nonzero(matches))
+                if count:
+                    data['device_id'][matches] = DELETED_DEVICE
+                    data['device_id'].flush()
+                deleted += count
+        return deleted
+
+    def purge_before(self, cutoff):
+        purged = 0
+        with self._locked():
+            for day, directory in self._partitions(until=cutoff):
+                if EPOCH + timedelta(days=day + 1) > cutoff:
+                    continue
+                rows = self._length(directory)
+                try:
+                    shutil.rmtree(directory)
+                except OSError as e:
+                    # Windows refuses while a reader still has the files mapped
+                    logging.warning(f"Could not remove partition {directory}: {e}")
+                    continue
+                purged += rows
+        return purged
+
+    def stats(self):
+        partitions = self._partitions()
+        return {
+            'store': self.name,
+            'path': self.path,
+            'partitions': len(partitions),
+            'rows': sum(self._length(directory) for _, directory in partitions),
+            'bytes': sum(
+                os.path.getsize(os.path.join(directory, column))
+                for _, directory in partitions for column in COLUMN_TYPES
+                if os.path.exists(os.path.join(directory, column))
+            ),
+            'oldest_day': os.path.basename(partitions[0][1]) if partitions else None,
+            'newest_day': os.path.basename(partitions[-1][1]) if partitions else None
+        }
+
+
+def create_store(kind, session, path):
+    """Store of the given kind; session is used by the SQL store, path by the columnar one"""
+    if kind == 'sql':
+        return SqlMetricsStore(session)
+    if kind == 'columnar':
+        return ColumnarMetricsStore(path)
+    raise ValueError(f"Unknown metrics store {kind}; expected sql or columnar")
+
+
+def create_store_from_env(session, default_path):
+    """Store selected by METRICS_STORE (sql or columnar) and METRICS_STORE_PATH"""
+    return create_store(
+        os.getenv('METRICS_STORE', 'sql').strip().lower() or 'sql',
+        session,
+        os.getenv('METRICS_STORE_PATH') or default_path
+    )
@@ -5,8 +5,6 @@ import sys
 import threading
 import logging
 from io import BytesIO
-import win32gui
-import win32con
 
 class SystemTrayIcon:
     def __init__(self, agent):
@@ -77,7 +75,11 @@ class SystemTrayIcon:
             self.icon.update_menu()
     
     def hide_console_window(self):
+        if sys.platform != 'win32':
+            return
         try:
+            import win32gui
+            import win32con
             # Find and hide the console window
             hwnd = win32gui.GetForegroundWindow()
             if hwnd:
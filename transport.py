@@ -0,0 +1,88 @@
+import json
+import time
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from compression import compress, ZSTD_AVAILABLE
+
+
+class AgentTransport:
+    """Long-lived HTTP session used by the agent for every upload.
+
+    Connections to the cloud endpoint are kept alive and reused, and JSON
+    bodies are compressed before sending. Every server accepts gzip; with
+    zstd, a server that answers 415 Unsupported Media Type gets the
+    request again in gzip, and so does every later request. The transport
+    keeps byte, request and connection counters so the cost per sample can
+    be reported with stats().
+    """
+
+    def __init__(self, base_url, api_key='', user_agent='NetworkAgent', encoding='gzip', pool_size=2):
+        self.base_url = base_url.rstrip('/')
+        if encoding == 'zstd' and not ZSTD_AVAILABLE:
+            logging.warning("zstandard is not installed; compressing uploads with gzip")
+            encoding = 'gzip'
+        self.encoding = encoding
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'User-Agent': user_agent
+        })
+        if api_key:
+            self.session.headers['Authorization'] = f'Bearer {api_key}'
+
+        self.started = time.monotonic()
+        self.requests = 0
+        self.samples = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def post(self, path, payload, samples=0, timeout=10):
+        """POST a JSON payload and return the response, raising on HTTP errors"""
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        response = self._send(path, body, timeout)
+        if response.status_code == 415 and self.encoding not in ('gzip', 'identity'):
+            logging.warning(f"Server does not accept {self.encoding} request bodies; switching to gzip")
+            self.encoding = 'gzip'
+            response = self._send(path, body, timeout)
+        self.samples += samples
+        response.raise_for_status()
+        return response
+
+    def _send(self, path, body, timeout):
+        data = compress(body, self.encoding)
+        headers = {}
+        if self.encoding != 'identity':
+            headers['Content-Encoding'] = self.encoding
+
+        response = self.session.post(f'{self.base_url}{path}', data=data, headers=headers, timeout=timeout)
+        self.requests += 1
+        self.raw_bytes += len(body)
+        self.sent_bytes += len(data)
+        return response
+
+    def connections(self):
+        """Number of TCP (and TLS) connections opened so far"""
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def stats(self):
+        """Upload cost counters since the transport was created"""
+        hours = max(time.monotonic() - self.started, 1) / 3600
+        handshakes = self.connections()
+        return {
+            'requests': self.requests,
+            'samples': self.samples,
+            'raw_bytes': self.raw_bytes,
+            'sent_bytes': self.sent_bytes,
+            'bytes_per_sample': round(self.sent_bytes / self.samples, 1) if self.samples else None,
+            'compression_ratio': round(self.raw_bytes / self.sent_bytes, 2) if self.sent_bytes else None,
+            'handshakes': handshakes,
+            'handshakes_per_hour': round(handshakes / hours, 2)
+        }
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,32 @@
+"""Background job runner for production deployments.
+
+Runs the scheduled jobs of app.py (server probe, compaction, heartbeat
+sweep) and every queued speed test in their own process so web workers
+started by serve.py do not each run a copy. It also evaluates every alert
+rule, on samples the web processes relay through the database, and keeps
+the active_alert table they answer /api/alerts from. Events these jobs
+raise, such as a device going offline, reach dashboards through the web
+processes. Start exactly one per database.
+"""
+import signal
+import logging
+import threading
+from app import scheduler, start_background_jobs
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stopping.set())
+
+    start_background_jobs(relay=True)
+    logging.info("Background jobs started")
+    while not stopping.wait(60):
+        logging.info(f"Scheduler stats: {scheduler.stats()}")
+    logging.info("Stopping background jobs")
+    scheduler.stop(wait=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+"""WSGI entry point for external servers, e.g. `gunicorn wsgi:app`.
+
+Background jobs are not started; run worker.py alongside.
+"""
+from app import app
+
+application = app